@@ -1,14 +1,30 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-from .models import Product, Order, OrderItem, Address, Payment, User
+from .models import Product, Order, OrderItem, Address, OutboxEmail, Payment, PaymentNotification, User
 from .forms import CustomUserChangeForm, CustomUserCreationForm
 
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('id', 'order', 'amount', 'status', 'refund')
 
+class PaymentNotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'payment', 'status', 'outcome', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status',)
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'key', 'to', 'subject', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('key', 'to')
+
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'placement_date', 'is_active')
+    list_display = ('id', 'user', 'placement_date', 'is_active', 'total')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    def total(self, obj):
+        return obj.total
+    total.admin_order_field = 'total'
 
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'order')
@@ -17,7 +33,8 @@ class AddressAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'user')
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'category', 'price', 'publish_date')
+    list_display = ('id', 'sku', 'title', 'category', 'price', 'publish_date')
+    search_fields = ('sku', 'title')
 
 class UserAdmin(BaseUserAdmin):
     form = CustomUserChangeForm
@@ -44,4 +61,6 @@ admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Address, AddressAdmin)
 admin.site.register(Payment, PaymentAdmin)
+admin.site.register(PaymentNotification, PaymentNotificationAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
 admin.site.register(User, UserAdmin)
@@ -0,0 +1,21 @@
+from django.urls import path
+
+from . import async_views, urls
+
+# The URL names of core.urls that have an async view
+ASYNC_VIEWS = {
+    'index': async_views.index,
+    'search': async_views.search,
+    'product-detail': async_views.product_detail,
+    'cart': async_views.view_cart,
+    'cart-add': async_views.add_to_cart,
+    'cart-remove': async_views.remove_from_cart,
+    'cart-remove-single': async_views.remove_single_from_cart,
+}
+
+app_name = 'core'
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if getattr(pattern, 'name', None) in ASYNC_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
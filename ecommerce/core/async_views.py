@@ -0,0 +1,110 @@
+"""
+Async versions of the catalog and cart views, served by core.async_urls
+under the ecommerce.settings_asgi profile.
+
+Django 3.1 has no async ORM, so anything that touches the database, the
+session or request.user is wrapped with db(), which runs it in a thread
+pool of ASYNC_DB_THREADS threads. A burst of connections then waits on the
+event loop for a pool thread, instead of every request holding a thread.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import close_old_connections
+from django.shortcuts import redirect, render as render_sync
+
+from . import views
+
+_executor = None
+_executor_size = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The shared pool for db(), or None when ASYNC_DB_THREADS is 0."""
+    global _executor, _executor_size
+    size = settings.ASYNC_DB_THREADS
+    if not size:
+        return None
+    with _executor_lock:
+        if _executor_size != size:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(size, thread_name_prefix='async-db')
+            _executor_size = size
+        return _executor
+
+
+def reset_executor():
+    global _executor, _executor_size
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = _executor_size = None
+
+
+def _run_in_pool(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    finally:
+        # The pool threads never see request_finished, expire their connections like it does
+        close_old_connections()
+
+
+def db(function):
+    """
+    Wrap a synchronous function that uses the database into a coroutine
+    function running it in the pool. Without a pool it runs in the main
+    thread, like Django runs sync views, which is what tests need to see
+    their transaction.
+    """
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        executor = get_executor()
+        if executor is None:
+            return await sync_to_async(function)(*args, **kwargs)
+        return await sync_to_async(_run_in_pool, thread_sensitive=False, executor=executor)(function, args, kwargs)
+    return wrapper
+
+
+# Rendering runs the context processors and evaluates request.user
+render = db(render_sync)
+
+
+async def index(request):
+    context = await db(views.index_context)(request)
+    return await render(request, "core/home.html", context)
+
+
+async def search(request):
+    context = await db(views.search_context)(request)
+    return await render(request, "core/home.html", context)
+
+
+async def product_detail(request, product_id):
+    context = await db(views.product_detail_context)(request, product_id)
+    return await render(request, "core/product_detail.html", context)
+
+
+async def view_cart(request):
+    context = await db(views.cart_context)(request)
+    return await render(request, "core/cart.html", context)
+
+
+async def add_to_cart(request, product_id, redirect_url):
+    messages.success(request, await db(views.add_item)(request, product_id))
+    return views.cart_redirect(product_id, redirect_url)
+
+
+async def remove_from_cart(request, product_id):
+    messages.success(request, await db(views.remove_item)(request, product_id))
+    return redirect('core:cart')
+
+
+async def remove_single_from_cart(request, product_id):
+    messages.success(request, await db(views.remove_item)(request, product_id, single=True))
+    return redirect('core:cart')
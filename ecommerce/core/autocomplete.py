@@ -0,0 +1,153 @@
+import bisect
+import heapq
+import threading
+
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from .models import CatalogVersion, Product
+from .trigram import words
+
+# Sorts after any character that can follow a prefix
+MAX_CHAR = '\U0010ffff'
+
+
+class PrefixIndex:
+    """
+    Sorted array of title suffixes for search-as-you-type. Every title is
+    stored once per word it contains, starting at that word, so typing any
+    word of a title finds it. A prefix lookup is two bisections plus picking
+    the most popular titles in the matching range. Results are cached per
+    prefix until a title with that prefix changes.
+    """
+    MAX_CACHED_PREFIXES = 50000
+
+    def __init__(self):
+        self.entries = []
+        self.titles = {}
+        self.weights = {}
+        self.cache = {}
+        # The titles version (see CatalogVersion) the index is in step with
+        self.version = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.titles)
+
+    @staticmethod
+    def keys(title):
+        title_words = words(title)
+        return [(' '.join(title_words[i:]), i) for i in range(len(title_words))]
+
+    def add(self, pk, title, weight=None):
+        with self.lock:
+            self.remove(pk, keep_weight=True)
+            self.titles[pk] = title
+            self.weights[pk] = weight if weight is not None else self.weights.get(pk, 0)
+            for key, position in self.keys(title):
+                bisect.insort(self.entries, (key, position, pk))
+            self._invalidate(title)
+
+    def remove(self, pk, keep_weight=False):
+        with self.lock:
+            title = self.titles.pop(pk, None)
+            if title is None:
+                return
+            for key, position in self.keys(title):
+                i = bisect.bisect_left(self.entries, (key, position, pk))
+                if i < len(self.entries) and self.entries[i] == (key, position, pk):
+                    del self.entries[i]
+            if not keep_weight:
+                self.weights.pop(pk, None)
+            self._invalidate(title)
+
+    def bulk_load(self, rows):
+        """Replace the contents with (pk, title, weight) rows."""
+        with self.lock:
+            self.titles = {pk: title for pk, title, weight in rows}
+            self.weights = {pk: weight for pk, title, weight in rows}
+            self.entries = sorted(
+                (key, position, pk)
+                for pk, title in self.titles.items()
+                for key, position in self.keys(title)
+            )
+            self.cache.clear()
+
+    def complete(self, prefix, limit=10):
+        """Return up to `limit` (product id, title) pairs whose title has a word starting with prefix."""
+        prefix = ' '.join(words(prefix))
+        if not prefix:
+            return []
+        with self.lock:
+            cached = self.cache.get(prefix)
+            if cached is None or cached[0] < limit:
+                cached = (limit, self._complete(prefix, limit))
+                if len(self.cache) >= self.MAX_CACHED_PREFIXES:
+                    self.cache.clear()
+                self.cache[prefix] = cached
+        return cached[1][:limit]
+
+    def _complete(self, prefix, limit):
+        lo = bisect.bisect_left(self.entries, (prefix,))
+        hi = bisect.bisect_left(self.entries, (prefix + MAX_CHAR,), lo)
+        entries, weights = self.entries, self.weights
+        # Most popular first, then titles that start with the prefix. A title can
+        # match at more than one word, so take a few spare entries for duplicates.
+        # The range is read in place, a short prefix can match most of the entries.
+        size = limit * 3
+        while True:
+            matches = map(entries.__getitem__, range(lo, hi))
+            top = heapq.nlargest(size, matches, key=lambda entry: (weights[entry[2]], entry[1] == 0))
+            results = {}
+            for key, position, pk in top:
+                results.setdefault(pk, self.titles[pk])
+            if len(results) >= limit or len(top) < size:
+                return list(results.items())[:limit]
+            size *= 4
+
+    def _invalidate(self, title):
+        # Only cached prefixes of this title's keys can have changed
+        for key, position in self.keys(title):
+            for i in range(1, len(key) + 1):
+                self.cache.pop(key[:i].rstrip(), None)
+
+    @classmethod
+    def from_database(cls):
+        index = cls()
+        # Taken before reading the titles, so a change made meanwhile shows as a new version
+        index.version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        # Popularity is the number of units of the product that have been added to orders
+        rows = Product.objects.annotate(
+            popularity=Coalesce(Sum('orderitem__quantity'), 0),
+        ).values_list('id', 'title', 'popularity')
+        index.bulk_load(list(rows.iterator(chunk_size=5000)))
+        return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_autocomplete_index():
+    """
+    Return the process wide prefix index, building it from the database on
+    first use. Product signals keep it up to date with changes made in this
+    process, and it is built again when the titles version shows another
+    process changed a title.
+    """
+    global _index
+    version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = PrefixIndex.from_database()
+            index = _index
+    return index
+
+def loaded_autocomplete_index():
+    """Return the index if it has been built in this process, else None."""
+    return _index
+
+def reset_autocomplete_index():
+    global _index
+    _index = None
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+from itertools import count
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.template.loader import render_to_string
+from django.test.client import RequestFactory
+
+from . import payfast, signals
+from .benchmarks import Benchmark
+from .cart import SESSION_ORDER_KEY
+from .catalog_cache import catalog_cache_context, product_card_key
+from .forms import AddressForm, RegisterForm
+from .models import Address, Order, OrderItem, Payment, Product, User
+from .pagination import KeysetPage
+
+ADDRESS_DATA = {
+    'name': 'Benchmark customer',
+    'country': 'ZA',
+    'province': 'WC',
+    'zip_code': '8001',
+    'city': 'Cape Town',
+    'suburb': 'Gardens',
+    'street_address': '1 Main Road',
+    'mobile_number': '0821234567',
+    'is_billing': True,
+    'is_shipping': True,
+}
+
+
+# Product receivers with effects the runner's rollback doesn't undo: the
+# in-memory search indexes of this process and the image storage
+MUTED_RECEIVERS = [
+    (post_save, Product, signals.process_image),
+    (post_save, Product, signals.index_product),
+]
+
+
+@contextmanager
+def muted_receivers():
+    for signal, sender, receiver in MUTED_RECEIVERS:
+        signal.disconnect(receiver, sender=sender)
+    try:
+        yield
+    finally:
+        for signal, sender, receiver in MUTED_RECEIVERS:
+            signal.connect(receiver, sender=sender)
+
+
+class Fixtures:
+    """The rows the benchmarks work on. Created inside the runner's transaction."""
+    def __init__(self):
+        with muted_receivers():
+            self.create()
+
+    def create(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('benchmark-user@example.com', 'benchmark-password')
+        self.products = [
+            Product.objects.create(
+                sku=f'benchmark-{i}', title=f'Benchmark product {i}',
+                description='Benchmark product description', price=10 + i, category='CP',
+            )
+            for i in range(24)
+        ]
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.bulk_create(OrderItem(order=self.order, item=product, quantity=2) for product in self.products[:10])
+        self.guest_order = Order.objects.create()
+        self.address = Address.objects.create(user=self.user, **ADDRESS_DATA)
+        self.payment = Payment.objects.create(amount=self.order.total_price, address=self.address, order=self.order)
+
+    def request(self, user, session=None):
+        request = self.factory.get('/')
+        request.user = user
+        request.session = session if session is not None else SessionStore()
+        return request
+
+
+def get_benchmarks(fixtures):
+    """Every benchmark of the suite, by name."""
+    f = fixtures
+
+    def new_or_get(request):
+        Order.objects.new_or_get(request)
+
+    def guest_request():
+        session = SessionStore()
+        session[SESSION_ORDER_KEY] = f.guest_order.pk
+        return (f.request(AnonymousUser(), session),)
+
+    versions = count()
+
+    def render_home(context, request, cold):
+        if cold:
+            # A new version misses the cached page, and the cards are dropped, without touching other cache entries
+            context['catalog_version'] = f'benchmark-{next(versions)}'
+            cache.delete_many([product_card_key(product) for product in context['products']])
+        render_to_string('core/home.html', context, request)
+
+    def home_context(cold):
+        request = f.request(f.user)
+        products = KeysetPage(list(Product.objects.select_related('rating').filter(sku__startswith='benchmark-').order_by('-id')))
+        context = {'products': products, 'page': products, 'user': f.user, **catalog_cache_context(products)}
+        return context, request, cold
+
+    def render_cart(context, request):
+        render_to_string('core/cart.html', context, request)
+
+    def cart_context():
+        order_items = list(OrderItem.objects.for_cart(f.order))
+        return {'order_items': order_items, 'order_total': f.order.total_price}, f.request(f.user)
+
+    benchmarks = [
+        Benchmark('order.total_price', lambda order: order.total_price, lambda: (f.order,)),
+        Benchmark('order.new_or_get.user', new_or_get, lambda: (f.request(f.user),)),
+        Benchmark('order.new_or_get.guest', new_or_get, guest_request),
+        Benchmark('form.address.valid', lambda: AddressForm(ADDRESS_DATA).is_valid()),
+        Benchmark('form.address.invalid', lambda: AddressForm({**ADDRESS_DATA, 'mobile_number': '082'}).is_valid()),
+        Benchmark('form.register.valid', lambda: RegisterForm({
+            'email': 'new-benchmark-user@example.com',
+            'password': 'benchmark-password',
+            'password_confirm': 'benchmark-password',
+        }).is_valid()),
+        # Cold renders every fragment, warm is served from the fragment cache
+        Benchmark('template.home.cold', render_home, lambda: home_context(cold=True)),
+        Benchmark('template.home.warm', render_home, lambda: home_context(cold=False)),
+        Benchmark('template.cart', render_cart, cart_context),
+        Benchmark('payfast.signature', payfast.signature, lambda: ({
+            key: value for key, value in payfast.payment_data(f.payment, f.address).items() if key != 'signature'
+        },)),
+        Benchmark('payfast.payment_data', payfast.payment_data, lambda: (f.payment, f.address)),
+    ]
+    return {benchmark.name: benchmark for benchmark in benchmarks}
@@ -0,0 +1,73 @@
+import math
+import statistics
+import time
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of `values`, which must be sorted."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(len(values) * percent / 100), 1)
+    return values[rank - 1]
+
+
+def latency_summary(timings):
+    """Count, mean and the usual percentiles of a list of timings."""
+    timings = sorted(timings)
+    return {
+        'count': len(timings),
+        'mean': statistics.fmean(timings) if timings else 0.0,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'max': timings[-1] if timings else 0.0,
+    }
+
+
+class Benchmark:
+    """
+    A function to time. `setup` is called once before timing and returns the
+    arguments the function is called with, so fixtures don't count.
+    """
+    def __init__(self, name, function, setup=None):
+        self.name = name
+        self.function = function
+        self.setup = setup
+
+    def run(self, rounds=7, min_time=0.05):
+        args = self.setup() if self.setup else ()
+        function = self.function
+        # Calibrate the number of calls per round so a round lasts at least min_time
+        loops = 1
+        while True:
+            elapsed = self.time(function, args, loops)
+            if elapsed >= min_time:
+                break
+            loops *= 2
+        timings = [elapsed / loops * 1000] + [
+            self.time(function, args, loops) / loops * 1000 for _ in range(rounds - 1)
+        ]
+        return {'loops': loops, 'rounds': rounds, **latency_summary(timings), 'min': min(timings)}
+
+    @staticmethod
+    def time(function, args, loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function(*args)
+        return time.perf_counter() - start
+
+
+def compare(previous, current, threshold):
+    """
+    Compare two runs by median time per call. Returns (name, previous,
+    current, change, regressed) for every benchmark in both runs, where change
+    is a fraction and regressed tells whether it is more than `threshold`.
+    """
+    changes = []
+    for name, result in current.items():
+        if name not in previous:
+            continue
+        old, new = previous[name]['p50'], result['p50']
+        change = (new - old) / old if old else 0.0
+        changes.append((name, old, new, change, change > threshold))
+    return changes
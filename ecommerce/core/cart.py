@@ -0,0 +1,538 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from .models import Order, OrderItem, Product, order_total
+from .resp import RESPClient, RESPError
+
+SESSION_ORDER_KEY = 'order_id'
+# The guest cart of the key-value backends
+SESSION_CART_KEY = 'cart_token'
+# The cart badge's summary, with the id of the cart it describes
+SESSION_SUMMARY_KEY = 'cart_summary'
+EMPTY_CART_SUMMARY = {'count': 0, 'total': 0}
+
+
+def remember_cart(request, order):
+    request.session[SESSION_ORDER_KEY] = order.id
+
+
+def adopt_guest_order(order, user):
+    """Hand a guest order to `user` and return the order that is now the user's cart."""
+    try:
+        with transaction.atomic():
+            # Only claim the guest order if nobody else has in the meantime
+            Order.objects.filter(pk=order.pk, user__isnull=True).update(user=user)
+    except IntegrityError:
+        # A concurrent request gave the user an active order first
+        return Order.objects.get(user=user, is_active=True)
+    order.user = user
+    return order
+
+
+def merge_guest_order(guest, order):
+    """
+    Move the items of the guest order `guest` into `order`, adding up the
+    quantities of products that are in both, and delete the guest order. The
+    number of statements doesn't depend on the number of items. Returns False
+    if another request merged or adopted the guest order first.
+    """
+    guest_items = OrderItem.objects.filter(order=guest)
+    with transaction.atomic():
+        # Claiming the guest order first makes a concurrent merge of it wait for this one, and then find nothing
+        if not Order.objects.filter(pk=guest.pk, user__isnull=True, is_active=True).update(is_active=False):
+            return False
+        OrderItem.objects.filter(order=order, item__in=guest_items.values('item')).update(
+            quantity=F('quantity') + Subquery(guest_items.filter(item=OuterRef('item')).values('quantity')[:1]),
+        )
+        guest_items.exclude(item__in=OrderItem.objects.filter(order=order).values('item')).update(order=order)
+        # Deletes the items that were added up as well
+        Order.objects.filter(pk=guest.pk).delete()
+    return True
+
+
+def create_user_order(user):
+    """
+    Create the active order of a user who had none, and return (order, True),
+    or (order, False) with the one a concurrent request created first.
+    """
+    try:
+        with transaction.atomic():
+            return Order.objects.create(user=user), True
+    except IntegrityError:
+        # order_one_active_per_user only lets one of the requests create it
+        return Order.objects.get(user=user, is_active=True), False
+
+
+def resolve_cart(request, create=True):
+    """
+    Return (order, created) for the active order that acts as the request's
+    cart, creating one if there is none and `create` is set, else (None, False).
+
+    A signed in user's active order wins over a guest order in the session, and
+    a guest order in the session is adopted by a user without an active order.
+    Resolving costs a single query on an indexed column unless an order has to
+    be created or adopted.
+    """
+    order_id = request.session.get(SESSION_ORDER_KEY)
+    user = request.user
+    order = None
+    changed = False
+
+    if user.is_authenticated:
+        # is_active is repeated in both branches so each can use the active order index
+        condition = Q(user=user, is_active=True)
+        if order_id is not None:
+            condition |= Q(pk=order_id, user__isnull=True, is_active=True)
+        candidates = list(Order.objects.filter(condition).order_by('id')[:2])
+        # Prefer the user's own active order over a guest order
+        candidates.sort(key=lambda candidate: candidate.user_id is None)
+        if candidates:
+            order = candidates[0]
+            if order.user_id is None:
+                order = adopt_guest_order(order, user)
+                changed = True
+    elif order_id is not None:
+        order = Order.objects.filter(pk=order_id, user__isnull=True, is_active=True).first()
+
+    created = False
+    if order is None:
+        if not create:
+            return None, False
+        if user.is_authenticated:
+            order, created = create_user_order(user)
+        else:
+            order = Order.objects.create()
+            created = True
+
+    # Writing the session marks it as modified, so only do it when the id changes
+    if changed or created or request.session.get(SESSION_ORDER_KEY) != order.id:
+        remember_cart(request, order)
+    return order, created
+
+
+class CartItem:
+    """A product and its quantity in a cart that isn't stored as OrderItem rows."""
+    def __init__(self, item, quantity):
+        self.item = item
+        self.quantity = quantity
+
+    @property
+    def total_price(self):
+        return self.quantity * self.item.price
+
+
+class BaseCartBackend:
+    """
+    A cart backend stores the request's cart, and turns it into the signed in
+    user's active order at checkout. Cart items have `item`, `quantity` and
+    `total_price` like OrderItem.
+    """
+    def contents(self, request):
+        """Return (items, total) of the request's cart."""
+        raise NotImplementedError
+
+    def add(self, request, product):
+        """Add one of `product` and return True if it wasn't in the cart yet."""
+        raise NotImplementedError
+
+    def remove_one(self, request, product):
+        """
+        Remove one of `product`. Return True if that removed the item from the
+        cart, False if only its quantity went down and None if it isn't in the cart.
+        """
+        raise NotImplementedError
+
+    def remove_all(self, request, product):
+        """Remove `product` and return False if it wasn't in the cart."""
+        raise NotImplementedError
+
+    def checkout_order(self, request):
+        """The user's active order holding the cart's items, or None if the cart is empty."""
+        raise NotImplementedError
+
+    def forget(self, order):
+        """Drop the cart of an order that has been placed."""
+        raise NotImplementedError
+
+    def merge_guest_cart(self, request, user):
+        """
+        Add the guest cart of the session `user` just signed in with to the
+        user's cart, and store the summary of the user's cart in the session.
+        """
+        raise NotImplementedError
+
+    def summary_cart_id(self, request):
+        """
+        An id of the request's cart that changes when the request gets another
+        cart, e.g. on signing in, None if it has none. Must not query the database.
+        """
+        raise NotImplementedError
+
+    def summary(self, request):
+        """
+        {'count': number of items, 'total': price} of the request's cart for
+        the cart badge. It's kept in the session, which the cart views refresh
+        whenever they change the cart, so it only costs queries when the
+        session has none for the current cart. Changes made in other sessions,
+        or in the admin, show up once the cart page has been viewed.
+        """
+        cart_id = self.summary_cart_id(request)
+        if cart_id is None:
+            return EMPTY_CART_SUMMARY
+        stored = request.session.get(SESSION_SUMMARY_KEY)
+        if stored is not None and stored['cart'] == cart_id:
+            return {'count': stored['count'], 'total': stored['total']}
+        return self.refresh_summary(request)
+
+    def refresh_summary(self, request):
+        """Store and return the summary of the request's cart, after it changed."""
+        items, total = self.contents(request)
+        return self.remember_summary(request, items, total)
+
+    def remember_summary(self, request, items, total):
+        """Store the summary of a cart whose contents are already loaded."""
+        return self.store_summary(request, sum(item.quantity for item in items), total)
+
+    def store_summary(self, request, count, total, cart_id=None):
+        """Store the summary of the request's cart, or of the cart `cart_id` when it's about to change."""
+        summary = {'count': count, 'total': total}
+        stored = {'cart': cart_id if cart_id is not None else self.summary_cart_id(request), **summary}
+        # Writing the session marks it as modified, so only do it when the summary changes
+        if request.session.get(SESSION_SUMMARY_KEY) != stored:
+            request.session[SESSION_SUMMARY_KEY] = stored
+        return summary
+
+
+class DatabaseCartBackend(BaseCartBackend):
+    """The cart is the active Order and its OrderItem rows, see resolve_cart."""
+    def contents(self, request):
+        # Looking at the cart must not create an order, guests only get one once they add an item
+        order, created = resolve_cart(request, create=False)
+        items = list(OrderItem.objects.for_cart(order)) if order is not None else []
+        return items, order.total_price if items else 0
+
+    def add(self, request, product):
+        order, created = resolve_cart(request)
+        return OrderItem.objects.add_one(order, product)
+
+    def remove_one(self, request, product):
+        order, created = resolve_cart(request, create=False)
+        return OrderItem.objects.remove_one(order, product) if order is not None else None
+
+    def remove_all(self, request, product):
+        order, created = resolve_cart(request, create=False)
+        return order is not None and OrderItem.objects.remove_all(order, product)
+
+    def checkout_order(self, request):
+        order = Order.objects.filter(user=request.user, is_active=True).first()
+        if order is not None and order.orderitem_set.exists():
+            return order
+        return None
+
+    def forget(self, order):
+        # The placed order is no longer active, so resolve_cart doesn't pick it up again
+        pass
+
+    def merge_guest_cart(self, request, user):
+        order_id = request.session.get(SESSION_ORDER_KEY)
+        condition = Q(user=user, is_active=True)
+        if order_id is not None:
+            condition |= Q(pk=order_id, user__isnull=True, is_active=True)
+        orders = list(Order.objects.filter(condition).order_by('id')[:2])
+        guest = next((order for order in orders if order.user_id is None), None)
+        order = next((order for order in orders if order.user_id is not None), None)
+        if guest is not None:
+            if order is None:
+                order = adopt_guest_order(guest, user)
+            if order.pk != guest.pk:
+                merge_guest_order(guest, order)
+        # The request may not have its user yet, so the summary gets the id of the cart
+        if order is None:
+            request.session.pop(SESSION_ORDER_KEY, None)
+            self.store_summary(request, **EMPTY_CART_SUMMARY, cart_id=f'user:{user.pk}')
+            return
+        remember_cart(request, order)
+        self.store_summary(request, **self.order_summary(order.pk), cart_id=order.pk)
+
+    def summary_cart_id(self, request):
+        order_id = request.session.get(SESSION_ORDER_KEY)
+        if order_id is None and request.user.is_authenticated:
+            # A signed in user may have a cart this session hasn't resolved yet
+            return f'user:{request.user.pk}'
+        return order_id
+
+    def refresh_summary(self, request):
+        # After a change the session has the cart's id, so one aggregate does without resolving the cart again
+        order_id = request.session.get(SESSION_ORDER_KEY)
+        if order_id is None:
+            order, created = resolve_cart(request, create=False)
+            if order is None:
+                return self.store_summary(request, **EMPTY_CART_SUMMARY)
+            order_id = order.pk
+        return self.store_summary(request, **self.order_summary(order_id))
+
+    def order_summary(self, order_id):
+        return OrderItem.objects.filter(order_id=order_id, order__is_active=True).aggregate(
+            count=Coalesce(Sum('quantity'), 0),
+            total=order_total('quantity', 'item__price'),
+        )
+
+
+class KeyValueCartBackend(BaseCartBackend):
+    """
+    The cart is a map of product id to quantity under a key per user, or per
+    guest session, which is only written to Order/OrderItem rows at checkout.
+    Carts expire CART_TIMEOUT seconds after their last change. Subclasses
+    provide the storage.
+    """
+    def increment(self, key, product_id, amount):
+        """Add `amount` to the quantity of `product_id`, and return the new quantity."""
+        raise NotImplementedError
+
+    def decrement(self, key, product_id):
+        """
+        Take one of `product_id` off the cart, removing the product when none
+        is left, in one atomic step. Return the new quantity, or None if the
+        product wasn't in the cart.
+        """
+        raise NotImplementedError
+
+    def delete_field(self, key, product_id):
+        """Remove `product_id` from the cart and return whether it was there."""
+        raise NotImplementedError
+
+    def get_all(self, key):
+        """The cart as {product_id: quantity}."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def merge(self, key, into_key):
+        """
+        Add the quantities of the cart at `key` to the cart at `into_key`, delete
+        it and return the merged cart, or None if there is no cart at `key`.
+        """
+        raise NotImplementedError
+
+    def cart_key(self, request, create=False):
+        """The key of the request's cart, None for a guest without one unless `create` is set."""
+        if request.user.is_authenticated:
+            return f'cart:user:{request.user.pk}'
+        token = request.session.get(SESSION_CART_KEY)
+        if token is None:
+            if not create:
+                return None
+            token = request.session[SESSION_CART_KEY] = uuid.uuid4().hex
+        return f'cart:guest:{token}'
+
+    def contents(self, request):
+        key = self.cart_key(request)
+        return self.items(self.get_all(key)) if key is not None else ([], 0)
+
+    def items(self, quantities):
+        """(items, total) of a cart given as {product_id: quantity}."""
+        if not quantities:
+            return [], 0
+        products = Product.objects.in_bulk(quantities)
+        # Products deleted since they were added are left out
+        items = [CartItem(products[product_id], quantity) for product_id, quantity in quantities.items() if product_id in products]
+        return items, sum(item.total_price for item in items)
+
+    def add(self, request, product):
+        return self.increment(self.cart_key(request, create=True), product.pk, 1) == 1
+
+    def remove_one(self, request, product):
+        key = self.cart_key(request)
+        if key is None:
+            return None
+        quantity = self.decrement(key, product.pk)
+        return None if quantity is None else quantity == 0
+
+    def remove_all(self, request, product):
+        key = self.cart_key(request)
+        return key is not None and self.delete_field(key, product.pk)
+
+    def checkout_order(self, request):
+        items, total = self.contents(request)
+        if not items:
+            return None
+        order = Order.objects.filter(user=request.user, is_active=True).first()
+        if order is None:
+            order, created = create_user_order(request.user)
+        quantities = {item.item.pk: item.quantity for item in items}
+        with transaction.atomic():
+            # Concurrent checkouts rewrite the items one after the other
+            Order.objects.select_for_update().filter(pk=order.pk).exists()
+            # Only write when the cart changed since the last checkout
+            if dict(OrderItem.objects.filter(order=order).values_list('item_id', 'quantity')) != quantities:
+                OrderItem.objects.filter(order=order).delete()
+                OrderItem.objects.bulk_create(OrderItem(order=order, item=item.item, quantity=item.quantity) for item in items)
+        return order
+
+    def forget(self, order):
+        if order.user_id is not None:
+            self.delete(f'cart:user:{order.user_id}')
+
+    def merge_guest_cart(self, request, user):
+        key = f'cart:user:{user.pk}'
+        token = request.session.pop(SESSION_CART_KEY, None)
+        quantities = self.merge(f'cart:guest:{token}', key) if token is not None else None
+        if quantities is None:
+            quantities = self.get_all(key)
+        # The request may not have its user yet, so the summary gets the id of the cart
+        items, total = self.items(quantities)
+        self.store_summary(request, sum(item.quantity for item in items), total, cart_id=key)
+
+    def summary_cart_id(self, request):
+        return self.cart_key(request)
+
+
+class LocalCartBackend(KeyValueCartBackend):
+    """Carts in the memory of this process, so only for a single process, e.g. in development."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key: (expires at, {product_id: quantity})
+        self.carts = {}
+
+    def _cart(self, key):
+        entry = self.carts.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.carts.pop(key, None)
+            return None
+        return entry[1]
+
+    def increment(self, key, product_id, amount):
+        with self.lock:
+            cart = self._cart(key) or {}
+            cart[product_id] = cart.get(product_id, 0) + amount
+            self.carts[key] = (time.monotonic() + settings.CART_TIMEOUT, cart)
+            return cart[product_id]
+
+    def decrement(self, key, product_id):
+        with self.lock:
+            cart = self._cart(key)
+            if cart is None or product_id not in cart:
+                return None
+            quantity = cart[product_id] - 1
+            if quantity > 0:
+                cart[product_id] = quantity
+                self.carts[key] = (time.monotonic() + settings.CART_TIMEOUT, cart)
+                return quantity
+            del cart[product_id]
+            if not cart:
+                del self.carts[key]
+            return 0
+
+    def delete_field(self, key, product_id):
+        with self.lock:
+            cart = self._cart(key)
+            if cart is None or product_id not in cart:
+                return False
+            del cart[product_id]
+            if not cart:
+                del self.carts[key]
+            return True
+
+    def get_all(self, key):
+        with self.lock:
+            return dict(self._cart(key) or {})
+
+    def delete(self, key):
+        with self.lock:
+            self.carts.pop(key, None)
+
+    def merge(self, key, into_key):
+        with self.lock:
+            guest = self._cart(key)
+            if guest is None:
+                return None
+            del self.carts[key]
+            cart = self._cart(into_key) or {}
+            for product_id, quantity in guest.items():
+                cart[product_id] = cart.get(product_id, 0) + quantity
+            self.carts[into_key] = (time.monotonic() + settings.CART_TIMEOUT, cart)
+            return dict(cart)
+
+
+class RedisCartBackend(KeyValueCartBackend):
+    """Carts as hashes in a server that speaks the Redis protocol, at CART_REDIS_URL."""
+    # Scripts run atomically, so no other command lands between the decrement and the
+    # delete. KEYS[1] is the cart, ARGV the product id and CART_TIMEOUT, -1 means not in the cart.
+    DECREMENT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if quantity > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return quantity
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 0
+"""
+
+    def __init__(self):
+        self.client = RESPClient.from_url(settings.CART_REDIS_URL, timeout=settings.CART_REDIS_TIMEOUT)
+
+    def increment(self, key, product_id, amount):
+        quantity, _ = self.client.pipeline(
+            ('HINCRBY', key, product_id, amount),
+            ('EXPIRE', key, settings.CART_TIMEOUT),
+        )
+        return quantity
+
+    def decrement(self, key, product_id):
+        quantity = self.client.execute('EVAL', self.DECREMENT_SCRIPT, 1, key, product_id, settings.CART_TIMEOUT)
+        return quantity if quantity >= 0 else None
+
+    def delete_field(self, key, product_id):
+        return bool(self.client.execute('HDEL', key, product_id))
+
+    def get_all(self, key):
+        return self.parse_hash(self.client.execute('HGETALL', key))
+
+    def parse_hash(self, reply):
+        return {int(reply[i]): int(reply[i + 1]) for i in range(0, len(reply), 2)}
+
+    def delete(self, key):
+        self.client.execute('DEL', key)
+
+    def merge(self, key, into_key):
+        # Renaming claims the cart, so concurrent merges of it can't both add it up
+        claimed = f'{key}:merging:{uuid.uuid4().hex}'
+        try:
+            _, reply = self.client.pipeline(('RENAME', key, claimed), ('HGETALL', claimed))
+        except RESPError:
+            # There is no cart at `key`
+            return None
+        commands = [('HINCRBY', into_key, reply[i], reply[i + 1]) for i in range(0, len(reply), 2)]
+        *_, reply = self.client.pipeline(
+            *commands,
+            ('EXPIRE', into_key, settings.CART_TIMEOUT),
+            ('DEL', claimed),
+            ('HGETALL', into_key),
+        )
+        return self.parse_hash(reply)
+
+
+_backend = None
+
+def get_cart_backend():
+    """Return the CART_BACKEND backend."""
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.CART_BACKEND)()
+    return _backend
+
+
+def reset_cart_backend(**kwargs):
+    global _backend
+    _backend = None
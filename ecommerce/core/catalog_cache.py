@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.cache.utils import make_template_fragment_key
+
+PRODUCT_CARD_FRAGMENT = 'product_card'
+CATALOG_PAGE_FRAGMENT = 'catalog_page'
+
+
+def product_card_version(product):
+    """
+    Everything a product card shows. It's part of the card's cache key, so a
+    changed product gets a new key in every process, however it was changed,
+    and the cache never has to be told. Products come with select_related('rating').
+    """
+    # Products without reviews have no rating summary
+    rating = getattr(product, 'rating', None)
+    return (
+        product.title, product.price, product.image.name, product.image_hash,
+        (rating.count, rating.total) if rating is not None else None,
+    )
+
+
+def catalog_page_version(page):
+    """The version of a catalog page: its products' card versions and whether there are more pages."""
+    return (
+        [(product.pk, product_card_version(product)) for product in page],
+        page.has_next, page.has_previous,
+    )
+
+
+def product_card_key(product):
+    return make_template_fragment_key(PRODUCT_CARD_FRAGMENT, [product.pk, product_card_version(product)])
+
+
+def catalog_cache_context(page):
+    """Template context for the {% cache %} tags of the catalog templates showing `page`."""
+    return {
+        'catalog_version': catalog_page_version(page),
+        'catalog_cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+    }
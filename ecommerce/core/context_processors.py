@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_backend
+
+
+def cart_summary(request):
+    """The cart badge of base.html, only looked up by pages that render it."""
+    if not hasattr(request, 'session'):
+        # e.g. pages rendered ahead of time by warm_catalog_cache
+        return {}
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart_backend().summary(request))}
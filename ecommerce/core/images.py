@@ -0,0 +1,124 @@
+import hashlib
+import io
+import os
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Pillow format and file extension of every variant, WebP first because it is preferred
+VARIANT_FORMATS = (
+    ('WEBP', 'webp'),
+    ('JPEG', 'jpg'),
+)
+HASH_LENGTH = 16
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+DOWNLOAD_TIMEOUT = 30
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def variant_name(image_hash, height, extension):
+    """
+    Storage name of a variant. Names only depend on the image content, so
+    variants can be cached forever and never have to be looked up.
+    """
+    return f'{settings.PRODUCT_IMAGE_VARIANT_DIR}/{image_hash}-{height}.{extension}'
+
+
+def resize(image, height):
+    if image.height <= height:
+        # Never upscale, the variant is the original size instead
+        return image.copy()
+    width = max(round(image.width * height / image.height), 1)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, put transparent images on white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=settings.PRODUCT_IMAGE_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=settings.PRODUCT_IMAGE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def generate_variants(name, storage=None):
+    """
+    Write every size and format variant of the image stored as `name` and
+    return its content hash. Variants that already exist are skipped.
+    Doesn't touch the database, so it can run in worker processes.
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    content_hash = image_hash(data)
+    image = None
+    for height in settings.PRODUCT_IMAGE_HEIGHTS:
+        resized = None
+        for image_format, extension in VARIANT_FORMATS:
+            variant = variant_name(content_hash, height, extension)
+            if storage.exists(variant):
+                continue
+            if image is None:
+                image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+            if resized is None:
+                resized = resize(image, height)
+            storage.save(variant, ContentFile(encode(resized, image_format)))
+    return content_hash
+
+
+def imported_image_name(source):
+    """
+    Storage name for an image imported from a URL or file path. It is derived
+    from the source, so importing the same source again reuses the file.
+    """
+    extension = os.path.splitext(urllib.parse.urlparse(source).path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        extension = '.jpg'
+    return f'products/imported/{hashlib.sha256(source.encode()).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+def import_image(source, storage=None):
+    """
+    Download (http and https URLs) or read (file paths) an image, store it
+    under imported_image_name() unless it is there already, and generate its
+    variants. Returns (name, hash). Doesn't touch the database either.
+    """
+    storage = storage or default_storage
+    name = imported_image_name(source)
+    if not storage.exists(name):
+        if urllib.parse.urlparse(source).scheme in ('http', 'https'):
+            with urllib.request.urlopen(source, timeout=DOWNLOAD_TIMEOUT) as response:
+                data = response.read()
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        # Refuse anything Pillow can't read before it is stored
+        Image.open(io.BytesIO(data)).verify()
+        name = storage.save(name, ContentFile(data))
+    return name, generate_variants(name, storage)
+
+
+def process_product_image(product):
+    """Generate the variants of a product's image and store its hash on the product."""
+    from .models import Product
+
+    content_hash = generate_variants(product.image.name) if product.image else ''
+    if content_hash != product.image_hash:
+        Product.objects.filter(pk=product.pk).update(image_hash=content_hash)
+        product.image_hash = content_hash
+    return content_hash
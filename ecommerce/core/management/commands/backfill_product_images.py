@@ -0,0 +1,54 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from core.images import generate_variants
+from core.models import Product
+
+
+def generate(product_id, name):
+    try:
+        return product_id, generate_variants(name), None
+    except OSError as e:
+        return product_id, None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized image variants of products that have none, using a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes, 0 to run in this process.')
+        parser.add_argument('--force', action='store_true', help='Process every product with an image, not only the ones without variants.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(image_hash='')
+        jobs = list(products.values_list('id', 'image', 'image_hash'))
+        hashes = {pk: image_hash for pk, _, image_hash in jobs}
+
+        if options['workers']:
+            # Workers only read and write files, the database is left to this process
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [executor.submit(generate, pk, name) for pk, name, _ in jobs]
+                results = [future.result() for future in as_completed(futures)]
+        else:
+            results = [generate(pk, name) for pk, name, _ in jobs]
+
+        processed = failed = 0
+        for pk, content_hash, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f'Product {pk}: {error}')
+                continue
+            processed += 1
+            if content_hash != hashes[pk]:
+                Product.objects.filter(pk=pk).update(image_hash=content_hash)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} product images in {elapsed:.2f}s, {failed} failed.'
+        ))
@@ -0,0 +1,174 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+
+from core.benchmarks import latency_summary
+from core.cart import resolve_cart
+from core.models import Order, OrderItem, Product, Review
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large number of orders and reviews in a transaction that is rolled back, '
+        'and time the cart, checkout and product detail lookups with and without the '
+        'order and review indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000, help='Number of orders to seed.')
+        parser.add_argument('--users', type=int, default=50000, help='Number of users the orders belong to.')
+        parser.add_argument('--products', type=int, default=2000, help='Number of products to seed.')
+        parser.add_argument('--reviews', type=int, default=200000, help='Number of reviews to seed.')
+        parser.add_argument('--repeat', type=int, default=200, help='Number of timed lookups per measurement.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random data and lookups.')
+        parser.add_argument('--yes-really', action='store_true', help='Run with DEBUG off, on a database that is a throwaway copy.')
+
+    def handle(self, *args, **options):
+        # Dropping the indexes and seeding in one transaction locks the tables until it is rolled back
+        if not settings.DEBUG and not options['yes_really']:
+            raise CommandError(
+                'This drops indexes and seeds millions of rows in the default database, which blocks '
+                'the store until it is done. Run it with DEBUG on, or pass --yes-really on a throwaway copy.'
+            )
+        self.random = random.Random(options['seed'])
+        try:
+            # SQLite can only change the schema in a transaction without foreign key checks
+            with connection.constraint_checks_disabled(), transaction.atomic():
+                self.seed(options)
+                with connection.schema_editor() as editor:
+                    self.drop_indexes(editor)
+                # Warm the page cache so both runs read from memory
+                self.measure(options['repeat'])
+                before = self.measure(options['repeat'])
+                with connection.schema_editor() as editor:
+                    self.create_indexes(editor)
+                after = self.measure(options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{"lookup":<16}{"":<5}{"without (ms)":>14}{"with (ms)":>12}{"speedup":>10}')
+        for name in before:
+            for statistic in ('p50', 'p95'):
+                old, new = before[name][statistic], after[name][statistic]
+                speedup = old / new if new else float('inf')
+                self.stdout.write(f'{name:<16}{statistic:<5}{old:>14.3f}{new:>12.3f}{speedup:>9.1f}x')
+        self.stdout.write(self.style.SUCCESS('Seeded data was rolled back.'))
+
+    def drop_indexes(self, editor):
+        for model in (Order, Review):
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+            # The partial unique constraint is what indexes the cart lookup
+            for constraint in model._meta.constraints:
+                editor.remove_constraint(model, constraint)
+
+    def create_indexes(self, editor):
+        for model in (Order, Review):
+            for index in model._meta.indexes:
+                editor.add_index(model, index)
+            for constraint in model._meta.constraints:
+                editor.add_constraint(model, constraint)
+
+    def seed(self, options):
+        start = time.perf_counter()
+        password = User.objects.make_random_password()
+        User.objects.bulk_create(
+            (User(email=f'benchmark{i}@example.com', password=password) for i in range(options['users'])),
+            batch_size=BATCH_SIZE,
+        )
+        self.user_ids = list(User.objects.filter(email__startswith='benchmark').values_list('id', flat=True))
+        Product.objects.bulk_create(
+            (Product(title=f'Benchmark product {i}', description='Benchmark', price=10, category='CP') for i in range(options['products'])),
+            batch_size=BATCH_SIZE,
+        )
+        self.product_ids = list(Product.objects.filter(title__startswith='Benchmark product').values_list('id', flat=True))
+        # Popularity follows a long tail: a few users and products account for most rows
+        self.user_weights = [1 / (rank + 1) for rank in range(len(self.user_ids))]
+        self.product_weights = [1 / (rank + 1) for rank in range(len(self.product_ids))]
+
+        # Every user has one active order, the rest are placed orders and empty guest carts
+        placed_users = iter(self.random.choices(self.user_ids, self.user_weights, k=options['orders']))
+        orders = []
+        for i in range(options['orders']):
+            if i < len(self.user_ids):
+                orders.append(Order(user_id=self.user_ids[i], is_active=True))
+            elif i % 3:
+                orders.append(Order(user_id=next(placed_users), is_active=False))
+            else:
+                orders.append(Order())
+            if len(orders) == BATCH_SIZE:
+                Order.objects.bulk_create(orders)
+                orders = []
+        Order.objects.bulk_create(orders)
+        active = Order.objects.filter(user_id__in=self.user_ids[:1000], is_active=True)
+        OrderItem.objects.bulk_create(
+            (OrderItem(order=order, item_id=self.random.choice(self.product_ids)) for order in active),
+            batch_size=BATCH_SIZE,
+        )
+
+        reviewed = self.random.choices(self.product_ids, self.product_weights, k=options['reviews'])
+        reviews = []
+        for product_id in reviewed:
+            reviews.append(Review(
+                user_id=self.random.choice(self.user_ids),
+                product_id=product_id,
+                rating=self.random.randint(1, 5),
+            ))
+            if len(reviews) == BATCH_SIZE:
+                Review.objects.bulk_create(reviews)
+                reviews = []
+        Review.objects.bulk_create(reviews)
+        self.stdout.write(f'Seeded {options["orders"]} orders and {options["reviews"]} reviews in {time.perf_counter() - start:.1f}s.')
+
+    def measure(self, repeat):
+        factory = RequestFactory()
+        # Traffic follows the same long tail as the data
+        user_picks = self.random.choices(self.user_ids, self.user_weights, k=repeat)
+        product_picks = self.random.choices(self.product_ids, self.product_weights, k=repeat)
+        users = User.objects.in_bulk(user_picks)
+        products = Product.objects.in_bulk(product_picks)
+        users = [users[pk] for pk in user_picks]
+        products = [products[pk] for pk in product_picks]
+
+        def new_or_get(user):
+            request = factory.get('/cart/')
+            request.user = user
+            request.session = {}
+            resolve_cart(request, create=False)
+
+        def checkout(user):
+            order = Order.objects.filter(user=user, is_active=True).first()
+            order.orderitem_set.exists()
+
+        def product_detail(product):
+            list(Review.objects.for_product(product)[:20])
+
+        lookups = {
+            'new_or_get': (new_or_get, users),
+            'checkout': (checkout, users),
+            'product_detail': (product_detail, products),
+        }
+        results = {}
+        for name, (lookup, args) in lookups.items():
+            timings = []
+            for arg in args:
+                start = time.perf_counter()
+                lookup(arg)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = latency_summary(timings)
+        return results
+
@@ -0,0 +1,172 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.benchmarks import latency_summary
+from core.models import Product
+
+HOST = '127.0.0.1'
+
+
+class URLConfWSGIHandler(WSGIHandler):
+    def __init__(self, urlconf):
+        super().__init__()
+        self.urlconf = urlconf
+
+    def get_response(self, request):
+        request.urlconf = self.urlconf
+        return super().get_response(request)
+
+
+class URLConfASGIHandler(ASGIHandler):
+    def __init__(self, urlconf):
+        super().__init__()
+        self.urlconf = urlconf
+
+    async def get_response_async(self, request):
+        request.urlconf = self.urlconf
+        return await super().get_response_async(request)
+
+
+class WSGIServer:
+    """Hands requests to a WSGI application on a fixed number of threads, like a threaded WSGI server."""
+    def __init__(self, urlconf, threads):
+        self.application = URLConfWSGIHandler(urlconf)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    def call(self, path, query_string):
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query_string, 'HTTP_HOST': HOST, 'wsgi.input': BytesIO()}
+        setup_testing_defaults(environ)
+        statuses = []
+        response = self.application(environ, lambda status, headers: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        return int(statuses[0].split()[0])
+
+    async def request(self, path, query_string):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.call, path, query_string)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class ASGIServer:
+    """Hands every request to an ASGI application on the event loop, like an ASGI server."""
+    def __init__(self, urlconf):
+        self.application = URLConfASGIHandler(urlconf)
+
+    async def request(self, path, query_string):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'root_path': '',
+            'headers': [(b'host', HOST.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': (HOST, 80),
+        }
+        statuses = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await self.application(scope, receive, send)
+        return statuses[0]
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of the WSGI handler with the sync views and the ASGI '
+        'handler with the async views under concurrent connections, in process and '
+        'on the current database. Run it with --settings=ecommerce.settings_asgi.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50, help='Number of concurrent connections.')
+        parser.add_argument('--requests', type=int, default=20, help='Number of requests every connection makes.')
+        parser.add_argument('--threads', type=int, default=8, help='Number of threads of the WSGI server.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the pages the connections visit.')
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:1000])
+        if not product_ids:
+            raise CommandError('There are no products to visit, run seed_store first.')
+        titles = Product.objects.filter(pk__in=product_ids[:100]).values_list('title', flat=True)
+        search_words = sorted({word for title in titles for word in title.split() if not word.isdigit()}) or ['product']
+        if 'core.middleware.QueryCountMiddleware' in settings.MIDDLEWARE:
+            self.stderr.write(
+                'QueryCountMiddleware is sync only, so the async views run in a thread. '
+                'Use --settings=ecommerce.settings_asgi for a fair comparison.'
+            )
+
+        rng = random.Random(options['seed'])
+        visits = [
+            [self.page(rng, product_ids, search_words) for _ in range(options['requests'])]
+            for _ in range(options['connections'])
+        ]
+        self.stdout.write(f'{"server":<8}{"requests":>10}{"errors":>8}{"rps":>9}{"p50 (ms)":>11}{"p95 (ms)":>11}{"p99 (ms)":>11}')
+        for name, server in (
+            ('wsgi', lambda: WSGIServer('ecommerce.urls', options['threads'])),
+            ('asgi', lambda: ASGIServer('ecommerce.urls_asgi')),
+        ):
+            server = server()
+            try:
+                timings, elapsed = asyncio.run(self.run(server, visits))
+            finally:
+                server.close()
+            self.report(name, timings, elapsed)
+
+    def page(self, rng, product_ids, search_words):
+        return rng.choice([
+            (reverse('core:index'), ''),
+            (reverse('core:search'), f'search={rng.choice(search_words)}'),
+            (reverse('core:product-detail', args=[rng.choice(product_ids)]), ''),
+            (reverse('core:cart'), ''),
+        ])
+
+    async def run(self, server, visits):
+        timings = []
+
+        async def connection(pages):
+            for path, query_string in pages:
+                start = time.perf_counter()
+                try:
+                    ok = await server.request(path, query_string) < 400
+                except Exception:
+                    ok = False
+                timings.append(((time.perf_counter() - start) * 1000, ok))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connection(pages) for pages in visits))
+        return timings, time.perf_counter() - start
+
+    def report(self, name, timings, elapsed):
+        summary = latency_summary([duration for duration, _ in timings])
+        errors = sum(1 for _, ok in timings if not ok)
+        self.stdout.write(
+            f'{name:<8}{summary["count"]:>10}{errors:>8}{summary["count"] / elapsed:>9.1f}'
+            f'{summary["p50"]:>11.1f}{summary["p95"]:>11.1f}{summary["p99"]:>11.1f}'
+        )
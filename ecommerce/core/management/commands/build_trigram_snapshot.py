@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.trigram import TrigramIndex
+
+
+class Command(BaseCommand):
+    help = 'Build the fuzzy search trigram index from the database and save it as a snapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Snapshot file, defaults to the TRIGRAM_SNAPSHOT_PATH setting.')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.TRIGRAM_SNAPSHOT_PATH
+        if not path:
+            raise CommandError('Set TRIGRAM_SNAPSHOT_PATH or pass --path.')
+        start = time.perf_counter()
+        index = TrigramIndex.from_database()
+        index.save(path)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Saved trigram index of {len(index)} products to {path} in {elapsed:.2f}s.'))
@@ -0,0 +1,226 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.images import import_image, imported_image_name
+from core.models import CatalogVersion, Product
+from core.search import get_search_backend
+
+IMPORTED_FIELDS = ('title', 'description', 'price', 'category')
+# Categories can be given by name as well as by code
+CATEGORY_CODES = {name.lower(): code for code, name in Product.CATEGORY_CHOICES}
+
+
+def fetch_image(product_id, source):
+    try:
+        return product_id, import_image(source), None
+    except Exception as e:
+        return product_id, None, f'{source}: {e}'
+
+
+class InlineExecutor:
+    """Runs the image jobs right away, for --workers 0."""
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(f):
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'Invalid JSON: {e}')
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError('Expected a JSON object.')
+
+
+class Command(BaseCommand):
+    help = (
+        'Import products from a CSV or JSON lines file, creating new products and '
+        'updating existing ones matched by SKU. Rows are read and written in batches, '
+        'and images are downloaded and resized by a pool of worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON lines file, "-" for standard input.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Input format, by default taken from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows written per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of image worker processes, 0 to process images in this process.')
+        parser.add_argument('--skip-images', action='store_true', help='Ignore the image column.')
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or self.guess_format(options['path'])
+        self.batch_size = options['batch_size']
+        self.skip_images = options['skip_images']
+        self.stats = dict.fromkeys(('rows', 'created', 'updated', 'invalid', 'images', 'image_errors'), 0)
+        self.start = self.last_report = time.perf_counter()
+
+        self.executor = ProcessPoolExecutor(options['workers']) if options['workers'] else InlineExecutor()
+        # Bounds the number of images in flight, so memory doesn't grow with the input
+        self.max_pending = max(options['workers'], 1) * 4
+        self.pending = set()
+        self.image_results = []
+        try:
+            with self.open(options['path']) as f:
+                rows = read_csv(f) if input_format == 'csv' else read_jsonl(f)
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    self.import_batch(batch)
+                    self.report()
+            self.collect_images(wait_for=0)
+            self.save_images()
+        finally:
+            self.executor.shutdown()
+
+        self.report(final=True)
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        raise CommandError('Could not tell the input format from the file name, pass --format.')
+
+    def open(self, path):
+        if path == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8', newline='', closefd=False)
+        try:
+            return open(path, encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+    def parse(self, line_number, row):
+        """Return (product, image source) for a row, or None if it is invalid."""
+        if isinstance(row, Exception):
+            return self.invalid(line_number, str(row))
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            return self.invalid(line_number, 'sku: This field cannot be blank.')
+        product = Product(sku=sku)
+        for field in IMPORTED_FIELDS:
+            setattr(product, field, row.get(field))
+        product.category = CATEGORY_CODES.get(str(product.category or '').lower(), product.category)
+        try:
+            product.full_clean(exclude=['image', 'image_hash'], validate_unique=False)
+        except ValidationError as e:
+            messages = '; '.join(f'{field}: {" ".join(errors)}' for field, errors in e.message_dict.items())
+            return self.invalid(line_number, messages)
+        image = str(row.get('image') or '').strip()
+        return product, None if self.skip_images else image or None
+
+    def invalid(self, line_number, message):
+        self.stats['invalid'] += 1
+        self.stderr.write(f'Line {line_number}: {message}')
+        return None
+
+    def import_batch(self, batch):
+        self.stats['rows'] += len(batch)
+        parsed = {}
+        for line_number, row in batch:
+            result = self.parse(line_number, row)
+            if result is not None:
+                # A SKU that repeats within the batch keeps its last row
+                parsed[result[0].sku] = result
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            existing = Product.objects.in_bulk(list(parsed), field_name='sku')
+            new, changed = [], []
+            retitled = False
+            for sku, (product, _) in parsed.items():
+                current = existing.get(sku)
+                if current is None:
+                    new.append(product)
+                    continue
+                retitled = retitled or current.title != product.title
+                if any(getattr(current, field) != getattr(product, field) for field in IMPORTED_FIELDS):
+                    for field in IMPORTED_FIELDS:
+                        setattr(current, field, getattr(product, field))
+                    changed.append(current)
+            Product.objects.bulk_create(new, batch_size=self.batch_size)
+            Product.objects.bulk_update(changed, IMPORTED_FIELDS, batch_size=self.batch_size)
+            # Not every database returns the ids of bulk inserted rows
+            products = Product.objects.in_bulk(list(parsed), field_name='sku')
+            # Bulk writes skip the product signals, so keep the search indexes in sync here
+            written = [products[product.sku] for product in new + changed]
+            get_search_backend().index_products(written)
+            if new or retitled:
+                # The in-memory title indexes of the web processes rebuild on the new version
+                CatalogVersion.objects.bump(CatalogVersion.TITLES)
+        self.stats['created'] += len(new)
+        self.stats['updated'] += len(changed)
+
+        for sku, (_, source) in parsed.items():
+            product = products[sku]
+            if source and (product.image.name != imported_image_name(source) or not product.image_hash):
+                self.submit_image(product.pk, source)
+
+    def submit_image(self, product_id, source):
+        self.collect_images(wait_for=self.max_pending - 1)
+        self.pending.add(self.executor.submit(fetch_image, product_id, source))
+
+    def collect_images(self, wait_for):
+        """Collect finished image jobs until at most `wait_for` are still running."""
+        while self.pending:
+            done, self.pending = wait(self.pending, timeout=0 if len(self.pending) <= wait_for else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                product_id, result, error = future.result()
+                if error:
+                    self.stats['image_errors'] += 1
+                    self.stderr.write(f'Product {product_id}: {error}')
+                else:
+                    self.image_results.append((product_id, *result))
+            if not done:
+                break
+        if len(self.image_results) >= self.batch_size:
+            self.save_images()
+
+    def save_images(self):
+        if not self.image_results:
+            return
+        products = [
+            Product(pk=product_id, image=name, image_hash=content_hash)
+            for product_id, name, content_hash in self.image_results
+        ]
+        Product.objects.bulk_update(products, ['image', 'image_hash'], batch_size=self.batch_size)
+        self.stats['images'] += len(products)
+        self.image_results = []
+
+    def report(self, final=False):
+        now = time.perf_counter()
+        if not final and now - self.last_report < 1:
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        stats = self.stats
+        message = (
+            f'{stats["rows"]} rows in {elapsed:.1f}s ({stats["rows"] / elapsed if elapsed else 0:.0f} rows/s): '
+            f'{stats["created"]} created, {stats["updated"]} updated, {stats["invalid"]} invalid, '
+            f'{stats["images"]} images, {stats["image_errors"]} image errors.'
+        )
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
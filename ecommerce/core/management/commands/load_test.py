@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.benchmarks import latency_summary
+from core.models import Product
+
+User = get_user_model()
+
+# What every simulated customer does, in order, on each visit
+SCENARIO = ('index', 'search', 'product_detail', 'add_to_cart', 'view_cart', 'checkout')
+
+
+class Client:
+    """One simulated customer with its own session, signed in as a seeded user."""
+    def __init__(self, base_url, email, password, product_ids, search_words, timeout, seed):
+        self.base_url = base_url
+        self.email = email
+        self.password = password
+        self.product_ids = product_ids
+        self.search_words = search_words
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        self.timings = []
+
+    def url(self, path):
+        return urljoin(self.base_url, path)
+
+    def login(self):
+        url = self.url(reverse('core:login'))
+        self.session.get(url, timeout=self.timeout)
+        response = self.session.post(url, data={
+            'username': self.email,
+            'password': self.password,
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken', ''),
+        }, headers={'Referer': url}, allow_redirects=False, timeout=self.timeout)
+        if response.status_code != 302:
+            raise CommandError(f'Could not sign in as {self.email}.')
+
+    def request(self, name, path, **params):
+        start = time.perf_counter()
+        try:
+            # Redirects aren't followed, so each timing covers a single view
+            response = self.session.get(self.url(path), params=params, allow_redirects=False, timeout=self.timeout)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        self.timings.append((name, (time.perf_counter() - start) * 1000, ok))
+
+    def visit(self):
+        product_id = self.random.choice(self.product_ids)
+        steps = {
+            'index': (reverse('core:index'), {}),
+            'search': (reverse('core:search'), {'search': self.random.choice(self.search_words)}),
+            'product_detail': (reverse('core:product-detail', args=[product_id]), {}),
+            'add_to_cart': (reverse('core:cart-add', args=[product_id, 'cart']), {}),
+            'view_cart': (reverse('core:cart'), {}),
+            'checkout': (reverse('core:checkout'), {}),
+        }
+        for step in SCENARIO:
+            path, params = steps[step]
+            self.request(step, path, **params)
+
+    def run(self, deadline, stop):
+        self.login()
+        while time.perf_counter() < deadline and not stop.is_set():
+            self.visit()
+        return self.timings
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the store with concurrent simulated customers signed in as users '
+        'created by seed_store, and report latency percentiles and throughput per view.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/', help='Base URL of the running store.')
+        parser.add_argument('--clients', type=int, default=10, help='Number of concurrent clients.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for.')
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds before a request counts as failed.')
+        parser.add_argument('--prefix', default='seed', help='Email prefix of the seeded users to sign in as.')
+        parser.add_argument('--password', default='seed-password', help='Password of the seeded users.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random choices of the clients.')
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        emails = [f'{options["prefix"]}{i}@example.com' for i in range(clients)]
+        if User.objects.filter(email__in=emails).count() < clients:
+            raise CommandError(f'Run seed_store with at least {clients} users first.')
+        product_ids = list(Product.objects.order_by('?').values_list('id', flat=True)[:1000])
+        if not product_ids:
+            raise CommandError('There are no products to visit.')
+        titles = Product.objects.filter(pk__in=product_ids[:100]).values_list('title', flat=True)
+        search_words = sorted({word for title in titles for word in title.split() if not word.isdigit()})
+
+        stop = threading.Event()
+        start = time.perf_counter()
+        deadline = start + options['duration']
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            futures = [
+                executor.submit(Client(
+                    options['url'], email, options['password'], product_ids, search_words,
+                    options['timeout'], options['seed'] + i,
+                ).run, deadline, stop)
+                for i, email in enumerate(emails)
+            ]
+            try:
+                timings = [timing for future in futures for timing in future.result()]
+            except BaseException:
+                stop.set()
+                raise
+        elapsed = time.perf_counter() - start
+        self.report(timings, elapsed)
+
+    def report(self, timings, elapsed):
+        self.stdout.write(
+            f'{"view":<16}{"requests":>10}{"errors":>8}{"rps":>9}{"p50 (ms)":>11}{"p95 (ms)":>11}{"p99 (ms)":>11}'
+        )
+        for name in SCENARIO:
+            durations = [duration for step, duration, _ in timings if step == name]
+            errors = sum(1 for step, _, ok in timings if step == name and not ok)
+            summary = latency_summary(durations)
+            self.stdout.write(
+                f'{name:<16}{summary["count"]:>10}{errors:>8}{summary["count"] / elapsed:>9.1f}'
+                f'{summary["p50"]:>11.1f}{summary["p95"]:>11.1f}{summary["p99"]:>11.1f}'
+            )
+        summary = latency_summary([duration for _, duration, _ in timings])
+        errors = sum(1 for _, _, ok in timings if not ok)
+        self.stdout.write(self.style.SUCCESS(
+            f'{summary["count"]} requests in {elapsed:.1f}s, {summary["count"] / elapsed:.1f} requests/s, '
+            f'{errors} errors, p50 {summary["p50"]:.1f}ms, p95 {summary["p95"]:.1f}ms, p99 {summary["p99"]:.1f}ms.'
+        ))
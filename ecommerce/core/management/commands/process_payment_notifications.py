@@ -0,0 +1,61 @@
+import logging
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from core.payment_queue import process_batch, worker_name
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Process the queued PayFast payment notifications. Any number of these '
+        'workers can run at the same time, each notification is claimed by one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker threads in this process.')
+        parser.add_argument('--batch-size', type=int, default=10, help='Number of notifications a worker claims at a time.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.processed = [0] * options['workers']
+        threads = [
+            threading.Thread(target=self.work, args=(index, options), name=worker_name(index))
+            for index in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # Let every worker finish its batch, unfinished claims would wait for the lock timeout
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(self.style.SUCCESS(f'Processed {sum(self.processed)} payment notifications.'))
+
+    def work(self, index, options):
+        name = worker_name(index)
+        try:
+            while not self.stop.is_set():
+                try:
+                    claimed = process_batch(name, options['batch_size'])
+                except DatabaseError:
+                    # e.g. the database is locked or restarting, try again after a pause
+                    logger.exception('Worker %s could not claim payment notifications.', name)
+                    claimed = 0
+                self.processed[index] += claimed
+                if not claimed:
+                    if options['once']:
+                        break
+                    self.stop.wait(options['poll_interval'])
+        finally:
+            # Every thread has its own connection
+            connection.close()
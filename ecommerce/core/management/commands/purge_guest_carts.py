@@ -0,0 +1,50 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Delete empty guest orders that were abandoned before being filled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=1,
+                            help='Only purge orders created at least this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of orders deleted per transaction.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the orders that would be purged without deleting them.')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['older_than_days'])
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+
+        if options['dry_run']:
+            count = Order.objects.abandoned_guest_carts(before).count()
+            self.stdout.write(f'{count} empty guest orders would be purged.')
+            return
+
+        purged = 0
+        while True:
+            with transaction.atomic():
+                ids = list(Order.objects.abandoned_guest_carts(before).values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                # Check again while deleting, an item may have been added since the ids were read
+                _, deleted = Order.objects.abandoned_guest_carts(before).filter(id__in=ids).delete()
+            purged += deleted.get(Order._meta.label, 0)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'Purged {purged} orders ({purged / elapsed:.0f} orders/s).')
+            if len(ids) < batch_size:
+                break
+
+        elapsed = time.perf_counter() - start
+        rate = purged / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} empty guest orders in {elapsed:.2f}s ({rate:.0f} orders/s).'
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import ProductRating
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product rating summaries from the reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of summaries written per query.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        created, updated, deleted = ProductRating.objects.reconcile(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created}, fixed {updated} and deleted {deleted} rating summaries in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,88 @@
+import datetime
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.benchmark_suite import Fixtures, get_benchmarks
+from core.benchmarks import compare
+
+
+class Rollback(Exception):
+    pass
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the order, cart, form, template and PayFast benchmarks on fixtures that '
+        'are rolled back afterwards. Results can be saved as JSON and compared to an '
+        'earlier run, failing when a benchmark got slower than the threshold.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only run benchmarks whose name starts with one of these.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown of the median that counts as a regression, as a fraction.')
+        parser.add_argument('--rounds', type=int, default=7, help='Number of timed rounds per benchmark.')
+        parser.add_argument('--min-time', type=float, default=0.05, help='Minimum seconds per round.')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)['benchmarks']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Could not read {options["compare"]}: {e}')
+
+        results = {}
+        try:
+            with transaction.atomic():
+                benchmarks = get_benchmarks(Fixtures())
+                for name, benchmark in benchmarks.items():
+                    if options['names'] and not name.startswith(tuple(options['names'])):
+                        continue
+                    results[name] = benchmark.run(options['rounds'], options['min_time'])
+                    self.stdout.write(
+                        f'{name:<28}{results[name]["p50"] * 1000:>12.1f}us'
+                        f'{results[name]["min"] * 1000:>12.1f}us min{results[name]["loops"]:>9} loops'
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'commit': current_commit(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'benchmarks': results,
+                }, f, indent=2)
+            self.stdout.write(f'Wrote results to {options["output"]}.')
+
+        if previous is not None:
+            self.report_changes(compare(previous, results, options['threshold']), options['threshold'])
+
+    def report_changes(self, changes, threshold):
+        regressions = [name for name, _, _, _, regressed in changes if regressed]
+        for name, old, new, change, regressed in changes:
+            line = f'{name:<28}{old * 1000:>12.1f}us ->{new * 1000:>10.1f}us {change:>+8.1%}'
+            self.stdout.write(self.style.ERROR(f'{line}  REGRESSION') if regressed else line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmarks are more than {threshold:.0%} slower: {", ".join(regressions)}.')
+        self.stdout.write(self.style.SUCCESS(f'No benchmark is more than {threshold:.0%} slower.'))
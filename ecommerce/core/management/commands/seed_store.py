@@ -0,0 +1,221 @@
+import datetime
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Address, CatalogVersion, Order, OrderItem, Payment, Product, ProductRating, Review
+from core.search import get_search_backend
+
+User = get_user_model()
+
+ADJECTIVES = (
+    'Classic', 'Compact', 'Deluxe', 'Essential', 'Lightweight', 'Portable', 'Premium',
+    'Rugged', 'Slim', 'Smart', 'Vintage', 'Wireless', 'Organic', 'Ultra', 'Everyday',
+)
+NOUNS = {
+    'CP': ('Laptop', 'Monitor', 'Keyboard', 'Mouse', 'Router', 'Webcam', 'Tablet', 'Headset', 'Drive', 'Dock'),
+    'BK': ('Cookbook', 'Novel', 'Atlas', 'Biography', 'Guide', 'Anthology', 'Journal', 'Textbook', 'Memoir', 'Almanac'),
+    'CG': ('Jacket', 'Sneakers', 'Hoodie', 'Jeans', 'Scarf', 'Shirt', 'Dress', 'Boots', 'Cap', 'Sweater'),
+}
+CITIES = ('Cape Town', 'Johannesburg', 'Durban', 'Pretoria', 'Port Elizabeth', 'Bloemfontein', 'Polokwane', 'Kimberley')
+REVIEW_TEXTS = (
+    'Exactly as described.', 'Great value for the price.', 'Arrived quickly and works well.',
+    'Not what I expected.', 'Would buy again.', 'Decent, but the quality could be better.', '',
+)
+# Ratings lean positive, like they do on most stores
+RATING_WEIGHTS = (5, 5, 12, 30, 48)
+# Most placed orders are paid, a few failed or were cancelled
+PAYMENT_STATUS_WEIGHTS = (('S', 90), ('U', 6), ('C', 4))
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with generated users, addresses, products, orders, payments '
+        'and reviews using bulk inserts, for load tests against production sized data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of users.')
+        parser.add_argument('--products', type=int, default=2000, help='Number of products.')
+        parser.add_argument('--orders', type=int, default=50000, help='Number of orders, placed orders and carts.')
+        parser.add_argument('--reviews', type=int, default=100000, help='Number of reviews.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows per insert.')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the generated user emails and product SKUs.')
+        parser.add_argument('--password', default='seed-password', help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random data.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        if User.objects.filter(email__startswith=f'{self.prefix}0@').exists():
+            raise CommandError(f'The store has been seeded with prefix "{self.prefix}" already, pass another --prefix.')
+        if (options['orders'] or options['reviews']) and not (options['users'] and options['products']):
+            raise CommandError('Orders and reviews need at least one user and one product.')
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            self.seed_users(options['users'], options['password'])
+            self.seed_products(options['products'])
+            self.seed_orders(options['orders'])
+            self.seed_reviews(options['reviews'])
+            if options['products'] or options['orders']:
+                # The fuzzy search and autocomplete indexes of every process rebuild on
+                # the new version, with the new titles and the popularity of the new orders
+                CatalogVersion.objects.bump(CatalogVersion.TITLES)
+
+        # Bulk inserts skip the signals, so bring the derived data up to date in one go
+        self.step('Summarized ratings', lambda: ProductRating.objects.reconcile()[0])
+        self.step('Indexed products', lambda: get_search_backend().rebuild())
+        self.stdout.write(self.style.SUCCESS(f'Seeded the store in {time.perf_counter() - start:.1f}s.'))
+
+    def step(self, label, function):
+        start = time.perf_counter()
+        count = function()
+        self.stdout.write(f'{label}: {count} in {time.perf_counter() - start:.1f}s.')
+        return count
+
+    def insert(self, model, objects):
+        """
+        Bulk insert `objects` and return their new ids in order. Not every
+        database returns the ids of bulk inserted rows, but new ids are
+        always above the current maximum.
+        """
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True))
+
+    def batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def long_tail(self, count):
+        # A few users and products account for most of the orders and reviews.
+        # Cumulative weights make every pick a bisection instead of a scan.
+        return list(accumulate(1 / (rank + 1) for rank in range(count)))
+
+    def pick_user(self):
+        return self.random.choices(self.user_ids, cum_weights=self.user_weights)[0]
+
+    def pick_product(self):
+        return self.random.choices(self.product_ids, cum_weights=self.product_weights)[0]
+
+    def seed_users(self, count, password):
+        def seed():
+            # Hashing once keeps seeding fast, every user gets the same password
+            password_hash = make_password(password)
+            self.user_ids = []
+            self.address_ids = {}
+            for batch in self.batches(count):
+                users = [User(email=f'{self.prefix}{i}@example.com', password=password_hash) for i in batch]
+                user_ids = self.insert(User, users)
+                addresses = [self.address(user_id) for user_id in user_ids]
+                self.address_ids.update(zip(user_ids, self.insert(Address, addresses)))
+                self.user_ids += user_ids
+            self.user_weights = self.long_tail(len(self.user_ids))
+            return len(self.user_ids)
+        self.step('Users', seed)
+
+    def address(self, user_id):
+        return Address(
+            user_id=user_id,
+            name=f'Customer {user_id}',
+            country='ZA',
+            province=self.random.choice(Address.PROVINCES[1:])[0],
+            zip_code=f'{self.random.randint(1000, 9999)}',
+            city=self.random.choice(CITIES),
+            street_address=f'{self.random.randint(1, 300)} Main Road',
+            mobile_number=f'0{self.random.randint(600000000, 849999999)}',
+        )
+
+    def seed_products(self, count):
+        def seed():
+            self.product_ids = []
+            self.prices = {}
+            for batch in self.batches(count):
+                products = []
+                for i in batch:
+                    category = self.random.choice(list(NOUNS))
+                    title = f'{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS[category])} {i}'
+                    products.append(Product(
+                        sku=f'{self.prefix}-{i}',
+                        title=title,
+                        description=f'{title}, a {dict(Product.CATEGORY_CHOICES)[category].lower()} product.',
+                        # Prices are skewed towards the cheap end, like real catalogs
+                        price=round(self.random.lognormvariate(5, 1), 2),
+                        category=category,
+                    ))
+                product_ids = self.insert(Product, products)
+                self.prices.update(zip(product_ids, (product.price for product in products)))
+                self.product_ids += product_ids
+            self.product_weights = self.long_tail(len(self.product_ids))
+            return len(self.product_ids)
+        self.step('Products', seed)
+
+    def seed_orders(self, count):
+        def seed():
+            # One in ten orders is an open cart, a fifth of those belong to guests
+            carts = count // 10
+            user_carts = iter(self.random.sample(self.user_ids, min(carts - carts // 5, len(self.user_ids))))
+            today = timezone.now().date()
+            totals = {'orders': 0, 'items': 0, 'payments': 0}
+            for batch in self.batches(count):
+                orders = []
+                for i in batch:
+                    if i < carts:
+                        orders.append(Order(user_id=next(user_carts, None), is_active=True))
+                    else:
+                        user_id = self.pick_user()
+                        placed = today - datetime.timedelta(days=self.random.randint(0, 730))
+                        orders.append(Order(user_id=user_id, is_active=False, placement_date=placed))
+                order_ids = self.insert(Order, orders)
+
+                items, payments = [], []
+                for order_id, order in zip(order_ids, orders):
+                    size = min(self.random.choice((1, 1, 1, 2, 2, 3, 4, 5)), len(self.product_ids))
+                    products = set()
+                    while len(products) < size:
+                        products.add(self.pick_product())
+                    amount = 0
+                    for product_id in products:
+                        quantity = self.random.choice((1, 1, 1, 2, 3))
+                        items.append(OrderItem(order_id=order_id, item_id=product_id, quantity=quantity))
+                        amount += quantity * self.prices[product_id]
+                    if not order.is_active:
+                        payments.append(Payment(
+                            order_id=order_id,
+                            address_id=self.address_ids[order.user_id],
+                            amount=round(amount, 2),
+                            # Payment.save() sets the item name, bulk inserts skip it
+                            item_name=f'Order #{order_id}',
+                            status=self.random.choices(*zip(*PAYMENT_STATUS_WEIGHTS))[0],
+                        ))
+                OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+                Payment.objects.bulk_create(payments, batch_size=self.batch_size)
+                totals['orders'] += len(order_ids)
+                totals['items'] += len(items)
+                totals['payments'] += len(payments)
+            return f'{totals["orders"]} orders with {totals["items"]} items and {totals["payments"]} payments'
+        self.step('Orders', seed)
+
+    def seed_reviews(self, count):
+        def seed():
+            for batch in self.batches(count):
+                reviews = [
+                    Review(
+                        user_id=self.pick_user(),
+                        product_id=self.pick_product(),
+                        rating=self.random.choices(range(1, 6), RATING_WEIGHTS)[0],
+                        content=self.random.choice(REVIEW_TEXTS),
+                    )
+                    for _ in batch
+                ]
+                Review.objects.bulk_create(reviews, batch_size=self.batch_size)
+            return count
+        self.step('Reviews', seed)
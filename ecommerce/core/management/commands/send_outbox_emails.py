@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+
+from core.outbox import RateLimiter, send_batch
+from core.payment_queue import worker_name
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Send the queued outbox emails in batches over one SMTP connection, '
+        'which stays open while there is mail to send.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Number of emails claimed at a time.')
+        parser.add_argument('--rate', type=float, default=settings.OUTBOX_EMAIL_RATE_LIMIT, help='Maximum emails per second, 0 for no limit.')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once the outbox is empty instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        name = worker_name()
+        connection = get_connection()
+        limiter = RateLimiter(options['rate'])
+        sent = 0
+        try:
+            while True:
+                try:
+                    claimed = send_batch(name, options['batch_size'], connection, limiter)
+                except DatabaseError:
+                    logger.exception('Could not claim outbox emails.')
+                    claimed = 0
+                sent += claimed
+                if not claimed:
+                    # Don't keep the SMTP server waiting while idle, the next send opens the connection again
+                    connection.close()
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS(f'Processed {sent} outbox emails.'))
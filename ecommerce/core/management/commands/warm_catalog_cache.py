@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.test.client import RequestFactory
+from django.urls import reverse
+
+from core.models import Product
+from core.views import index, paginate_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Render every product card and the first catalog pages into the cache. '
+        'Only useful with a cache that is shared with the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10, help='Number of catalog pages to render.')
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], (LocMemCache, DummyCache)):
+            raise CommandError('The default cache is local to this process, so the web processes would never see what it renders.')
+        start = time.perf_counter()
+        cards = 0
+        products = Product.objects.select_related('rating')
+        for product in products.iterator(chunk_size=2000):
+            render_to_string('core/includes/product_card.html', {
+                'product': product,
+                'catalog_cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+            })
+            cards += 1
+
+        factory = RequestFactory()
+        cursor = None
+        pages = 0
+        while pages < options['pages']:
+            request = factory.get(reverse('core:index'), {'cursor': cursor} if cursor else {})
+            request.user = AnonymousUser()
+            index(request)
+            pages += 1
+            page = paginate_catalog(request, Product.objects.all())
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Cached {cards} product cards and {pages} catalog pages in {elapsed:.2f}s.'
+        ))
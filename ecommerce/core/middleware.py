@@ -0,0 +1,90 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that records the queries run through it: how
+    many, how long they took in total and how many repeat a statement that
+    already ran, which is what an N+1 pattern looks like.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.duplicates = 0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+        if self.statements[sql] > 1:
+            self.duplicates += 1
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+
+    def repeated_statements(self):
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+def get_query_budget(view_name):
+    """The maximum number of queries configured for a view, or None."""
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+class QueryCountMiddleware:
+    """
+    Record the SQL queries run while handling each request. The counter is
+    stored on the request as `query_stats` and the count as `query_count`.
+
+    When DEBUG is on, the numbers are sent back in X-Query-Count and
+    Server-Timing headers, and a view that runs more queries than its
+    QUERY_BUDGETS entry is logged, or raises QueryBudgetExceeded if
+    QUERY_BUDGET_RAISE is set.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        request.query_stats = counter
+        request.query_count = counter.count
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.count)
+            response['Server-Timing'] = (
+                f'db;dur={counter.duration * 1000:.1f};desc="{counter.count} queries", '
+                f'total;dur={elapsed * 1000:.1f}'
+            )
+            self.check_budget(request, counter)
+        return response
+
+    def check_budget(self, request, counter):
+        match = request.resolver_match
+        budget = get_query_budget(match.view_name) if match else None
+        if budget is None or counter.count <= budget:
+            return
+        message = (
+            f'{match.view_name} ran {counter.count} queries, its budget is {budget} '
+            f'({counter.duplicates} duplicates).'
+        )
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
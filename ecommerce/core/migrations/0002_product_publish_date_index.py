@@ -0,0 +1,17 @@
+# Generated by Django 3.1.3 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-publish_date', '-id'], name='product_publish_date_idx'),
+        ),
+    ]
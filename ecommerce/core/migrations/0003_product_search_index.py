@@ -0,0 +1,52 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+CATEGORIES = {'CP': 'Computers', 'BK': 'Book', 'CG': 'Clothing'}
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('english', "
+    "CASE category WHEN 'CP' THEN 'Computers' WHEN 'BK' THEN 'Book' "
+    "WHEN 'CG' THEN 'Clothing' ELSE coalesce(category, '') END), 'C')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX product_search_idx ON core_product USING GIN (({POSTGRES_DOCUMENT}))')
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE core_product_fts USING fts5("
+                "title, description, category, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite was built without FTS5, search falls back to the simple backend
+            return
+        Product = apps.get_model('core', 'Product')
+        for product in Product.objects.all().iterator():
+            schema_editor.execute(
+                'INSERT INTO core_product_fts (rowid, title, description, category) VALUES (%s, %s, %s, %s)',
+                [product.pk, product.title, product.description, CATEGORIES.get(product.category, product.category)],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_search_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_product_publish_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
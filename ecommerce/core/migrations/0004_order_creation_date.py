@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='creation_date',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.3 on 2026-10-18 04:51
+
+from django.db import migrations, models
+
+
+def merge_duplicate_order_items(apps, schema_editor):
+    # Lost update races left some orders with several rows for the same product
+    OrderItem = apps.get_model('core', 'OrderItem')
+    duplicates = (
+        OrderItem.objects.values('order', 'item')
+        .annotate(rows=models.Count('id'), total=models.Sum('quantity'), keep=models.Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        items = OrderItem.objects.filter(order=duplicate['order'], item=duplicate['item'])
+        items.exclude(id=duplicate['keep']).delete()
+        items.filter(id=duplicate['keep']).update(quantity=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_order_creation_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_order_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='orderitem_order_item_unique'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.3 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+def merge_duplicate_active_orders(apps, schema_editor):
+    # new_or_get used to create a second active order when it lost a race, move
+    # the items of every extra active order without a payment into the user's newest one
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    users = (
+        Order.objects.filter(is_active=True, user__isnull=False)
+        .values('user').annotate(orders=models.Count('id'), keep=models.Max('id'))
+        .filter(orders__gt=1)
+    )
+    for user in users.iterator():
+        extra = Order.objects.filter(user=user['user'], is_active=True).exclude(id=user['keep'])
+        # Orders with a payment in flight keep their items for the payment, they just stop being a cart
+        extra.filter(payment__isnull=False).update(is_active=False)
+        for item in OrderItem.objects.filter(order__in=extra):
+            kept, created = OrderItem.objects.get_or_create(
+                order_id=user['keep'], item_id=item.item_id, defaults={'quantity': item.quantity},
+            )
+            if not created:
+                OrderItem.objects.filter(pk=kept.pk).update(quantity=models.F('quantity') + item.quantity)
+            item.delete()
+        # Only orders without a payment are left in `extra`
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_orderitem_unique_order_item'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_active_orders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-publish_date', '-id'], name='review_product_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(is_active=True), fields=('user',), name='order_one_active_per_user'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.3 on 2026-10-18 05:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def summarize_existing_reviews(apps, schema_editor):
+    ProductRating = apps.get_model('core', 'ProductRating')
+    Review = apps.get_model('core', 'Review')
+    rows = Review.objects.order_by().values('product').annotate(
+        count=models.Count('id'),
+        total=models.Sum('rating'),
+        **{f'rating_{rating}': models.Count('id', filter=models.Q(rating=rating)) for rating in range(1, 6)},
+    )
+    ProductRating.objects.bulk_create(
+        (ProductRating(product_id=row.pop('product'), **row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_order_review_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='core.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(summarize_existing_reviews, migrations.RunPython.noop),
+    ]
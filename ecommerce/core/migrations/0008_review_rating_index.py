@@ -0,0 +1,17 @@
+# Generated by Django 3.1.3 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_productrating'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-rating', '-publish_date', '-id'], name='review_product_rating_idx'),
+        ),
+    ]
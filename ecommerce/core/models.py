@@ -1,7 +1,13 @@
-from django.db import models
+import datetime
+import uuid
+
+from django.db import IntegrityError, connection, models, transaction
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from django.db.models.functions import Coalesce
+from django.http import QueryDict
 from django.urls import reverse
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 
@@ -44,6 +50,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def get_short_name(self):
+        # Shown next to reviews, without giving away the email address
+        return self.email.split('@')[0]
+
     @property
     def is_staff(self):
         return self.is_admin
@@ -55,52 +65,74 @@ class Product(models.Model):
         ('BK', 'Book'),
         ('CG', 'Clothing'),
     ]
+    # Stock keeping unit, the product's id in the catalog imports (see import_products)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     title = models.CharField(max_length=200)
     description = models.TextField()
     price = models.FloatField()
     image = models.ImageField(upload_to='products', null=True, blank=True)
+    # Content hash of the image, names its resized variants (see core.images)
+    image_hash = models.CharField(max_length=16, blank=True, editable=False)
     publish_date = models.DateField(auto_now_add=True)
     category = models.CharField(max_length=100, choices=CATEGORY_CHOICES)
+
+    class Meta:
+        indexes = [
+            # Backs the keyset pagination of the catalog listing
+            models.Index(fields=['-publish_date', '-id'], name='product_publish_date_idx'),
+        ]
     
     def __str__(self):
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored image and title, so saving can tell what changed
+        instance._loaded_image = instance.__dict__.get('image')
+        instance._loaded_title = instance.__dict__.get('title')
+        return instance
+
+    @property
+    def image_changed(self):
+        return not hasattr(self, '_loaded_image') or self._loaded_image != self.image.name
+
+    @property
+    def title_changed(self):
+        return not hasattr(self, '_loaded_title') or self._loaded_title != self.title
     
     def get_absolute_url(self):
         return reverse("core:product-detail", kwargs={"product_id": self.pk})
     
-class OrderManager(models.Manager):
+def order_total(quantity, price):
+    """SUM(quantity * price) over order items, 0 for an order without items."""
+    return Coalesce(
+        models.Sum(models.F(quantity) * models.F(price), output_field=models.FloatField()),
+        models.Value(0.0),
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate every order with its `total` price."""
+        return self.annotate(total=order_total('orderitem__quantity', 'orderitem__item__price'))
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+    def abandoned_guest_carts(self, before):
+        """Active guest orders without items or payments, created before `before`."""
+        return self.get_queryset().filter(
+            models.Q(creation_date__lt=before) | models.Q(creation_date__isnull=True),
+            user__isnull=True,
+            is_active=True,
+            orderitem__isnull=True,
+            payment__isnull=True,
+        )
+
     def new_or_get(self, request):
-        order_id = request.session.get('order_id', None)
-        qs = self.get_queryset().filter(id=order_id)
-        qs_auth_count = 0
-        if request.user.is_authenticated:
-            qs_auth_count = self.get_queryset().filter(user=request.user, is_active=True).count()
-        if qs.count() == 1 and qs_auth_count == 0:
-            new_obj = False
-            order = qs.first()
-            if request.user.is_authenticated and order.user is None:
-                order.user = request.user
-                order.save()
-            return order, new_obj
-        else: # No order id in session
-            # TODO: What happens when active order is different from guest order, and the user logs in? Currently the active order is selected if an active order exists. Maybe we should merge the guest and active(user authenticated) order.
-            if request.user.is_authenticated:
-                qs = self.get_queryset().filter(user=request.user, is_active=True)
-                if qs.count() == 1:
-                    new_obj = False
-                    order = qs.first()
-                else:
-                    order = Order(user=request.user)
-                    order.save()
-                    new_obj = True
-                request.session['order_id'] = order.id
-                return order, new_obj
-            else:
-                order = Order()
-                order.save()
-                new_obj = True
-                request.session['order_id'] = order.id
-                return order, new_obj
+        """Return (order, created) for the request's cart, see core.cart.resolve_cart."""
+        from .cart import resolve_cart
+        return resolve_cart(request)
 
 
 
@@ -109,25 +141,78 @@ class Order(models.Model):
     # order_number = models.CharField(max_length=6, default='123', unique=True)
     placement_date = models.DateField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Null for orders created before the field existed
+    creation_date = models.DateTimeField(auto_now_add=True, null=True)
     
     objects = OrderManager()
 
+    class Meta:
+        constraints = [
+            # Also the index for finding a user's cart, and guest carts by user IS NULL
+            models.UniqueConstraint(fields=['user'], condition=models.Q(is_active=True), name='order_one_active_per_user'),
+        ]
+
     def __str__(self):
         return f'Order #{self.pk}'
     
     @property
     def total_price(self):
-        total = 0
-        for item in self.orderitem_set.all():
-            total = total + item.total_price
-        return total
+        # Orders from with_totals() already carry the total
+        if hasattr(self, 'total'):
+            return self.total
+        return self.orderitem_set.aggregate(total=order_total('quantity', 'item__price'))['total']
+
 
 
+class OrderItemManager(models.Manager):
+    def for_cart(self, order):
+        """The order's items joined with their products, ready to render."""
+        return self.get_queryset().filter(order=order).select_related('item').order_by('id')
+
+    # Every mutation is a single statement, so concurrent requests can't lose updates
+    def add_one(self, order, product):
+        """Add one of `product` to `order` and return True if it wasn't in the order yet."""
+        items = self.get_queryset().filter(order=order, item=product)
+        if items.update(quantity=models.F('quantity') + 1):
+            return False
+        try:
+            with transaction.atomic():
+                self.create(order=order, item=product, quantity=1)
+            return True
+        except IntegrityError:
+            # Another request added the item between the update and the insert
+            items.update(quantity=models.F('quantity') + 1)
+            return False
+
+    def remove_one(self, order, product):
+        """
+        Remove one of `product` from `order`. Return True if that removed the
+        item from the order, False if only its quantity went down and None if
+        the product isn't in the order.
+        """
+        items = self.get_queryset().filter(order=order, item=product)
+        if items.filter(quantity__gt=1).update(quantity=models.F('quantity') - 1):
+            return False
+        deleted, _ = items.filter(quantity__lte=1).delete()
+        return True if deleted else None
+
+    def remove_all(self, order, product):
+        """Remove `product` from `order` and return False if it wasn't in the order."""
+        deleted, _ = self.get_queryset().filter(order=order, item=product).delete()
+        return bool(deleted)
+
 
 class OrderItem(models.Model):
     item = models.ForeignKey(Product, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+
+    objects = OrderItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'item'], name='orderitem_order_item_unique'),
+        ]
     
     def __str__(self):
         return f'{self.quantity} of {self.item.title}'
@@ -185,13 +270,312 @@ class Payment(models.Model):
         self.item_name = f"Order #{self.order.id}"
         super().save(*args, **kwargs)
 
+class JobManager(models.Manager):
+    def claimable(self, now=None):
+        """Jobs that are due, and claimed ones whose worker has stopped responding."""
+        now = now or timezone.now()
+        stale = now - datetime.timedelta(seconds=self.model.setting('LOCK_TIMEOUT'))
+        return self.get_queryset().filter(
+            models.Q(status=Job.PENDING, available_at__lte=now)
+            | models.Q(status=Job.PROCESSING, locked_at__lt=stale)
+        )
+
+    def claim(self, worker, limit):
+        """
+        Lock up to `limit` due jobs for `worker` and return them. The claim is
+        a conditional update, so concurrent workers never get the same job. On
+        databases with SKIP LOCKED they also don't wait for each other's
+        candidate rows.
+        """
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        claim = {
+            'status': Job.PROCESSING,
+            'claim_token': token,
+            'locked_by': worker,
+            'locked_at': now,
+            'attempts': models.F('attempts') + 1,
+        }
+        candidates = self.claimable(now).order_by('available_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+                self.claimable(now).filter(pk__in=ids).update(**claim)
+        else:
+            # One UPDATE ... WHERE id IN (SELECT ... LIMIT) statement, so no other worker can claim in between
+            self.claimable(now).filter(pk__in=candidates.values('id')[:limit]).update(**claim)
+        return list(self.get_queryset().filter(claim_token=token).order_by('available_at', 'id'))
+
+
+class Job(models.Model):
+    """
+    A row of a database backed work queue. Workers claim jobs with
+    JobManager.claim(), and then finish() them or retry_or_fail(). The
+    <SETTINGS_PREFIX>_MAX_ATTEMPTS, _RETRY_DELAY and _LOCK_TIMEOUT settings
+    control retries and reclaiming.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    SETTINGS_PREFIX = None
+
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def setting(cls, name):
+        return getattr(settings, f'{cls.SETTINGS_PREFIX}_{name}')
+
+    def _update_claimed(self, **fields):
+        # The claim token guards against a worker that lost its claim after the lock timed out
+        return type(self).objects.filter(pk=self.pk, claim_token=self.claim_token).update(**fields)
+
+    def finish(self, **fields):
+        """Mark the claimed job as done, setting `fields` as well."""
+        self._update_claimed(status=Job.DONE, last_error='', processed_at=timezone.now(), **fields)
+
+    def retry_or_fail(self, error):
+        """
+        Put the claimed job back in the queue after a delay that doubles every
+        attempt, or mark it as failed after the last attempt. Returns the new status.
+        """
+        if self.attempts >= self.setting('MAX_ATTEMPTS'):
+            status, available_at = Job.FAILED, self.available_at
+        else:
+            delay = self.setting('RETRY_DELAY') * 2 ** (self.attempts - 1)
+            status, available_at = Job.PENDING, timezone.now() + datetime.timedelta(seconds=delay)
+        self._update_claimed(status=status, available_at=available_at, last_error=error)
+        return status
+
+
+class PaymentNotification(Job):
+    """
+    An Instant Transaction Notification (ITN) from PayFast, stored as received
+    and processed later by the process_payment_notifications workers.
+    """
+    SETTINGS_PREFIX = 'PAYMENT_NOTIFICATION'
+
+    # The url encoded POST data, field order matters for the signature
+    payload = models.TextField()
+    referer = models.CharField(max_length=200, blank=True)
+    payment = models.ForeignKey(Payment, null=True, blank=True, on_delete=models.SET_NULL)
+    # What processing decided, e.g. the payment status or that it was a duplicate
+    outcome = models.CharField(max_length=50, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Backs the workers' search for due notifications
+            models.Index(fields=['status', 'available_at'], name='notification_due_idx'),
+            models.Index(fields=['claim_token'], name='notification_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'Notification {self.pk} for payment {self.payment_id} ({self.status})'
+
+    @property
+    def data(self):
+        return QueryDict(self.payload).dict()
+
+
+class OutboxEmailManager(JobManager):
+    def enqueue(self, key, to, subject, body):
+        """
+        Queue an email for send_outbox_emails. Call it in the transaction that
+        makes the change the email is about, so the email is sent if and only
+        if the change is committed. An email is queued once per `key`.
+        """
+        email, created = self.get_or_create(key=key, defaults={'to': to, 'subject': subject, 'body': body})
+        return email
+
+
+class OutboxEmail(Job):
+    """An email waiting to be sent, written in the same transaction as the change it reports."""
+    SETTINGS_PREFIX = 'OUTBOX_EMAIL'
+
+    # Identifies what the email is about, e.g. order-confirmation:12
+    key = models.CharField(max_length=100, unique=True)
+    to = models.EmailField(max_length=255)
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_due_idx'),
+            models.Index(fields=['claim_token'], name='outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to} ({self.status})'
+
+
+class ReviewManager(models.Manager):
+    def for_product(self, product):
+        """The product's reviews joined with their authors, ready to render."""
+        return self.get_queryset().filter(product=product).select_related('user').order_by('-publish_date', '-id')
+
+
 class Review(models.Model):
+    # Keyset orderings for listing a product's reviews, each backed by an index
+    ORDERINGS = {
+        'recent': ('-publish_date', '-id'),
+        'rating': ('-rating', '-publish_date', '-id'),
+    }
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     rating = models.IntegerField()
     content = models.TextField(null=True, blank=True)
     publish_date = models.DateField(auto_now_add=True)
 
+    objects = ReviewManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-publish_date', '-id'], name='review_product_date_idx'),
+            models.Index(fields=['product', '-rating', '-publish_date', '-id'], name='review_product_rating_idx'),
+        ]
+
     def __str__(self):
         return f'{self.product} with rating of {self.rating}'
-    
\ No newline at end of file
+    
+
+class ProductRatingManager(models.Manager):
+    # Summaries are kept up to date with single UPDATE statements, so concurrent reviews don't lose counts
+    def _changes(self, rating, sign):
+        changes = {
+            'count': models.F('count') + sign,
+            'total': models.F('total') + sign * rating,
+        }
+        if 1 <= rating <= 5:
+            changes[f'rating_{rating}'] = models.F(f'rating_{rating}') + sign
+        return changes
+
+    def add_rating(self, product_id, rating):
+        summaries = self.get_queryset().filter(product_id=product_id)
+        if summaries.update(**self._changes(rating, 1)):
+            return
+        fields = {'count': 1, 'total': rating}
+        if 1 <= rating <= 5:
+            fields[f'rating_{rating}'] = 1
+        try:
+            with transaction.atomic():
+                self.create(product_id=product_id, **fields)
+        except IntegrityError:
+            # Another review created the summary between the update and the insert
+            summaries.update(**self._changes(rating, 1))
+
+    def remove_rating(self, product_id, rating):
+        self.get_queryset().filter(product_id=product_id).update(**self._changes(rating, -1))
+
+    def reconcile(self, batch_size=1000):
+        """
+        Rebuild every summary from the reviews with one GROUP BY query and bulk
+        writes. Return the number of summaries created, updated and deleted.
+        """
+        fields = ['count', 'total'] + [f'rating_{rating}' for rating in range(1, 6)]
+        aggregates = {
+            'count': models.Count('id'),
+            'total': models.Sum('rating'),
+            **{f'rating_{rating}': models.Count('id', filter=models.Q(rating=rating)) for rating in range(1, 6)},
+        }
+        expected = {
+            row.pop('product'): row
+            for row in Review.objects.order_by().values('product').annotate(**aggregates)
+        }
+        to_create, to_update = [], []
+        with transaction.atomic():
+            existing = self.get_queryset().in_bulk()
+            for product_id, values in expected.items():
+                summary = existing.pop(product_id, None)
+                if summary is None:
+                    to_create.append(self.model(product_id=product_id, **values))
+                elif any(getattr(summary, field) != values[field] for field in fields):
+                    for field in fields:
+                        setattr(summary, field, values[field])
+                    to_update.append(summary)
+            self.bulk_create(to_create, batch_size=batch_size)
+            self.bulk_update(to_update, fields, batch_size=batch_size)
+            # Whatever is left has no reviews anymore
+            deleted, _ = self.get_queryset().filter(pk__in=list(existing)).delete()
+        return len(to_create), len(to_update), deleted
+
+
+class ProductRating(models.Model):
+    """Review count, rating total and histogram of a product, so listings don't aggregate reviews."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    objects = ProductRatingManager()
+
+    def __str__(self):
+        return f'{self.product} rated {self.average:.1f} by {self.count}'
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else 0
+
+    @property
+    def histogram(self):
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
+
+
+class CatalogVersionManager(models.Manager):
+    def current(self, name):
+        """The version of `name`, 0 until it is first bumped."""
+        return self.get_queryset().filter(name=name).values_list('version', flat=True).first() or 0
+
+    def bump(self, name):
+        """Record a change to `name` and return the new version."""
+        versions = self.get_queryset().filter(name=name)
+        if not versions.update(version=models.F('version') + 1):
+            try:
+                with transaction.atomic():
+                    self.create(name=name, version=1)
+            except IntegrityError:
+                # Another process created the counter between the update and the insert
+                versions.update(version=models.F('version') + 1)
+        return self.current(name)
+
+
+class CatalogVersion(models.Model):
+    """
+    Change counters the in-memory catalog indexes (core.trigram, core.autocomplete)
+    compare their own version with, so every process notices changes made by others.
+    """
+    TITLES = 'titles'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = CatalogVersionManager()
+
+    def __str__(self):
+        return f'{self.name} at version {self.version}'
@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1 / `rate` seconds apart. No limit when `rate` is falsy."""
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = None
+
+    def wait(self):
+        now = self.clock()
+        if self.next_at is not None and now < self.next_at:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def send_batch(worker, batch_size, connection, limiter):
+    """
+    Claim and send up to `batch_size` outbox emails over `connection`,
+    returning how many were claimed. Failed emails are retried later, and
+    left as failed after OUTBOX_EMAIL_MAX_ATTEMPTS.
+    """
+    emails = OutboxEmail.objects.claim(worker, batch_size)
+    for email in emails:
+        limiter.wait()
+        message = EmailMessage(email.subject, email.body, settings.EMAIL_HOST_USER, [email.to], connection=connection)
+        try:
+            # An open connection is left open by send(), and reused for the next email
+            connection.open()
+            message.send()
+        except Exception as e:
+            status = email.retry_or_fail(f'{type(e).__name__}: {e}')
+            logger.warning('Outbox email %s failed on attempt %s (%s): %s', email.pk, email.attempts, status, e)
+            # The connection may be broken, open a new one for the next email
+            connection.close()
+        else:
+            email.finish()
+    return len(emails)
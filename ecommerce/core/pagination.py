@@ -0,0 +1,182 @@
+import base64
+import json
+from collections.abc import Sequence
+
+from django.db.models import Q
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, [str(value) for value in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise InvalidCursor('Malformed cursor.')
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Malformed cursor.')
+    return direction, values
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self)} objects>'
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by the values of its ordering fields instead of OFFSET,
+    so every page costs one indexed range scan however deep the cursor is.
+    The last field in `ordering` must be unique (normally the primary key).
+    """
+    NEXT = NEXT
+    PREVIOUS = PREVIOUS
+
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = int(page_size)
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering
+        ]
+
+    def encode_cursor(self, direction, obj):
+        return encode_cursor(direction, [getattr(obj, field.attname) for field in self.fields])
+
+    def decode_cursor(self, cursor):
+        direction, values = decode_cursor(cursor, len(self.fields))
+        try:
+            key = [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor('Malformed cursor.')
+        return direction, key
+
+    def _seek(self, key, forward):
+        # Build (a < x) OR (a = x AND b < y) ... for the ordering fields
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            term = Q(**{f'{self.fields[i].name}__{lookup}': key[i]})
+            for j in range(i):
+                term &= Q(**{self.fields[j].name: key[j]})
+            condition |= term
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+
+    def page(self, cursor=None):
+        """Return the page for `cursor`, raising InvalidCursor if it can't be decoded."""
+        if not cursor:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.page_size + 1])
+            has_next, has_previous = len(rows) > self.page_size, False
+            rows = rows[:self.page_size]
+        else:
+            direction, key = self.decode_cursor(cursor)
+            if direction == self.NEXT:
+                qs = self.queryset.filter(self._seek(key, forward=True)).order_by(*self.ordering)
+                rows = list(qs[:self.page_size + 1])
+                has_next, has_previous = len(rows) > self.page_size, True
+                rows = rows[:self.page_size]
+            else:
+                qs = self.queryset.filter(self._seek(key, forward=False)).order_by(*self._reversed_ordering())
+                rows = list(qs[:self.page_size + 1])
+                has_next, has_previous = True, len(rows) > self.page_size
+                rows = rows[:self.page_size][::-1]
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(self.NEXT, rows[-1])
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(self.PREVIOUS, rows[0])
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        """Like page(), but fall back to the first page for a bad cursor."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+
+class RankedPaginator:
+    """
+    Paginate a list of primary keys that is already in its final order (e.g.
+    search results ranked by relevance). Cursors hold the pk at the page
+    boundary, so a page only loads the rows it shows.
+    """
+    def __init__(self, queryset, ids, page_size):
+        self.queryset = queryset
+        self.ids = list(ids)
+        self.page_size = int(page_size)
+        self.positions = {pk: i for i, pk in enumerate(self.ids)}
+
+    def _position(self, cursor):
+        direction, (value,) = decode_cursor(cursor, 1)
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+        except Exception:
+            raise InvalidCursor('Malformed cursor.')
+        if pk not in self.positions:
+            raise InvalidCursor('Cursor no longer matches the result set.')
+        return direction, self.positions[pk]
+
+    def page(self, cursor=None):
+        """Return the page for `cursor`, raising InvalidCursor if it can't be used."""
+        if not cursor:
+            start = 0
+        else:
+            direction, position = self._position(cursor)
+            start = position + 1 if direction == NEXT else max(position - self.page_size, 0)
+        page_ids = self.ids[start:start + self.page_size]
+        objects = self.queryset.in_bulk(page_ids)
+        rows = [objects[pk] for pk in page_ids if pk in objects]
+
+        next_cursor = previous_cursor = None
+        if page_ids and start + self.page_size < len(self.ids):
+            next_cursor = encode_cursor(NEXT, [page_ids[-1]])
+        if page_ids and start > 0:
+            previous_cursor = encode_cursor(PREVIOUS, [page_ids[0]])
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        """Like page(), but fall back to the first page for a bad cursor."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
@@ -0,0 +1,144 @@
+import hashlib
+import threading
+from urllib.parse import quote_plus, urlencode
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def signature(data):
+    """The MD5 signature PayFast expects over the url encoded data, in the order given."""
+    return hashlib.md5(urlencode(data, quote_via=quote_plus).encode()).hexdigest()
+
+
+def payment_data(payment, address):
+    """The signed form data that sends the customer to PayFast to pay `payment`."""
+    data = {
+        'merchant_id': settings.PAYFAST_MERCHANT_ID,
+        'merchant_key': settings.PAYFAST_MERCHANT_KEY,
+        'return_url': settings.PAYFAST_RETURN_URL,
+        'cancel_url': settings.PAYFAST_CANCEL_URL,
+        'notify_url': settings.PAYFAST_NOTIFY_URL,
+        'name_first': address.name.strip(), #TODO improve client side validation, and when instance is saved, strip then...?
+        'cell_number': address.mobile_number.strip(),
+        'm_payment_id': payment.id,
+        'amount': payment.amount,
+        'item_name': payment.item_name,
+        # 'email_confirmation': 1, 1=on 0=off
+        # 'passphrase': settings.PAYFAST_PASSPHRASE,
+    }
+    data['signature'] = signature(data)
+    return data
+
+
+class ValidationUnavailable(Exception):
+    """PayFast couldn't be asked to validate a notification, try again later."""
+
+
+def failed_checks(data, referer, payment):
+    """
+    Run security checks 1-3 on the data of a notification for `payment` and
+    return the names of the ones that failed.
+    """
+    failed = []
+    # Security check 1: Verify signature
+    # data['passphrase'] = settings.PAYFAST_PASSPHRASE
+    data = dict(data)
+    if data.pop('signature', None) != signature(data):
+        failed.append('signature')
+    # Security check 2: Verify the request is coming from a valid PayFast domain
+    if referer not in settings.PAYFAST_DOMAINS:
+        failed.append('host')
+    # Security check 3: Confirm payment amount from PayFast is the same as amount in database
+    try:
+        amount = float(data.get('amount_gross'))
+    except (TypeError, ValueError):
+        amount = None
+    if amount != payment.amount:
+        failed.append('amount')
+    return failed
+
+
+class PayFastClient:
+    """
+    Talks to the PayFast server API over a pool of at most `pool_size`
+    keep-alive connections. Connection errors and 5xx responses are retried
+    with exponential backoff, and every attempt is bounded by the timeout.
+    Thread safe, so one client serves all the workers of a process.
+    """
+    def __init__(self, query_url, timeout, retries, backoff, pool_size):
+        self.query_url = query_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            # Wait for a free connection rather than opening more than pool_size
+            pool_block=True,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=(500, 502, 503, 504),
+                # Validating is read only, so POSTs are safe to repeat
+                allowed_methods=frozenset(['POST']),
+            ),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.PAYFAST_QUERY_URL,
+            timeout=settings.PAYFAST_VALIDATION_TIMEOUT,
+            retries=settings.PAYFAST_VALIDATION_RETRIES,
+            backoff=settings.PAYFAST_VALIDATION_BACKOFF,
+            pool_size=settings.PAYFAST_POOL_SIZE,
+        )
+
+    def validate(self, data):
+        """Security check 4: ask PayFast whether it sent the notification with `data`."""
+        try:
+            response = self.session.post(self.query_url, data=data, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ValidationUnavailable(str(e))
+        return response.text.strip() == 'VALID'
+
+    async def validate_async(self, data):
+        """validate() for async code. The pooled call runs in a thread, so the event loop isn't blocked."""
+        return await sync_to_async(self.validate, thread_sensitive=False)(data)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process wide PayFast client, created from the settings on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PayFastClient.from_settings()
+    return _client
+
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+def validate_with_server(data):
+    return get_client().validate(data)
+
+
+async def validate_with_server_async(data):
+    return await get_client().validate_async(data)
@@ -0,0 +1,97 @@
+import datetime
+import logging
+import os
+import socket
+
+from django.conf import settings
+from django.db import transaction
+
+from . import payfast
+from .cart import get_cart_backend
+from .models import OutboxEmail, Payment, PaymentNotification
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def enqueue(request):
+    """Store a PayFast notification as received, for a worker to process."""
+    data = request.POST
+    try:
+        payment_id = int(data.get('m_payment_id'))
+    except (TypeError, ValueError):
+        payment_id = None
+    if payment_id is not None and not Payment.objects.filter(pk=payment_id).exists():
+        payment_id = None
+    return PaymentNotification.objects.create(
+        payload=data.urlencode(),
+        referer=request.headers.get('Referer', '')[:200],
+        payment_id=payment_id,
+    )
+
+
+def process(notification):
+    """
+    Verify a notification and apply it to its payment and order, returning
+    the outcome. Notifications are applied at most once per payment: only a
+    processing payment can fail, and a successful payment is never changed.
+    Raises on errors that are worth retrying, e.g. PayFast being unreachable.
+    """
+    payment = notification.payment
+    if payment is None:
+        return 'unknown payment'
+    if payment.status == 'S':
+        return 'duplicate'
+
+    data = notification.data
+    failed = payfast.failed_checks(data, notification.referer, payment)
+    if not failed and settings.PAYFAST_SERVER_VALIDATION and not payfast.validate_with_server(data):
+        failed.append('server')
+
+    with transaction.atomic():
+        if failed:
+            updated = Payment.objects.filter(pk=payment.pk, status='P').update(status='U')
+            outcome = f'unsuccessful: {", ".join(failed)}'
+        else:
+            # A forged notification may have failed the payment first, or the buyer may have come back
+            # through the cancel url, the genuine one still goes through
+            updated = Payment.objects.filter(pk=payment.pk, status__in=['P', 'U', 'C']).update(status='S')
+            outcome = 'successful'
+        if not updated:
+            return 'duplicate'
+        if not failed:
+            # Place order if payment is successful. TODO: Maybe change the business logic?
+            order = payment.order
+            order.placement_date = datetime.date.today()
+            order.is_active = False
+            order.save()
+            transaction.on_commit(lambda: get_cart_backend().forget(order))
+            if order.user is not None:
+                OutboxEmail.objects.enqueue(
+                    f'order-confirmation:{order.pk}',
+                    order.user.email,
+                    f'{payment.item_name} confirmation',
+                    f'Dear {order.user.get_short_name()} \n\nYour order has been placed.',
+                )
+    return outcome
+
+
+def process_batch(worker, batch_size):
+    """Claim and process up to `batch_size` notifications, returning how many were claimed."""
+    notifications = PaymentNotification.objects.claim(worker, batch_size)
+    payments = Payment.objects.select_related('order__user').in_bulk(
+        [notification.payment_id for notification in notifications if notification.payment_id]
+    )
+    for notification in notifications:
+        notification.payment = payments.get(notification.payment_id)
+        try:
+            outcome = process(notification)
+        except Exception as e:
+            status = notification.retry_or_fail(f'{type(e).__name__}: {e}')
+            logger.warning('Payment notification %s failed on attempt %s (%s): %s', notification.pk, notification.attempts, status, e)
+        else:
+            notification.finish(outcome=outcome)
+    return len(notifications)
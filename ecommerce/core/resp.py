@@ -0,0 +1,185 @@
+"""
+A small client for servers that speak the Redis protocol (RESP), enough for
+the key-value cart backend without depending on a Redis package.
+"""
+import select
+import socket
+import threading
+from urllib.parse import unquote, urlparse
+
+
+class RESPError(Exception):
+    """An error reply from the server."""
+
+
+class RESPConnectionError(ConnectionError):
+    """The server couldn't be reached, or the connection broke."""
+
+
+class RESPReplyError(RESPConnectionError):
+    """The connection broke after the commands were sent, so they may have run."""
+
+
+class RESPTimeoutError(RESPReplyError):
+    """The server didn't reply in time, the commands may still run."""
+
+
+# Commands that can be sent again without changing the outcome if they already ran
+IDEMPOTENT_COMMANDS = frozenset(['PING', 'AUTH', 'SELECT', 'HGETALL', 'HDEL', 'DEL', 'EXPIRE'])
+
+
+def encode_command(args):
+    parts = [f'*{len(args)}\r\n'.encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+class Connection:
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.file = self.sock.makefile('rb')
+
+    def send(self, commands):
+        self.sock.sendall(b''.join(encode_command(args) for args in commands))
+
+    def read_reply(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise RESPConnectionError('Connection closed by the server.')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return RESPError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.file.read(length + 2)
+            if len(data) != length + 2:
+                raise RESPConnectionError('Connection closed by the server.')
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RESPConnectionError(f'Unexpected reply {line!r}.')
+
+    def is_stale(self):
+        # Between pipelines there is nothing to read, unless the server closed the connection
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return bool(readable)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class RESPClient:
+    """
+    Sends commands over one connection per thread, opened on first use and
+    again when the server has closed it. Commands are only sent a second time
+    if they never reached the server, or can safely run twice.
+    """
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=1):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """A client for a redis://[:password@]host[:port][/db] URL."""
+        parts = urlparse(url)
+        db = parts.path.strip('/')
+        return cls(
+            host=parts.hostname or '127.0.0.1',
+            port=parts.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parts.password) if parts.password else None,
+            **kwargs,
+        )
+
+    def connect(self):
+        try:
+            connection = Connection(self.host, self.port, self.timeout)
+        except OSError as e:
+            raise RESPConnectionError(f'Could not connect to {self.host}:{self.port}: {e}') from e
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            for reply in self._send(connection, setup):
+                if isinstance(reply, RESPError):
+                    connection.close()
+                    raise reply
+        return connection
+
+    def _send(self, connection, commands):
+        try:
+            connection.send(commands)
+        except OSError as e:
+            raise RESPConnectionError(str(e)) from e
+        try:
+            return [connection.read_reply() for _ in commands]
+        except socket.timeout as e:
+            raise RESPTimeoutError(f'No reply from {self.host}:{self.port} in {self.timeout}s.') from e
+        except (OSError, RESPConnectionError) as e:
+            raise RESPReplyError(str(e)) from e
+
+    def pipeline(self, *commands):
+        """
+        Send `commands` in one round trip and return their replies. An error
+        reply to any of them is raised as RESPError after reading them all.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None and connection.is_stale():
+            # e.g. the server closed an idle connection
+            self.close()
+            connection = None
+        replies = None
+        if connection is not None:
+            try:
+                replies = self._send(connection, commands)
+            except RESPTimeoutError:
+                # A late reply would be read as the next pipeline's
+                self.close()
+                raise
+            except RESPReplyError:
+                self.close()
+                if not all(str(args[0]).upper() in IDEMPOTENT_COMMANDS for args in commands):
+                    raise
+            except RESPConnectionError:
+                # Nothing was sent, so trying again on a new connection can't run anything twice
+                self.close()
+        if replies is None:
+            connection = self.local.connection = self.connect()
+            try:
+                replies = self._send(connection, commands)
+            except RESPConnectionError:
+                self.close()
+                raise
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+    def close(self):
+        """Close the calling thread's connection."""
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,168 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+FTS_TABLE = 'core_product_fts'
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of the title, description and category columns
+FTS_WEIGHTS = (10.0, 1.0, 2.0)
+
+# Must stay identical to the expression indexed in migration 0003,
+# otherwise PostgreSQL can't use the GIN index.
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('english', "
+    "CASE category WHEN 'CP' THEN 'Computers' WHEN 'BK' THEN 'Book' "
+    "WHEN 'CG' THEN 'Clothing' ELSE coalesce(category, '') END), 'C')"
+)
+
+
+def search_terms(text):
+    return [word.lower() for word in WORD_RE.findall(text or '')]
+
+
+class BaseSearchBackend:
+    """
+    A search backend returns product ids for a query, best match first, and
+    is told about product changes so it can keep its index in sync.
+    """
+    def search(self, text, limit):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        pass
+
+    def index_products(self, products):
+        for product in products:
+            self.index_product(product)
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        """Rebuild the whole index and return the number of indexed products."""
+        return Product.objects.count()
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Unindexed fallback: every word must appear in the title."""
+    def search(self, text, limit):
+        qs = Product.objects.all()
+        for term in search_terms(text):
+            qs = qs.filter(title__icontains=term)
+        return list(qs.order_by('-publish_date', '-id').values_list('id', flat=True)[:limit])
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """Full-text search using an FTS5 table ranked with bm25()."""
+    def match_expression(self, text):
+        # Quote every word so user input can't inject FTS5 syntax, and match prefixes
+        return ' '.join(f'"{term}"*' for term in search_terms(text))
+
+    def search(self, text, limit):
+        expression = self.match_expression(text)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s) LIMIT %s',
+                [expression, *FTS_WEIGHTS, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)',
+                [product.pk, product.title, product.description, product.get_category_display()],
+            )
+
+    def index_products(self, products):
+        categories = dict(Product.CATEGORY_CHOICES)
+        rows = [(p.pk, p.title, p.description, categories.get(p.category, p.category)) for p in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)', rows)
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        categories = dict(Product.CATEGORY_CHOICES)
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            rows = Product.objects.values_list('id', 'title', 'description', 'category')
+            batch = []
+            for pk, title, description, category in rows.iterator(chunk_size=2000):
+                batch.append((pk, title, description, categories.get(category, category)))
+                if len(batch) == 2000:
+                    cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)', batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)', batch)
+                count += len(batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return count
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Full-text search over a GIN expression index. The index is maintained by
+    PostgreSQL itself, so there is nothing to do on product changes.
+    """
+    def search(self, text, limit):
+        terms = search_terms(text)
+        if not terms:
+            return []
+        query = ' & '.join(f'{term}:*' for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM core_product WHERE ({POSTGRES_DOCUMENT}) @@ to_tsquery('english', %s) "
+                f"ORDER BY ts_rank_cd({POSTGRES_DOCUMENT}, to_tsquery('english', %s)) DESC, id DESC LIMIT %s",
+                [query, query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def fts_table_exists():
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+_backend = None
+
+def get_search_backend():
+    """
+    Return the configured search backend. Without a SEARCH_BACKEND setting
+    the backend is picked from the database vendor.
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite' and fts_table_exists():
+            _backend = SQLiteFTSSearchBackend()
+        else:
+            _backend = SimpleSearchBackend()
+    return _backend
+
+
+def reset_search_backend(**kwargs):
+    global _backend
+    _backend = None
@@ -0,0 +1,111 @@
+import logging
+
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .async_views import reset_executor
+from .autocomplete import loaded_autocomplete_index
+from .cart import get_cart_backend, reset_cart_backend
+from .images import process_product_image
+from .models import CatalogVersion, Product, ProductRating, Review
+from .payfast import reset_client
+from .search import get_search_backend, reset_search_backend
+from .trigram import loaded_trigram_index
+
+logger = logging.getLogger(__name__)
+
+
+def titles_changed(*indexes):
+    """
+    Bump the titles version after a product change the loaded indexes have
+    already applied, so only the other processes rebuild theirs.
+    """
+    version = CatalogVersion.objects.bump(CatalogVersion.TITLES)
+    for index in indexes:
+        if index is not None and index.version == version - 1:
+            # Nobody else changed a title since the index was in step
+            index.version = version
+
+
+@receiver(post_save, sender=Product)
+def process_image(sender, instance, **kwargs):
+    if instance.image_changed or (instance.image and not instance.image_hash):
+        try:
+            process_product_image(instance)
+        except OSError:
+            logger.exception('Could not create image variants for product %s.', instance.pk)
+        instance._loaded_image = instance.image.name
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index_product(instance)
+    if not instance.title_changed:
+        return
+    # The trigram index is built lazily, there is nothing to update until it exists
+    trigram_index = loaded_trigram_index()
+    if trigram_index is not None:
+        trigram_index.add(instance.pk, instance.title)
+    autocomplete_index = loaded_autocomplete_index()
+    if autocomplete_index is not None:
+        autocomplete_index.add(instance.pk, instance.title)
+    titles_changed(trigram_index, autocomplete_index)
+    instance._loaded_title = instance.title
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_product(instance.pk)
+    trigram_index = loaded_trigram_index()
+    if trigram_index is not None:
+        trigram_index.remove(instance.pk)
+    autocomplete_index = loaded_autocomplete_index()
+    if autocomplete_index is not None:
+        autocomplete_index.remove(instance.pk)
+    titles_changed(trigram_index, autocomplete_index)
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    # Edits have to take the old rating out of the summary
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = Review.objects.filter(pk=instance.pk).values('product_id', 'rating').first()
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous == {'product_id': instance.product_id, 'rating': instance.rating}:
+        return
+    if previous is not None:
+        ProductRating.objects.remove_rating(previous['product_id'], previous['rating'])
+    ProductRating.objects.add_rating(instance.product_id, instance.rating)
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    ProductRating.objects.remove_rating(instance.product_id, instance.rating)
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    # A guest who signs in keeps what they added, also when the user already has a cart,
+    # and the session gets the cart badge's summary while it's written anyway
+    get_cart_backend().merge_guest_cart(request, user)
+
+@receiver(setting_changed)
+def search_setting_changed(sender, setting, **kwargs):
+    if setting == 'SEARCH_BACKEND':
+        reset_search_backend()
+
+@receiver(setting_changed)
+def payfast_setting_changed(sender, setting, **kwargs):
+    if setting.startswith('PAYFAST_'):
+        reset_client()
+
+@receiver(setting_changed)
+def cart_setting_changed(sender, setting, **kwargs):
+    if setting.startswith('CART_'):
+        reset_cart_backend()
+
+@receiver(setting_changed)
+def async_db_setting_changed(sender, setting, **kwargs):
+    if setting == 'ASYNC_DB_THREADS':
+        reset_executor()
@@ -0,0 +1,31 @@
+/* Search-as-you-type: fill the search box datalist from the autocomplete endpoint */
+(function ($) {
+  'use strict';
+
+  var $input = $('#search-input');
+  var $suggestions = $('#search-suggestions');
+  var url = $input.data('autocomplete-url');
+  var timer = null;
+  var lastQuery = '';
+
+  $input.on('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var query = $.trim($input.val());
+      if (query.length < 2 || query === lastQuery) {
+        return;
+      }
+      lastQuery = query;
+      $.getJSON(url, { q: query }, function (data) {
+        // Ignore responses for queries the user has already typed past
+        if (query !== lastQuery) {
+          return;
+        }
+        $suggestions.empty();
+        $.each(data.results, function (i, result) {
+          $('<option>').attr('value', result.title).appendTo($suggestions);
+        });
+      });
+    }, 150);
+  });
+})(jQuery);
@@ -0,0 +1,38 @@
+/* "Load more" for product reviews: append the next page from the reviews endpoint */
+(function ($) {
+  'use strict';
+
+  var $button = $('#load-more-reviews');
+  var $list = $('#review-list');
+
+  function renderReview(review) {
+    // Built with .text() so review content can't inject markup
+    var $info = $('<div class="review__info">')
+      .append($('<h4>').append($('<a href="#">').text(review.user)))
+      .append($('<p>').text('Rating: ' + review.rating));
+    var $details = $('<div class="review__details">')
+      .append($info)
+      .append($('<div class="review__date">').append($('<span>').text(review.publish_date)))
+      .append($('<p>').text(review.content));
+    return $('<div class="pro__review">')
+      .append($('<div class="review__thumb">').append($('<img src="images/review/1.jpg" alt="">')))
+      .append($details)
+      .add('<br>');
+  }
+
+  $button.on('click', function () {
+    $button.prop('disabled', true);
+    $.getJSON($button.data('url'), { cursor: $button.data('cursor') }, function (data) {
+      $.each(data.reviews, function (i, review) {
+        $list.append(renderReview(review));
+      });
+      if (data.next_cursor) {
+        $button.data('cursor', data.next_cursor).prop('disabled', false);
+      } else {
+        $button.remove();
+      }
+    }).fail(function () {
+      $button.prop('disabled', false);
+    });
+  });
+})(jQuery);
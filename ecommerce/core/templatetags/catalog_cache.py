@@ -0,0 +1,11 @@
+from django import template
+
+from ..catalog_cache import product_card_version
+
+register = template.Library()
+
+
+@register.filter
+def card_version(product):
+    """The part of a product card's cache key that changes with the product, see core.catalog_cache."""
+    return product_card_version(product)
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import async_views, views
+from .models import Order, OrderItem, Product
+
+User = get_user_model()
+
+
+@override_settings(ROOT_URLCONF='ecommerce.urls_asgi', ASYNC_DB_THREADS=0)
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Async product {i}', description=f'Description {i}', price=5 + i, category='CP')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_urls_resolve_to_async_views(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertIs(response.resolver_match.func, async_views.index)
+        # Views without an async version keep the sync one
+        response = self.client.get(reverse('core:autocomplete'))
+        self.assertIs(response.resolver_match.func, views.autocomplete)
+
+    async def test_index(self):
+        response = await self.async_client.get(reverse('core:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Async product 2')
+
+    async def test_search(self):
+        response = await self.async_client.get(reverse('core:search') + '?search=async')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['search_text'], 'async')
+        self.assertEqual(len(response.context['products']), 3)
+
+    async def test_product_detail(self):
+        response = await self.async_client.get(reverse('core:product-detail', args=[self.products[0].pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['product'], self.products[0])
+
+    async def test_product_detail_not_found(self):
+        response = await self.async_client.get(reverse('core:product-detail', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_empty_cart(self):
+        response = await self.async_client.get(reverse('core:cart'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('order_items', response.context)
+
+    def test_cart_mutations(self):
+        self.async_client.force_login(self.user)
+
+        @async_to_sync
+        async def get(path):
+            # Runs the views' database work in the test's thread, where the test data is
+            return await self.async_client.get(path)
+
+        product = self.products[0]
+
+        add = get(reverse('core:cart-add', args=[product.pk, 'cart']))
+        add_again = get(reverse('core:cart-add', args=[product.pk, 'product-detail']))
+        cart = get(reverse('core:cart'))
+        self.assertRedirects(add, reverse('core:cart'), fetch_redirect_response=False)
+        self.assertRedirects(add_again, reverse('core:product-detail', args=[product.pk]), fetch_redirect_response=False)
+        order = Order.objects.get(user=self.user, is_active=True)
+        self.assertEqual(OrderItem.objects.get(order=order, item=product).quantity, 2)
+        self.assertEqual(cart.context['order_total'], order.total_price)
+        self.assertEqual([message.message for message in cart.context['messages']], [
+            'The item has been added to your cart.',
+            'The item quantity in your cart has been updated.',
+        ])
+
+        remove_single = get(reverse('core:cart-remove-single', args=[product.pk]))
+        self.assertRedirects(remove_single, reverse('core:cart'), fetch_redirect_response=False)
+        self.assertEqual(OrderItem.objects.get(order=order, item=product).quantity, 1)
+        remove_all = get(reverse('core:cart-remove', args=[product.pk]))
+        self.assertRedirects(remove_all, reverse('core:cart'), fetch_redirect_response=False)
+        self.assertFalse(OrderItem.objects.filter(order=order).exists())
+        self.assertEqual(get(reverse('core:cart-remove', args=[product.pk])).status_code, 404)
+
+
+@override_settings(ROOT_URLCONF='ecommerce.urls_asgi', ASYNC_DB_THREADS=2)
+class AsyncViewsPoolTest(TransactionTestCase):
+    def test_database_work_runs_in_the_bounded_pool(self):
+        Product.objects.create(title='Pool product', description='Description', price=5, category='CP')
+        threads = set()
+        lock = threading.Lock()
+        running = [0, 0]
+        index_context = views.index_context
+
+        def recording_index_context(request):
+            with lock:
+                threads.add(threading.current_thread().name)
+                running[0] += 1
+                running[1] = max(running)
+            try:
+                return index_context(request)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        async def get_many():
+            return await asyncio.gather(*(self.async_client.get(reverse('core:index')) for _ in range(8)))
+
+        with mock.patch('core.views.index_context', recording_index_context):
+            responses = asyncio.run(get_many())
+        self.assertEqual([response.status_code for response in responses], [200] * 8)
+        self.assertTrue(all(name.startswith('async-db') for name in threads))
+        self.assertLessEqual(len(threads), 2)
+        self.assertLessEqual(running[1], 2)
+
+
+class BenchmarkServersCommandTest(TransactionTestCase):
+    @override_settings(ASYNC_DB_THREADS=2)
+    def test_compares_both_servers(self):
+        for i in range(3):
+            Product.objects.create(title=f'Benchmark product {i}', description='Description', price=5, category='CP')
+        out, err = StringIO(), StringIO()
+        call_command('benchmark_servers', connections=4, requests=3, threads=2, stdout=out, stderr=err)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['wsgi', 'asgi'])
+        for line in lines[1:]:
+            requests, errors = line.split()[1:3]
+            self.assertEqual((requests, errors), ('12', '0'))
+        # The test settings still have the sync only middleware
+        self.assertIn('settings_asgi', err.getvalue())
+
+    def test_no_products(self):
+        with self.assertRaisesMessage(Exception, 'There are no products to visit'):
+            call_command('benchmark_servers', stdout=StringIO())
@@ -0,0 +1,103 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .autocomplete import PrefixIndex, get_autocomplete_index, reset_autocomplete_index
+from .models import CatalogVersion, Order, OrderItem, Product
+
+class PrefixIndexTest(TestCase):
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.bulk_load([
+            (1, 'Mountain bike', 5),
+            (2, 'Bike helmet', 20),
+            (3, 'Bicycle pump', 1),
+            (4, 'Laptop bag', 0),
+        ])
+
+    def test_matches_any_word_of_title(self):
+        self.assertEqual([pk for pk, title in self.index.complete('bike')], [2, 1])
+
+    def test_most_popular_first(self):
+        self.assertEqual([pk for pk, title in self.index.complete('bi')], [2, 1, 3])
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.index.complete('LAPTOP'), [(4, 'Laptop bag')])
+
+    def test_multi_word_prefix(self):
+        self.assertEqual([pk for pk, title in self.index.complete('mountain b')], [1])
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.complete('b', limit=2)), 2)
+
+    def test_no_match(self):
+        self.assertEqual(self.index.complete('zz'), [])
+
+    def test_add_keeps_popularity(self):
+        self.index.add(3, 'Bicycle floor pump')
+        self.assertEqual(self.index.complete('floor'), [(3, 'Bicycle floor pump')])
+        self.assertEqual(self.index.complete('bicycle pump'), [])
+        self.assertEqual(self.index.weights[3], 1)
+
+    def test_remove(self):
+        self.index.remove(2)
+        self.assertEqual([pk for pk, title in self.index.complete('bi')], [1, 3])
+
+class AutocompleteViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bike = Product.objects.create(title='Bike', description='Product Test', price=50, category='CP')
+        cls.bicycle = Product.objects.create(title='Bicycle', description='Product Test 2', price=50, category='BK')
+        order = Order.objects.create()
+        OrderItem.objects.create(item=cls.bicycle, order=order, quantity=3)
+
+    def setUp(self):
+        reset_autocomplete_index()
+        self.addCleanup(reset_autocomplete_index)
+
+    def test_view_url_exists(self):
+        response = self.client.get('/autocomplete/', {'q': 'bi'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_results_weighted_by_popularity(self):
+        response = self.client.get(reverse('core:autocomplete'), {'q': 'bi'})
+        self.assertEqual(response.json(), {'results': [
+            {'id': self.bicycle.id, 'title': 'Bicycle', 'url': self.bicycle.get_absolute_url()},
+            {'id': self.bike.id, 'title': 'Bike', 'url': self.bike.get_absolute_url()},
+        ]})
+
+    def test_short_prefix_returns_nothing(self):
+        response = self.client.get(reverse('core:autocomplete'), {'q': 'b'})
+        self.assertEqual(response.json(), {'results': []})
+
+    def test_one_query_once_index_is_built(self):
+        get_autocomplete_index()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:autocomplete'), {'q': 'bik'})
+        self.assertEqual(len(response.json()['results']), 1)
+        # The titles version
+        self.assertEqual(len(queries), 1)
+
+    def test_index_updated_by_product_signals(self):
+        get_autocomplete_index()
+        product = Product.objects.create(title='Bike lock', description='Lock', price=10, category='CP')
+        response = self.client.get(reverse('core:autocomplete'), {'q': 'lock'})
+        self.assertEqual(response.json()['results'][0]['id'], product.id)
+        product.delete()
+        response = self.client.get(reverse('core:autocomplete'), {'q': 'lock'})
+        self.assertEqual(response.json(), {'results': []})
+
+    def test_rebuilt_after_a_change_in_another_process(self):
+        index = get_autocomplete_index()
+        # Another process renamed the product: the row changed and the version was bumped, but not this index
+        Product.objects.filter(pk=self.bike.pk).update(title='Scooter')
+        CatalogVersion.objects.bump(CatalogVersion.TITLES)
+        response = self.client.get(reverse('core:autocomplete'), {'q': 'sco'})
+        self.assertEqual(response.json()['results'][0]['id'], self.bike.id)
+        self.assertIsNot(get_autocomplete_index(), index)
+
+    def test_own_changes_keep_the_index(self):
+        index = get_autocomplete_index()
+        Product.objects.create(title='Bike lock', description='Lock', price=10, category='CP')
+        self.assertIs(get_autocomplete_index(), index)
@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from .benchmarks import Benchmark, compare, latency_summary, percentile
+from .models import CatalogVersion, Product, User
+from .trigram import get_trigram_index, reset_trigram_index
+
+
+class BenchmarkHelpersTest(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_latency_summary(self):
+        summary = latency_summary([3, 1, 2])
+        self.assertEqual((summary['count'], summary['p50'], summary['max'], summary['mean']), (3, 2, 3, 2))
+
+    def test_benchmark_calibrates_loops(self):
+        calls = []
+        result = Benchmark('append', calls.append, lambda: (1,)).run(rounds=3, min_time=0.001)
+        self.assertEqual(result['rounds'], 3)
+        self.assertGreater(result['loops'], 1)
+
+    def test_compare(self):
+        previous = {'fast': {'p50': 1.0}, 'slow': {'p50': 1.0}, 'removed': {'p50': 1.0}}
+        current = {'fast': {'p50': 0.5}, 'slow': {'p50': 1.5}, 'added': {'p50': 1.0}}
+        self.assertEqual(compare(previous, current, 0.2), [
+            ('fast', 1.0, 0.5, -0.5, False),
+            ('slow', 1.0, 1.5, 0.5, True),
+        ])
+
+
+class RunBenchmarksCommandTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.path = os.path.join(directory, 'benchmarks.json')
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+
+    def run_benchmarks(self, *names, **options):
+        out = StringIO()
+        call_command('run_benchmarks', *names, rounds=1, min_time=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_runs_every_benchmark_and_rolls_back(self):
+        out = self.run_benchmarks(output=self.path)
+        with open(self.path) as f:
+            results = json.load(f)
+        self.assertEqual(set(results['benchmarks']), {
+            'order.total_price', 'order.new_or_get.user', 'order.new_or_get.guest',
+            'form.address.valid', 'form.address.invalid', 'form.register.valid',
+            'template.home.cold', 'template.home.warm', 'template.cart',
+            'payfast.signature', 'payfast.payment_data',
+        })
+        self.assertIn('p95', results['benchmarks']['template.cart'])
+        self.assertIn('django', results)
+        self.assertIn('template.home.cold', out)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Product.objects.exists())
+
+    def test_fixtures_leave_the_search_indexes_alone(self):
+        reset_trigram_index()
+        self.addCleanup(reset_trigram_index)
+        index = get_trigram_index()
+        version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        self.run_benchmarks('order.total_price')
+        self.assertEqual(index.search('benchmark product'), [])
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version)
+        self.assertIs(get_trigram_index(), index)
+
+    def test_filter_by_name(self):
+        out = self.run_benchmarks('payfast')
+        self.assertIn('payfast.signature', out)
+        self.assertNotIn('order.total_price', out)
+
+    def test_compare_flags_regressions(self):
+        with open(self.path, 'w') as f:
+            json.dump({'benchmarks': {'payfast.signature': {'p50': 1e-9}, 'payfast.payment_data': {'p50': 1e6}}}, f)
+        with self.assertRaisesMessage(CommandError, '1 benchmarks are more than 20% slower: payfast.signature.'):
+            self.run_benchmarks('payfast', compare=self.path)
+
+    def test_compare_without_regressions(self):
+        with open(self.path, 'w') as f:
+            json.dump({'benchmarks': {'payfast.signature': {'p50': 1e6}}}, f)
+        out = self.run_benchmarks('payfast', compare=self.path, threshold=0.5)
+        self.assertIn('No benchmark is more than 50% slower.', out)
+
+    def test_compare_with_unreadable_file(self):
+        with self.assertRaises(CommandError):
+            self.run_benchmarks('payfast', compare=self.path)
@@ -0,0 +1,243 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test.client import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from .cart import DatabaseCartBackend, create_user_order, merge_guest_order, resolve_cart
+from .models import Order, OrderItem, Product
+
+User = get_user_model()
+
+class ResolveCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def make_request(self, user=None, order_id=None):
+        request = self.factory.get(reverse('core:cart'))
+        request.user = user or AnonymousUser()
+        request.session = self.client.session
+        if order_id is not None:
+            request.session['order_id'] = order_id
+        return request
+
+    def test_guest_existing_cart_is_one_query(self):
+        order = Order.objects.create()
+        request = self.make_request(order_id=order.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_cart(request), (order, False))
+
+    def test_user_existing_cart_is_one_query(self):
+        order = Order.objects.create(user=self.user)
+        request = self.make_request(self.user, order_id=order.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_cart(request), (order, False))
+
+    def test_user_without_session_cart_is_one_query(self):
+        order = Order.objects.create(user=self.user)
+        request = self.make_request(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_cart(request), (order, False))
+        self.assertEqual(request.session['order_id'], order.id)
+
+    def test_stale_session_order_is_not_used(self):
+        order = Order.objects.create(user=self.user, is_active=False)
+        request = self.make_request(self.user, order_id=order.id)
+        new_order, created = resolve_cart(request)
+        self.assertTrue(created)
+        self.assertNotEqual(new_order, order)
+        self.assertEqual(request.session['order_id'], new_order.id)
+
+    def test_guest_can_not_use_order_of_user(self):
+        order = Order.objects.create(user=self.user)
+        request = self.make_request(order_id=order.id)
+        self.assertEqual(resolve_cart(request, create=False), (None, False))
+
+    def test_user_adopts_guest_order(self):
+        order = Order.objects.create()
+        request = self.make_request(self.user, order_id=order.id)
+        # The lookup and the update, the rest is the savepoint around the update
+        with self.assertNumQueries(4):
+            self.assertEqual(resolve_cart(request), (order, False))
+        order.refresh_from_db()
+        self.assertEqual(order.user, self.user)
+
+    def test_no_order_created_without_create(self):
+        request = self.make_request()
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_cart(request, create=False), (None, False))
+        self.assertEqual(Order.objects.count(), 0)
+
+class CreateUserOrderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+
+    def test_creates_the_active_order(self):
+        order, created = create_user_order(self.user)
+        self.assertTrue(created)
+        self.assertEqual(Order.objects.get(user=self.user, is_active=True), order)
+
+    def test_returns_the_order_a_concurrent_request_created(self):
+        existing = Order.objects.create(user=self.user)
+        self.assertEqual(create_user_order(self.user), (existing, False))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+class MergeGuestCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=5, category='CP')
+            for i in range(20)
+        ]
+
+    def make_request(self, order_id=None):
+        request = RequestFactory().get(reverse('core:index'))
+        request.user = self.user
+        request.session = self.client.session
+        if order_id is not None:
+            request.session['order_id'] = order_id
+        return request
+
+    def create_order(self, user=None, quantities=()):
+        order = Order.objects.create(user=user)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, item=product, quantity=quantity) for product, quantity in zip(self.products, quantities)
+        )
+        return order
+
+    def items(self, order):
+        return list(OrderItem.objects.filter(order=order).order_by('item_id').values_list('item_id', 'quantity'))
+
+    def test_quantities_are_added_up(self):
+        order = self.create_order(self.user, [1, 2])
+        guest = self.create_order(quantities=[3, 0, 4])
+        OrderItem.objects.filter(order=guest, quantity=0).delete()
+        request = self.make_request(guest.id)
+        DatabaseCartBackend().merge_guest_cart(request, self.user)
+        self.assertEqual(self.items(order), [(self.products[0].id, 4), (self.products[1].id, 2), (self.products[2].id, 4)])
+        self.assertFalse(Order.objects.filter(pk=guest.pk).exists())
+        self.assertEqual(request.session['order_id'], order.id)
+
+    def test_query_count_does_not_depend_on_the_number_of_items(self):
+        counts = []
+        for size in (1, 20):
+            Order.objects.all().delete()
+            self.create_order(self.user, [1] * size)
+            request = self.make_request(self.create_order(quantities=[2] * size).id)
+            with CaptureQueriesContext(connection) as queries:
+                DatabaseCartBackend().merge_guest_cart(request, self.user)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_guest_order_is_adopted_by_a_user_without_one(self):
+        guest = self.create_order(quantities=[1])
+        request = self.make_request(guest.id)
+        DatabaseCartBackend().merge_guest_cart(request, self.user)
+        guest.refresh_from_db()
+        self.assertEqual(guest.user, self.user)
+        self.assertEqual(self.items(guest), [(self.products[0].id, 1)])
+
+    def test_no_guest_cart_only_looks_up_the_users_cart(self):
+        request = self.make_request()
+        # The user has no cart either, so there is nothing to sum up for the badge
+        with self.assertNumQueries(1):
+            DatabaseCartBackend().merge_guest_cart(request, self.user)
+        self.assertEqual(DatabaseCartBackend().summary(request), {'count': 0, 'total': 0})
+
+    def test_guest_order_is_merged_once(self):
+        order = self.create_order(self.user, [1])
+        guest = self.create_order(quantities=[1])
+        self.assertTrue(merge_guest_order(guest, order))
+        self.assertFalse(merge_guest_order(guest, order))
+        self.assertEqual(self.items(order), [(self.products[0].id, 2)])
+
+    def test_login_merges(self):
+        order = self.create_order(self.user, [1])
+        self.client.get(reverse('core:cart-add', kwargs={'product_id': self.products[0].id, 'redirect_url': 'cart'}))
+        self.client.login(email='testuser1@gmail.com', password='password123')
+        self.assertEqual(self.items(order), [(self.products[0].id, 2)])
+        self.assertEqual(Order.objects.count(), 1)
+
+class QueryCountMiddlewareTest(TestCase):
+    def test_query_count_on_request(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertEqual(response.wsgi_request.query_count, 1)
+
+    def test_no_header_without_debug(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertNotIn('X-Query-Count', response)
+
+    @override_settings(DEBUG=True)
+    def test_header_with_debug(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertEqual(response['X-Query-Count'], '1')
+
+class CartQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=5, category='CP')
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client.login(email='testuser1@gmail.com', password='password123')
+        self.order = Order.objects.create(user=self.user)
+
+    def test_cart_add_query_count_does_not_grow_with_cart(self):
+        self.client.get(reverse('core:cart-add', kwargs={'product_id': self.products[0].id, 'redirect_url': 'cart'}))
+        response = self.client.get(reverse('core:cart-add', kwargs={'product_id': self.products[1].id, 'redirect_url': 'cart'}))
+        small_cart_queries = response.wsgi_request.query_count
+        for product in self.products[2:]:
+            response = self.client.get(reverse('core:cart-add', kwargs={'product_id': product.id, 'redirect_url': 'cart'}))
+        self.assertEqual(response.wsgi_request.query_count, small_cart_queries)
+        self.assertEqual(OrderItem.objects.filter(order=self.order).count(), 5)
+
+class PurgeGuestCartsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.product = Product.objects.create(title='Product title 1', description='Product description 1', price=5, category='CP')
+
+    def setUp(self):
+        old = timezone.now() - datetime.timedelta(days=3)
+        self.empty = [Order.objects.create() for i in range(5)]
+        Order.objects.filter(pk__in=[order.pk for order in self.empty]).update(creation_date=old)
+        # Orders from before the creation date existed count as old
+        self.legacy = Order.objects.create()
+        Order.objects.filter(pk=self.legacy.pk).update(creation_date=None)
+        self.recent = Order.objects.create()
+        self.filled = Order.objects.create()
+        Order.objects.filter(pk=self.filled.pk).update(creation_date=old)
+        OrderItem.objects.create(item=self.product, order=self.filled)
+        self.users = Order.objects.create(user=self.user)
+        Order.objects.filter(pk=self.users.pk).update(creation_date=old)
+
+    def test_purges_only_old_empty_guest_orders(self):
+        out = StringIO()
+        call_command('purge_guest_carts', older_than_days=1, batch_size=2, stdout=out)
+        self.assertIn('Purged 6 empty guest orders', out.getvalue())
+        self.assertCountEqual(
+            Order.objects.values_list('pk', flat=True),
+            [self.recent.pk, self.filled.pk, self.users.pk],
+        )
+
+    def test_dry_run_deletes_nothing(self):
+        out = StringIO()
+        call_command('purge_guest_carts', dry_run=True, stdout=out)
+        self.assertIn('6 empty guest orders would be purged', out.getvalue())
+        self.assertEqual(Order.objects.count(), 9)
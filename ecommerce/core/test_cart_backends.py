@@ -0,0 +1,470 @@
+import socketserver
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .cart import LocalCartBackend, RedisCartBackend, get_cart_backend, reset_cart_backend
+from .models import Order, OrderItem, Product
+from .resp import RESPClient, RESPConnectionError, RESPError, RESPReplyError, RESPTimeoutError
+
+User = get_user_model()
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        while True:
+            args = self.read_command()
+            if args is None:
+                break
+            with server.lock:
+                server.commands.append([args[0].decode().upper()] + [arg.decode() for arg in args[1:]])
+                reply = server.run(args[0].decode().upper(), args[1:])
+                delay, server.reply_delay = server.reply_delay, 0
+                drop, server.drop_before_reply = server.drop_before_reply, False
+            if drop:
+                break
+            time.sleep(delay)
+            self.wfile.write(reply)
+            self.wfile.flush()
+            if server.drop_connections:
+                server.drop_connections = False
+                break
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """The subset of the Redis protocol and commands the cart backend uses, on localhost."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.password = password
+        self.hashes = {}
+        self.expires = {}
+        self.commands = []
+        self.connections = 0
+        # Close the connection after the next reply, like a server dropping idle clients
+        self.drop_connections = False
+        # Run the next command but close the connection instead of replying
+        self.drop_before_reply = False
+        # Seconds to wait before the next reply, after running the command
+        self.reply_delay = 0
+
+    @property
+    def url(self):
+        auth = f':{self.password}@' if self.password else ''
+        return f'redis://{auth}127.0.0.1:{self.server_address[1]}/2'
+
+    def run(self, command, args):
+        if command == 'PING':
+            return b'+PONG\r\n'
+        if command == 'AUTH':
+            return b'+OK\r\n' if args[0].decode() == self.password else b'-WRONGPASS invalid password\r\n'
+        if command == 'SELECT':
+            return b'+OK\r\n'
+        if command == 'HINCRBY':
+            key, field, amount = args
+            fields = self.hashes.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + int(amount)
+            return b':%d\r\n' % fields[field]
+        if command == 'HDEL':
+            fields = self.hashes.get(args[0], {})
+            deleted = sum(1 for field in args[1:] if fields.pop(field, None) is not None)
+            if not fields:
+                self.hashes.pop(args[0], None)
+            return b':%d\r\n' % deleted
+        if command == 'HGETALL':
+            fields = self.hashes.get(args[0], {})
+            reply = [b'*%d\r\n' % (len(fields) * 2)]
+            for field, value in fields.items():
+                value = str(value).encode()
+                reply.append(b'$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(field), field, len(value), value))
+            return b''.join(reply)
+        if command == 'DEL':
+            return b':%d\r\n' % sum(1 for key in args if self.hashes.pop(key, None) is not None)
+        if command == 'EXPIRE':
+            self.expires[args[0]] = int(args[1])
+            return b':1\r\n'
+        if command == 'EVAL':
+            # Runs under the server's lock, so as atomically as a script in Redis
+            if args[0].decode() != RedisCartBackend.DECREMENT_SCRIPT:
+                return b'-ERR unknown script\r\n'
+            key, field = args[2], args[3]
+            fields = self.hashes.get(key, {})
+            if field not in fields:
+                return b':-1\r\n'
+            fields[field] -= 1
+            if fields[field] > 0:
+                self.expires[key] = int(args[4])
+                return b':%d\r\n' % fields[field]
+            del fields[field]
+            if not fields:
+                self.hashes.pop(key, None)
+            return b':0\r\n'
+        if command == 'RENAME':
+            key, new_key = args
+            if key not in self.hashes:
+                return b'-ERR no such key\r\n'
+            self.hashes[new_key] = self.hashes.pop(key)
+            return b'+OK\r\n'
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
+
+    def cart(self, key):
+        return {int(field): value for field, value in self.hashes.get(key.encode(), {}).items()}
+
+
+class FakeRedisServerMixin:
+    def start_fake_redis(self, **options):
+        server = FakeRedisServer(**options)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+
+class RESPClientTest(FakeRedisServerMixin, SimpleTestCase):
+    def setUp(self):
+        self.server = self.start_fake_redis(password='secret')
+        self.resp = RESPClient.from_url(self.server.url)
+        self.addCleanup(self.resp.close)
+
+    def test_from_url(self):
+        client = RESPClient.from_url('redis://:p%40ss@example.com:6380/3')
+        self.assertEqual((client.host, client.port, client.db, client.password), ('example.com', 6380, 3, 'p@ss'))
+        client = RESPClient.from_url('redis://localhost')
+        self.assertEqual((client.host, client.port, client.db, client.password), ('localhost', 6379, 0, None))
+
+    def test_replies(self):
+        self.assertEqual(self.resp.execute('PING'), 'PONG')
+        self.assertEqual(self.resp.execute('HINCRBY', 'cart', 7, 2), 2)
+        self.assertEqual(self.resp.execute('HGETALL', 'cart'), [b'7', b'2'])
+        self.assertEqual(self.resp.execute('HGETALL', 'empty'), [])
+        # The connection is authenticated and selects the database first
+        self.assertEqual(self.server.commands[:2], [['AUTH', 'secret'], ['SELECT', '2']])
+
+    def test_pipeline_is_one_connection(self):
+        replies = self.resp.pipeline(('HINCRBY', 'cart', 1, 1), ('HINCRBY', 'cart', 1, 1), ('EXPIRE', 'cart', 60))
+        self.assertEqual(replies, [1, 2, 1])
+        self.resp.execute('PING')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_error_reply(self):
+        with self.assertRaisesMessage(RESPError, "unknown command 'NOPE'"):
+            self.resp.execute('NOPE')
+        # The connection is still usable
+        self.assertEqual(self.resp.execute('PING'), 'PONG')
+
+    def test_wrong_password(self):
+        client = RESPClient.from_url(self.server.url.replace('secret', 'wrong'))
+        with self.assertRaisesMessage(RESPError, 'WRONGPASS'):
+            client.execute('PING')
+
+    def test_reconnects_once(self):
+        self.resp.execute('PING')
+        self.server.drop_connections = True
+        self.resp.execute('PING')
+        self.assertEqual(self.resp.execute('PING'), 'PONG')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_reconnects_before_sending_on_a_closed_connection(self):
+        self.resp.execute('PING')
+        self.server.drop_connections = True
+        self.resp.execute('PING')
+        # Give the server's close time to arrive
+        time.sleep(0.1)
+        self.assertEqual(self.resp.execute('HINCRBY', 'cart', 1, 1), 1)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_broken_reply_only_retries_idempotent_commands(self):
+        self.resp.execute('PING')
+        self.server.drop_before_reply = True
+        with self.assertRaises(RESPReplyError):
+            self.resp.execute('HINCRBY', 'cart', 1, 1)
+        self.assertEqual(self.server.cart('cart'), {1: 1})
+        self.resp.execute('PING')
+        self.server.drop_before_reply = True
+        self.assertEqual(self.resp.execute('HGETALL', 'cart'), [b'1', b'1'])
+        self.assertEqual([command[0] for command in self.server.commands].count('HGETALL'), 2)
+
+    def test_reply_timeout_is_not_retried(self):
+        client = RESPClient.from_url(self.server.url, timeout=0.2)
+        self.addCleanup(client.close)
+        client.execute('PING')
+        self.server.reply_delay = 0.5
+        with self.assertRaises(RESPTimeoutError):
+            client.execute('HINCRBY', 'cart', 1, 1)
+        self.assertEqual([command[0] for command in self.server.commands].count('HINCRBY'), 1)
+        # The late reply is never read as the reply to the next command
+        self.assertEqual(client.execute('HINCRBY', 'cart', 1, 1), 2)
+
+    def test_unreachable(self):
+        client = RESPClient('127.0.0.1', 1, timeout=1)
+        with self.assertRaises(RESPConnectionError):
+            client.execute('PING')
+
+
+class CartBackendTestMixin:
+    """The cart views' behaviour, which every backend must have."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Product {i}', description='Description', price=5 + i, category='CP')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def add(self, product):
+        return self.client.get(reverse('core:cart-add', args=[product.pk, 'cart']))
+
+    def cart(self):
+        response = self.client.get(reverse('core:cart'))
+        return [(item.item, item.quantity) for item in response.context.get('order_items', [])], response.context.get('order_total')
+
+    def test_add_and_remove(self):
+        first, second = self.products[:2]
+        self.assertEqual(self.cart(), ([], None))
+        self.add(first)
+        self.add(first)
+        self.add(second)
+        self.assertEqual(self.cart(), ([(first, 2), (second, 1)], 2 * first.price + second.price))
+
+        self.assertRedirects(self.client.get(reverse('core:cart-remove-single', args=[first.pk])), reverse('core:cart'))
+        self.assertEqual(self.cart()[0], [(first, 1), (second, 1)])
+        self.client.get(reverse('core:cart-remove-single', args=[first.pk]))
+        self.assertEqual(self.cart()[0], [(second, 1)])
+        self.client.get(reverse('core:cart-remove', args=[second.pk]))
+        self.assertEqual(self.cart(), ([], None))
+
+    def test_removing_what_is_not_in_the_cart(self):
+        product = self.products[0]
+        self.assertEqual(self.client.get(reverse('core:cart-remove', args=[product.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('core:cart-remove-single', args=[product.pk])).status_code, 404)
+        self.add(self.products[1])
+        self.assertEqual(self.client.get(reverse('core:cart-remove', args=[product.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('core:cart-remove-single', args=[product.pk])).status_code, 404)
+        self.assertEqual(self.cart()[0], [(self.products[1], 1)])
+
+    def test_guest_cart_is_kept_on_login(self):
+        self.add(self.products[0])
+        self.client.login(username='testuser1@gmail.com', password='password123')
+        self.assertEqual(self.cart()[0], [(self.products[0], 1)])
+
+    def test_guest_cart_is_merged_on_login(self):
+        first, second, third = self.products
+        self.client.force_login(self.user)
+        self.add(second)
+        self.add(second)
+        self.add(first)
+        self.client.logout()
+
+        self.add(first)
+        self.add(third)
+        self.client.login(username='testuser1@gmail.com', password='password123')
+        self.assertEqual(sorted(self.cart()[0], key=lambda item: item[0].pk), [(first, 2), (second, 2), (third, 1)])
+        # Signing in again doesn't add the guest cart twice
+        self.client.login(username='testuser1@gmail.com', password='password123')
+        self.assertEqual(sorted(self.cart()[0], key=lambda item: item[0].pk), [(first, 2), (second, 2), (third, 1)])
+
+    def test_checkout(self):
+        self.client.force_login(self.user)
+        self.assertRedirects(self.client.get(reverse('core:checkout')), reverse('core:cart'))
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.assertEqual(self.client.get(reverse('core:checkout')).status_code, 200)
+        order = Order.objects.get(user=self.user, is_active=True)
+        self.assertEqual(
+            sorted(OrderItem.objects.filter(order=order).values_list('item_id', 'quantity')),
+            [(self.products[0].pk, 1), (self.products[1].pk, 1)],
+        )
+        # Changes after a checkout are in the next one
+        self.add(self.products[1])
+        self.client.get(reverse('core:cart-remove', args=[self.products[0].pk]))
+        self.client.get(reverse('core:checkout'))
+        self.assertEqual(list(OrderItem.objects.filter(order=order).values_list('item_id', 'quantity')), [(self.products[1].pk, 2)])
+        self.assertEqual(order.total_price, 2 * self.products[1].price)
+
+    def test_forget_after_payment(self):
+        self.client.force_login(self.user)
+        self.add(self.products[0])
+        self.client.get(reverse('core:checkout'))
+        order = Order.objects.get(user=self.user, is_active=True)
+        # PayFast sends the buyer back, the order is placed when its notification is processed
+        self.client.get(reverse('core:payment-return'))
+        self.assertEqual(self.summary()[0], (0, 0))
+        Order.objects.filter(pk=order.pk).update(is_active=False)
+        get_cart_backend().forget(order)
+        self.assertEqual(self.cart(), ([], None))
+        self.assertEqual(self.summary()[0], (0, 0))
+        self.add(self.products[1])
+        self.assertEqual(self.summary()[0], (1, self.products[1].price))
+
+    def summary(self):
+        response = self.client.get(reverse('core:index'))
+        summary = response.context['cart_summary']
+        return (summary['count'], summary['total']), response
+
+    def test_summary(self):
+        first, second = self.products[:2]
+        (count, total), empty = self.summary()
+        self.assertEqual((count, total), (0, 0))
+        self.assertNotContains(empty, 'cart__count')
+        self.add(first)
+        self.add(first)
+        self.add(second)
+        self.assertEqual(self.summary()[0], (3, 2 * first.price + second.price))
+        self.client.get(reverse('core:cart-remove-single', args=[first.pk]))
+        self.assertEqual(self.summary()[0], (2, first.price + second.price))
+        self.client.get(reverse('core:cart-remove', args=[second.pk]))
+        summary, response = self.summary()
+        self.assertEqual(summary, (1, first.price))
+        self.assertContains(response, f'R{first.price:.2f}')
+        # The cart views keep the summary in the session, so the badge costs no queries
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_backend().summary(response.wsgi_request), {'count': 1, 'total': first.price})
+
+    def test_summary_in_a_new_session(self):
+        first = self.products[0]
+        self.client.force_login(self.user)
+        self.add(first)
+        self.client.logout()
+        self.client.force_login(self.user)
+        self.assertEqual(self.summary()[0], (1, first.price))
+        # Signing in elsewhere doesn't show another user's summary
+        other = User.objects.create_user('other@example.com', 'password123')
+        self.client.force_login(other)
+        self.assertEqual(self.summary()[0], (0, 0))
+
+    def test_summary_after_merge_on_login(self):
+        first, second = self.products[:2]
+        self.client.force_login(self.user)
+        self.add(first)
+        self.client.logout()
+        self.add(first)
+        self.add(second)
+        self.client.login(username='testuser1@gmail.com', password='password123')
+        self.assertEqual(self.summary()[0], (3, 2 * first.price + second.price))
+
+
+class KeyValueCartBackendTestMixin:
+    """What the key-value backends must do on top, under concurrent requests."""
+    def test_add_and_remove_one_at_the_same_time(self):
+        backend = get_cart_backend()
+        request = RequestFactory().get('/')
+        request.user = self.user
+        product = self.products[0]
+        backend.add(request, product)
+        removed = []
+
+        def remove():
+            for _ in range(50):
+                removed.append(backend.remove_one(request, product))
+
+        thread = threading.Thread(target=remove)
+        thread.start()
+        for _ in range(50):
+            backend.add(request, product)
+        thread.join()
+        # Every add that a removal didn't take back is still in the cart
+        taken = sum(1 for result in removed if result is not None)
+        self.assertEqual(backend.get_all(backend.cart_key(request)).get(product.pk, 0), 51 - taken)
+
+
+class DatabaseCartBackendTest(CartBackendTestMixin, TestCase):
+    pass
+
+
+@override_settings(CART_BACKEND='core.cart.LocalCartBackend')
+class LocalCartBackendTest(KeyValueCartBackendTestMixin, CartBackendTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Every test gets empty carts
+        reset_cart_backend()
+
+    def test_cart_changes_do_not_write_orders(self):
+        self.client.force_login(self.user)
+        for product in self.products:
+            self.add(product)
+        self.client.get(reverse('core:cart-remove-single', args=[self.products[0].pk]))
+        self.cart()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_carts_expire(self):
+        backend = LocalCartBackend()
+        with mock.patch('core.cart.time.monotonic', return_value=1000.0), self.settings(CART_TIMEOUT=60):
+            backend.increment('cart:user:1', 1, 1)
+        with mock.patch('core.cart.time.monotonic', return_value=1059.0):
+            self.assertEqual(backend.get_all('cart:user:1'), {1: 1})
+        with mock.patch('core.cart.time.monotonic', return_value=1060.0):
+            self.assertEqual(backend.get_all('cart:user:1'), {})
+
+
+class RedisCartBackendTest(FakeRedisServerMixin, KeyValueCartBackendTestMixin, CartBackendTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_fake_redis()
+        settings = override_settings(CART_BACKEND='core.cart.RedisCartBackend', CART_REDIS_URL=self.server.url, CART_TIMEOUT=600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_cart_is_a_hash(self):
+        self.client.force_login(self.user)
+        self.add(self.products[0])
+        self.add(self.products[0])
+        self.assertEqual(self.server.cart(f'cart:user:{self.user.pk}'), {self.products[0].pk: 2})
+        self.assertEqual(self.server.expires[f'cart:user:{self.user.pk}'.encode()], 600)
+        self.assertFalse(Order.objects.exists())
+
+    def test_guest_cart_is_merged_into_the_user_cart(self):
+        self.server.hashes[f'cart:user:{self.user.pk}'.encode()] = {str(self.products[1].pk).encode(): 3}
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.client.login(username='testuser1@gmail.com', password='password123')
+        # The guest cart was claimed, read, and added up, and nothing is left behind
+        self.assertEqual(list(self.server.hashes), [f'cart:user:{self.user.pk}'.encode()])
+        self.assertEqual(self.server.cart(f'cart:user:{self.user.pk}'), {self.products[1].pk: 4, self.products[0].pk: 1})
+        commands = [command[0] for command in self.server.commands]
+        self.assertEqual(commands[commands.index('RENAME'):], ['RENAME', 'HGETALL', 'HINCRBY', 'HINCRBY', 'EXPIRE', 'DEL', 'HGETALL'])
+
+    def test_remove_one_is_a_single_script(self):
+        self.client.force_login(self.user)
+        self.add(self.products[0])
+        self.add(self.products[0])
+        del self.server.commands[:]
+        self.client.get(reverse('core:cart-remove-single', args=[self.products[0].pk]))
+        self.client.get(reverse('core:cart-remove-single', args=[self.products[0].pk]))
+        self.assertEqual([command[0] for command in self.server.commands if command[0] != 'HGETALL'], ['EVAL', 'EVAL'])
+        self.assertEqual(self.server.cart(f'cart:user:{self.user.pk}'), {})
+        # A product that isn't in the cart is never written
+        self.assertEqual(self.client.get(reverse('core:cart-remove-single', args=[self.products[0].pk])).status_code, 404)
+        self.assertNotIn(f'cart:user:{self.user.pk}'.encode(), self.server.hashes)
+
+    def test_deleted_products_are_left_out(self):
+        self.add(self.products[0])
+        self.add(self.products[1])
+        Product.objects.filter(pk=self.products[0].pk).delete()
+        self.assertEqual(self.cart()[0], [(self.products[1], 1)])
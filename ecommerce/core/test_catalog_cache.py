@@ -0,0 +1,82 @@
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .catalog_cache import product_card_key
+from .models import Product, Review, User
+
+
+@override_settings(CATALOG_PAGE_SIZE=2)
+class CatalogCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=50, category='CP')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def product(self, i):
+        return Product.objects.select_related('rating').get(pk=self.products[i].pk)
+
+    def test_cards_are_cached(self):
+        self.client.get(reverse('core:index'))
+        self.assertIsNotNone(cache.get(product_card_key(self.product(2))))
+        self.assertIsNone(cache.get(product_card_key(self.product(0))))
+
+    def test_cached_page_is_served(self):
+        self.assertTemplateUsed(self.client.get(reverse('core:index')), 'core/includes/product_card.html')
+        response = self.client.get(reverse('core:index'))
+        # The page came from the cache, so no card had to be rendered
+        self.assertTemplateNotUsed(response, 'core/includes/product_card.html')
+        self.assertContains(response, 'Product title 2')
+
+    def test_changed_product_gets_a_new_card_and_page(self):
+        self.client.get(reverse('core:index'))
+        old_key = product_card_key(self.product(2))
+        # Not even a save, like a change made by a bulk update or by another process
+        Product.objects.filter(pk=self.products[2].pk).update(title='Changed title')
+        self.assertNotEqual(product_card_key(self.product(2)), old_key)
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, 'Changed title')
+        self.assertNotContains(response, 'Product title 2')
+
+    def test_new_rating_gets_a_new_card(self):
+        self.client.get(reverse('core:index'))
+        user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        Review.objects.create(user=user, product=self.products[2], rating=4, content='Review content')
+        self.assertContains(self.client.get(reverse('core:index')), '4.0 (1)')
+
+    def test_deleting_product_invalidates_pages(self):
+        self.client.get(reverse('core:index'))
+        Product.objects.get(pk=self.products[2].pk).delete()
+        self.assertNotContains(self.client.get(reverse('core:index')), 'Product title 2')
+
+    def test_pages_are_cached_per_cursor_and_search(self):
+        first = self.client.get(reverse('core:index'))
+        second = self.client.get(reverse('core:index'), {'cursor': first.context['page'].next_cursor})
+        self.assertContains(second, 'Product title 0')
+        self.assertNotContains(second, 'Product title 2')
+        response = self.client.get(reverse('core:search'), {'search': 'title 0'})
+        self.assertContains(response, 'Product title 0')
+        self.assertNotContains(response, 'Product title 2')
+
+    def test_warm_catalog_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+            with override_settings(CACHES=shared):
+                out = StringIO()
+                call_command('warm_catalog_cache', stdout=out)
+                self.assertIn('Cached 3 product cards and 2 catalog pages', out.getvalue())
+                for i in range(3):
+                    self.assertIsNotNone(cache.get(product_card_key(self.product(i))))
+
+    def test_warm_catalog_cache_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'local to this process'):
+            call_command('warm_catalog_cache', stdout=StringIO())
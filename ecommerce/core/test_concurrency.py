@@ -0,0 +1,137 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+
+from .models import Order, OrderItem, Product
+
+User = get_user_model()
+
+THREADS = 8
+REQUESTS_PER_THREAD = 10
+
+
+class ConcurrentCartTest(TransactionTestCase):
+    """
+    Hit the cart endpoints from several threads at once. Every thread has its
+    own client and database connection, so the requests really overlap.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        self.product = Product.objects.create(title='Product title 1', description='Product description 1', price=5, category='CP')
+        self.order = Order.objects.create(user=self.user)
+
+    def hammer(self, url_name, kwargs, requests=REQUESTS_PER_THREAD):
+        barrier = threading.Barrier(THREADS)
+        errors = []
+
+        def worker():
+            client = Client()
+            client.force_login(self.user)
+            try:
+                barrier.wait()
+                for i in range(requests):
+                    response = client.get(reverse(url_name, kwargs=kwargs))
+                    if response.status_code not in (302, 404):
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def quantities(self):
+        return list(OrderItem.objects.filter(order=self.order, item=self.product).values_list('quantity', flat=True))
+
+    def test_concurrent_adds_are_all_counted(self):
+        self.hammer('core:cart-add', {'product_id': self.product.id, 'redirect_url': 'cart'})
+        self.assertEqual(self.quantities(), [THREADS * REQUESTS_PER_THREAD])
+
+    def test_concurrent_single_removes_are_all_counted(self):
+        OrderItem.objects.create(order=self.order, item=self.product, quantity=THREADS * REQUESTS_PER_THREAD + 5)
+        self.hammer('core:cart-remove-single', {'product_id': self.product.id})
+        self.assertEqual(self.quantities(), [5])
+
+    def test_concurrent_single_removes_never_go_below_zero(self):
+        OrderItem.objects.create(order=self.order, item=self.product, quantity=THREADS)
+        self.hammer('core:cart-remove-single', {'product_id': self.product.id}, requests=3)
+        self.assertEqual(self.quantities(), [])
+
+
+class ConcurrentLoginTest(TransactionTestCase):
+    """Sign in from several threads at once, each with a guest cart to merge."""
+    def setUp(self):
+        self.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        self.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=5, category='CP')
+            for i in range(3)
+        ]
+
+    def guest_client(self, *products):
+        client = Client()
+        for product in products:
+            client.get(reverse('core:cart-add', kwargs={'product_id': product.id, 'redirect_url': 'cart'}))
+        return client
+
+    def login_at_once(self, clients):
+        barrier = threading.Barrier(len(clients))
+        errors = []
+
+        def worker(client):
+            try:
+                barrier.wait()
+                client.force_login(self.user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def cart(self):
+        order = Order.objects.get(user=self.user, is_active=True)
+        return dict(OrderItem.objects.filter(order=order).values_list('item_id', 'quantity'))
+
+    def test_guest_carts_are_all_merged(self):
+        first, second, third = self.products
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, item=first, quantity=1)
+        self.login_at_once([self.guest_client(first, second) for i in range(THREADS)])
+        self.assertEqual(self.cart(), {first.id: 1 + THREADS, second.id: THREADS})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_guest_carts_are_all_merged_without_a_user_cart(self):
+        first, second, third = self.products
+        # One guest cart is adopted, the others are merged into it
+        self.login_at_once([self.guest_client(first, third) for i in range(THREADS)])
+        self.assertEqual(self.cart(), {first.id: THREADS, third.id: THREADS})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_same_guest_cart_is_merged_once(self):
+        first, second, third = self.products
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, item=second, quantity=1)
+        guest = self.guest_client(first, second)
+        clients = []
+        for i in range(THREADS):
+            # Every client has the guest's session, like tabs of one browser
+            client = Client()
+            client.cookies.load({settings.SESSION_COOKIE_NAME: guest.cookies[settings.SESSION_COOKIE_NAME].value})
+            clients.append(client)
+        self.login_at_once(clients)
+        self.assertEqual(self.cart(), {first.id: 1, second.id: 2})
+        self.assertEqual(Order.objects.count(), 1)
@@ -0,0 +1,157 @@
+import io
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from .images import generate_variants, image_hash, variant_name
+from .models import Product
+
+
+def image_file(size=(800, 400), color='red', mode='RGB', image_format='PNG', name='product.png'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+class TemporaryMediaMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root, PRODUCT_IMAGE_HEIGHTS=(100, 200))
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+
+    def create_product(self, **kwargs):
+        return Product.objects.create(title='Product title', description='Product description', price=50, category='CP', **kwargs)
+
+
+class ImageVariantTest(TemporaryMediaMixin, TestCase):
+    def test_variants_are_created_on_upload(self):
+        upload = image_file()
+        product = self.create_product(image=upload)
+        upload.seek(0)
+        self.assertEqual(product.image_hash, image_hash(upload.read()))
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, product.image_hash)
+        for height in (100, 200):
+            for extension in ('webp', 'jpg'):
+                with default_storage.open(variant_name(product.image_hash, height, extension)) as f:
+                    self.assertEqual(Image.open(f).size, (height * 2, height))
+
+    def test_variants_are_not_upscaled(self):
+        product = self.create_product(image=image_file(size=(300, 150)))
+        with default_storage.open(variant_name(product.image_hash, 200, 'jpg')) as f:
+            self.assertEqual(Image.open(f).size, (300, 150))
+
+    def test_transparent_image_jpeg_variant(self):
+        product = self.create_product(image=image_file(mode='RGBA', color=(0, 0, 0, 0)))
+        with default_storage.open(variant_name(product.image_hash, 100, 'jpg')) as f:
+            image = Image.open(f)
+            self.assertEqual(image.mode, 'RGB')
+            self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+    def test_saving_without_image_change_skips_processing(self):
+        product = self.create_product(image=image_file())
+        product = Product.objects.get(pk=product.pk)
+        self.assertFalse(product.image_changed)
+        product.title = 'Changed title'
+        with mock.patch('core.signals.process_product_image') as process:
+            product.save()
+        process.assert_not_called()
+
+    def test_replacing_image_updates_hash(self):
+        product = self.create_product(image=image_file())
+        old_hash = product.image_hash
+        product = Product.objects.get(pk=product.pk)
+        product.image = image_file(color='blue', name='blue.png')
+        self.assertTrue(product.image_changed)
+        product.save()
+        self.assertNotEqual(product.image_hash, old_hash)
+        self.assertTrue(default_storage.exists(variant_name(product.image_hash, 100, 'webp')))
+
+    def test_removing_image_clears_hash(self):
+        product = self.create_product(image=image_file())
+        product = Product.objects.get(pk=product.pk)
+        product.image = None
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, '')
+
+    def test_existing_variants_are_kept(self):
+        product = self.create_product(image=image_file())
+        name = variant_name(product.image_hash, 100, 'webp')
+        modified = default_storage.get_modified_time(name)
+        generate_variants(product.image.name)
+        self.assertEqual(default_storage.get_modified_time(name), modified)
+
+    def test_invalid_image_is_logged(self):
+        upload = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        with self.assertLogs('core.signals', 'ERROR'):
+            product = self.create_product(image=upload)
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, '')
+
+
+class ProductImageTagTest(TemporaryMediaMixin, TestCase):
+    def render(self, product, height=100):
+        template = Template('{% load product_images %}{% product_image product height alt="Product" %}')
+        return template.render(Context({'product': product, 'height': height}))
+
+    def test_picture_with_srcset(self):
+        product = self.create_product(image=image_file())
+        html = self.render(product)
+        webp_1x = default_storage.url(variant_name(product.image_hash, 100, 'webp'))
+        webp_2x = default_storage.url(variant_name(product.image_hash, 200, 'webp'))
+        self.assertIn(f'<source type="image/webp" srcset="{webp_1x} 1x, {webp_2x} 2x">', html)
+        self.assertIn(f'src="{default_storage.url(variant_name(product.image_hash, 100, "jpg"))}"', html)
+        self.assertIn('height: 100px;', html)
+
+    def test_no_2x_variant(self):
+        product = self.create_product(image=image_file())
+        html = self.render(product, height=200)
+        self.assertIn('-200.webp 1x"', html)
+        self.assertNotIn('2x', html)
+
+    def test_original_without_variants(self):
+        product = self.create_product(image=image_file())
+        Product.objects.filter(pk=product.pk).update(image_hash='')
+        product = Product.objects.get(pk=product.pk)
+        self.assertHTMLEqual(
+            self.render(product),
+            f'<img src="{product.image.url}" alt="Product" style="width: auto; height: 100px;">',
+        )
+
+    def test_placeholder_without_image(self):
+        self.assertIn('src="javascript:void(0)"', self.render(self.create_product()))
+
+
+class BackfillProductImagesCommandTest(TemporaryMediaMixin, TestCase):
+    def test_backfill(self):
+        product = self.create_product(image=image_file())
+        content_hash = product.image_hash
+        Product.objects.filter(pk=product.pk).update(image_hash='')
+        shutil.rmtree(f'{self.media_root}/products/variants')
+        self.create_product()
+
+        out = StringIO()
+        call_command('backfill_product_images', workers=0, stdout=out)
+        self.assertIn('Processed 1 product images', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, content_hash)
+        self.assertTrue(default_storage.exists(variant_name(content_hash, 200, 'jpg')))
+
+    def test_backfill_with_process_pool(self):
+        products = [self.create_product(image=image_file(color=color, name=f'{color}.png')) for color in ('red', 'green')]
+        Product.objects.update(image_hash='')
+        out = StringIO()
+        call_command('backfill_product_images', workers=2, stdout=out)
+        self.assertIn('Processed 2 product images', out.getvalue())
+        for product in products:
+            self.assertEqual(Product.objects.get(pk=product.pk).image_hash, product.image_hash)
@@ -0,0 +1,157 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from .catalog_cache import product_card_key
+from .images import imported_image_name
+from .models import CatalogVersion, Product
+from .search import get_search_backend
+
+CSV_HEADER = 'sku,title,description,price,category,image\n'
+
+
+class ImportProductsCommandTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=f'{self.directory}/media', PRODUCT_IMAGE_HEIGHTS=(100,))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def write(self, name, content):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def import_products(self, path, **options):
+        out, err = StringIO(), StringIO()
+        options.setdefault('workers', 0)
+        call_command('import_products', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_creates_products(self):
+        path = self.write('products.csv', CSV_HEADER + ''.join(
+            f'SKU-{i},Product title {i},Product description {i},{i}.5,CP,\n' for i in range(5)
+        ))
+        out, err = self.import_products(path, batch_size=2)
+        self.assertIn('5 rows', out)
+        self.assertIn('5 created, 0 updated, 0 invalid', out)
+        self.assertEqual(err, '')
+        product = Product.objects.get(sku='SKU-3')
+        self.assertEqual((product.title, product.price, product.category), ('Product title 3', 3.5, 'CP'))
+
+    def test_upsert_by_sku(self):
+        Product.objects.create(sku='SKU-1', title='Old title', description='Old description', price=10, category='CP')
+        unchanged = Product.objects.create(sku='SKU-2', title='Same title', description='Same description', price=20, category='BK')
+        path = self.write('products.csv', CSV_HEADER + (
+            'SKU-1,New title,New description,15,Book,\n'
+            'SKU-2,Same title,Same description,20,BK,\n'
+            'SKU-3,Created title,Created description,30,Clothing,\n'
+        ))
+        out, _ = self.import_products(path)
+        self.assertIn('1 created, 1 updated, 0 invalid', out)
+        self.assertEqual(Product.objects.count(), 3)
+        product = Product.objects.get(sku='SKU-1')
+        self.assertEqual((product.title, product.price, product.category), ('New title', 15, 'BK'))
+        self.assertEqual(Product.objects.get(sku='SKU-2').pk, unchanged.pk)
+
+    def test_repeated_sku_keeps_last_row(self):
+        path = self.write('products.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'sku': 'SKU-1', 'title': 'First', 'description': 'Description', 'price': 10, 'category': 'CP'},
+            {'sku': 'SKU-1', 'title': 'Second', 'description': 'Description', 'price': 10, 'category': 'CP'},
+        ]))
+        self.import_products(path)
+        self.assertEqual(Product.objects.get().title, 'Second')
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        path = self.write('products.jsonl', '\n'.join([
+            json.dumps({'sku': 'SKU-1', 'title': 'Valid', 'description': 'Description', 'price': 10, 'category': 'CP'}),
+            json.dumps({'sku': 'SKU-2', 'title': 'Bad price', 'description': 'Description', 'price': 'free', 'category': 'CP'}),
+            json.dumps({'sku': 'SKU-3', 'title': 'Bad category', 'description': 'Description', 'price': 10, 'category': 'Toys'}),
+            json.dumps({'title': 'No SKU', 'description': 'Description', 'price': 10, 'category': 'CP'}),
+            json.dumps({'sku': 'SKU-5', 'title': 'x' * 201, 'description': 'Description', 'price': 10, 'category': 'CP'}),
+            '{not json',
+            '[]',
+        ]))
+        out, err = self.import_products(path)
+        self.assertIn('1 created, 0 updated, 6 invalid', out)
+        for line in range(2, 8):
+            self.assertIn(f'Line {line}:', err)
+        self.assertIn('price:', err)
+        self.assertIn('category:', err)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['SKU-1'])
+
+    def test_search_index_and_cache_are_updated(self):
+        product = Product.objects.create(sku='SKU-1', title='Old title', description='Description', price=10, category='CP')
+        old_card_key = product_card_key(product)
+        version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        path = self.write('products.csv', CSV_HEADER + (
+            'SKU-1,Renamed gadget,Description,10,CP,\n'
+            'SKU-2,Imported widget,Description,10,CP,\n'
+        ))
+        self.import_products(path)
+        # The new title is part of the card's cache key, in every process
+        self.assertNotEqual(product_card_key(Product.objects.get(pk=product.pk)), old_card_key)
+        backend = get_search_backend()
+        self.assertEqual(backend.search('gadget', 10), [product.pk])
+        self.assertEqual(backend.search('widget', 10), [Product.objects.get(sku='SKU-2').pk])
+        self.assertEqual(backend.search('old', 10), [])
+        # The titles version tells the fuzzy search and autocomplete indexes to rebuild
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version + 1)
+
+    def test_price_changes_keep_the_titles_version(self):
+        Product.objects.create(sku='SKU-1', title='Gadget', description='Description', price=10, category='CP')
+        version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        self.import_products(self.write('products.csv', CSV_HEADER + 'SKU-1,Gadget,Description,12,CP,\n'))
+        self.assertEqual(Product.objects.get(sku='SKU-1').price, 12)
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version)
+
+    def test_images(self):
+        source = f'{self.directory}/source.png'
+        Image.new('RGB', (400, 200), 'red').save(source)
+        path = self.write('products.csv', CSV_HEADER + (
+            f'SKU-1,Product title,Description,10,CP,{source}\n'
+            f'SKU-2,Product title,Description,10,CP,{self.directory}/missing.png\n'
+        ))
+        out, err = self.import_products(path)
+        self.assertIn('1 images, 1 image errors', out)
+        self.assertIn('missing.png', err)
+        product = Product.objects.get(sku='SKU-1')
+        self.assertEqual(product.image.name, imported_image_name(source))
+        self.assertEqual(len(product.image_hash), 16)
+        self.assertEqual(Product.objects.get(sku='SKU-2').image_hash, '')
+
+        # Importing the same source again doesn't fetch it again
+        out, _ = self.import_products(path, skip_images=False)
+        self.assertIn('0 created, 0 updated', out)
+        self.assertIn('0 images, 1 image errors', out)
+
+    def test_images_with_process_pool(self):
+        rows = []
+        for i, color in enumerate(('red', 'green', 'blue')):
+            source = f'{self.directory}/{color}.png'
+            Image.new('RGB', (400, 200), color).save(source)
+            rows.append(f'SKU-{i},Product title,Description,10,CP,{source}\n')
+        path = self.write('products.csv', CSV_HEADER + ''.join(rows))
+        out, _ = self.import_products(path, workers=2, batch_size=2)
+        self.assertIn('3 images, 0 image errors', out)
+        self.assertEqual(Product.objects.filter(image_hash='').count(), 0)
+
+    def test_skip_images(self):
+        path = self.write('products.csv', CSV_HEADER + f'SKU-1,Product title,Description,10,CP,{self.directory}/missing.png\n')
+        out, err = self.import_products(path, skip_images=True)
+        self.assertIn('0 images, 0 image errors', out)
+        self.assertFalse(Product.objects.get().image)
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.import_products(self.write('products.txt', ''))
@@ -1,6 +1,12 @@
+import datetime
+from io import StringIO
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
 
@@ -403,3 +409,73 @@ class UserTest(TestCase):
     def test_create_superuser_is_admin(self):
         user = User.objects.create_superuser('test@gmail.com', 'mypassword123')
         self.assertTrue(user.is_admin)
+
+class OrderTotalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product_1 = Product.objects.create(title='Product title 1', description='Product description 1', price=53.5, category='CP')
+        cls.product_2 = Product.objects.create(title='Product title 2', description='Product description 2', price=10, category='BK')
+        cls.order = Order.objects.create()
+        OrderItem.objects.create(item=cls.product_1, order=cls.order, quantity=2)
+        OrderItem.objects.create(item=cls.product_2, order=cls.order, quantity=3)
+        cls.empty_order = Order.objects.create()
+
+    def test_total_price_is_one_query(self):
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.total_price, 2 * 53.5 + 3 * 10)
+
+    def test_with_totals_annotates_every_order(self):
+        with self.assertNumQueries(1):
+            totals = {order.pk: order.total for order in Order.objects.with_totals()}
+        self.assertEqual(totals, {self.order.pk: 137.0, self.empty_order.pk: 0})
+
+    def test_total_price_uses_annotation(self):
+        order = Order.objects.with_totals().get(pk=self.order.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(order.total_price, 137.0)
+
+    def test_with_totals_can_be_filtered_on(self):
+        self.assertQuerysetEqual(Order.objects.with_totals().filter(total__gt=100), [self.order], transform=lambda order: order)
+
+class OrderIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+
+    def test_one_active_order_per_user(self):
+        Order.objects.create(user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user)
+
+    def test_many_placed_orders_per_user(self):
+        Order.objects.create(user=self.user)
+        Order.objects.create(user=self.user, is_active=False)
+        Order.objects.create(user=self.user, is_active=False)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 3)
+
+    def test_many_active_guest_orders(self):
+        Order.objects.create()
+        Order.objects.create()
+        self.assertEqual(Order.objects.filter(user__isnull=True, is_active=True).count(), 2)
+
+    def test_reviews_for_product_newest_first(self):
+        product = Product.objects.create(title='Product title 1', description='Product description 1', price=5, category='CP')
+        reviews = [Review.objects.create(user=self.user, product=product, rating=i) for i in range(1, 4)]
+        Review.objects.filter(pk=reviews[2].pk).update(publish_date=datetime.date(2020, 1, 1))
+        self.assertEqual(list(Review.objects.for_product(product)), [reviews[1], reviews[0], reviews[2]])
+
+
+class BenchmarkIndexesCommandTest(TransactionTestCase):
+    def test_benchmark_rolls_back_seeded_data(self):
+        out = StringIO()
+        call_command('benchmark_indexes', orders=300, users=50, products=20, reviews=200, repeat=5, yes_really=True, stdout=out)
+        self.assertIn('product_detail', out.getvalue())
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Review.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 0)
+
+    def test_refuses_to_run_without_debug(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_indexes', orders=300, users=50, products=20, reviews=200, repeat=5, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 0)
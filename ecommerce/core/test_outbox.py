@@ -0,0 +1,202 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import OutboxEmail, Payment
+from .outbox import RateLimiter, send_batch
+from .payment_queue import process_batch
+from .test_payment_queue import PAYFAST_REFERER, create_payment, notification_data
+
+
+class ConnectionBackend(EmailBackend):
+    """
+    The locmem backend with the SMTP backend's connection handling: send
+    opens a connection if there is none, and closes it again if it did.
+    """
+    connections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection = None
+
+    def open(self):
+        if self.connection is not None:
+            return False
+        ConnectionBackend.connections += 1
+        self.connection = object()
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, messages):
+        new_connection = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class FailingBackend(EmailBackend):
+    """Fails to send to addresses at failing.example.com."""
+    def send_messages(self, messages):
+        if any(to.endswith('@failing.example.com') for message in messages for to in message.to):
+            raise ConnectionRefusedError('SMTP server unavailable')
+        return super().send_messages(messages)
+
+
+def unlimited():
+    return RateLimiter(0)
+
+
+class RateLimiterTest(TestCase):
+    def test_waits_between_calls(self):
+        now = [100.0]
+        sleep = mock.Mock(side_effect=lambda seconds: now.__setitem__(0, now[0] + seconds))
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(sleep.call_args_list, [mock.call(0.25), mock.call(0.25)])
+
+    def test_no_wait_when_slower_than_the_rate(self):
+        now = [100.0]
+        sleep = mock.Mock()
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        limiter.wait()
+        now[0] += 1
+        limiter.wait()
+        sleep.assert_not_called()
+
+    def test_no_limit(self):
+        sleep = mock.Mock()
+        limiter = RateLimiter(0, sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        sleep.assert_not_called()
+
+
+class OutboxEmailTest(TestCase):
+    def test_enqueue_is_idempotent(self):
+        first = OutboxEmail.objects.enqueue('order-confirmation:1', 'a@example.com', 'Subject', 'Body')
+        second = OutboxEmail.objects.enqueue('order-confirmation:1', 'a@example.com', 'Subject', 'Body')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_send_batch(self):
+        for i in range(3):
+            OutboxEmail.objects.enqueue(f'test:{i}', f'user{i}@example.com', f'Subject {i}', 'Body')
+        self.assertEqual(send_batch('worker', 10, mail.get_connection(), unlimited()), 3)
+        self.assertEqual([message.to for message in mail.outbox], [[f'user{i}@example.com'] for i in range(3)])
+        self.assertEqual(mail.outbox[0].subject, 'Subject 0')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.DONE).exists())
+        # Sent emails are not sent again
+        self.assertEqual(send_batch('worker', 10, mail.get_connection(), unlimited()), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_rate_limit(self):
+        for i in range(3):
+            OutboxEmail.objects.enqueue(f'test:{i}', 'user@example.com', 'Subject', 'Body')
+        limiter = RateLimiter(2)
+        with mock.patch.object(limiter, 'wait') as wait:
+            send_batch('worker', 10, mail.get_connection(), limiter)
+        self.assertEqual(wait.call_count, 3)
+
+    @override_settings(EMAIL_BACKEND='core.test_outbox.FailingBackend', OUTBOX_EMAIL_MAX_ATTEMPTS=2, OUTBOX_EMAIL_RETRY_DELAY=60)
+    def test_failures_are_retried_then_dead_lettered(self):
+        failing = OutboxEmail.objects.enqueue('test:failing', 'user@failing.example.com', 'Subject', 'Body')
+        OutboxEmail.objects.enqueue('test:working', 'user@example.com', 'Subject', 'Body')
+        with self.assertLogs('core.outbox', 'WARNING'):
+            send_batch('worker', 10, mail.get_connection(), unlimited())
+        # One failure doesn't hold up the rest of the batch
+        self.assertEqual([message.to for message in mail.outbox], [['user@example.com']])
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (OutboxEmail.PENDING, 1))
+        self.assertIn('SMTP server unavailable', failing.last_error)
+        self.assertGreater(failing.available_at, timezone.now() + datetime.timedelta(seconds=50))
+
+        OutboxEmail.objects.filter(pk=failing.pk).update(available_at=timezone.now())
+        with self.assertLogs('core.outbox', 'WARNING'):
+            send_batch('worker', 10, mail.get_connection(), unlimited())
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), (OutboxEmail.FAILED, 2))
+        self.assertEqual(send_batch('worker', 10, mail.get_connection(), unlimited()), 0)
+
+
+@override_settings(PAYFAST_SERVER_VALIDATION=False)
+class OrderEmailTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payment = create_payment()
+
+    def notify(self, **changes):
+        self.client.post(reverse('core:payment-notify'), notification_data(self.payment, **changes), HTTP_REFERER=PAYFAST_REFERER)
+        process_batch('test-worker', 10)
+
+    def test_successful_payment_queues_confirmation(self):
+        self.notify()
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.key, f'order-confirmation:{self.payment.order_id}')
+        self.assertEqual(email.to, 'testuser1@gmail.com')
+        self.assertEqual(email.subject, f'{self.payment.item_name} confirmation')
+        # Nothing is sent while processing the notification
+        self.assertEqual(mail.outbox, [])
+
+    def test_unsuccessful_payment_queues_nothing(self):
+        self.notify(amount_gross='1.00')
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_confirmation_is_rolled_back_with_the_order(self):
+        with mock.patch('core.models.Order.save', side_effect=RuntimeError('database went away')), self.assertLogs('core.payment_queue', 'WARNING'):
+            self.notify()
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'P')
+
+    def test_duplicate_notification_queues_one_email(self):
+        self.notify()
+        self.notify()
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_cancel_queues_email(self):
+        self.client.force_login(self.payment.order.user)
+        response = self.client.get(reverse('core:payment-cancel'))
+        self.assertRedirects(response, reverse('core:index'))
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'C')
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.key, email.to), (f'payment-cancelled:{self.payment.pk}', 'testuser1@gmail.com'))
+        # Cancelling again doesn't queue another email
+        self.client.get(reverse('core:payment-cancel'))
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_cancel_anonymous(self):
+        self.client.get(reverse('core:payment-cancel'))
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'P')
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_payment_after_cancel(self):
+        self.client.force_login(self.payment.order.user)
+        self.client.get(reverse('core:payment-cancel'))
+        self.notify()
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'S')
+        self.assertTrue(OutboxEmail.objects.filter(key=f'order-confirmation:{self.payment.order_id}').exists())
+
+
+class SendOutboxEmailsCommandTest(TestCase):
+    @override_settings(EMAIL_BACKEND='core.test_outbox.ConnectionBackend')
+    def test_batches_share_one_connection(self):
+        ConnectionBackend.connections = 0
+        for i in range(5):
+            OutboxEmail.objects.enqueue(f'test:{i}', f'user{i}@example.com', 'Subject', 'Body')
+        out = StringIO()
+        call_command('send_outbox_emails', batch_size=2, rate=0, once=True, stdout=out)
+        self.assertIn('Processed 5 outbox emails.', out.getvalue())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(ConnectionBackend.connections, 1)
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.DONE).exists())
@@ -0,0 +1,61 @@
+import datetime
+
+from django.test import TestCase
+
+from .models import Product
+from .pagination import InvalidCursor, KeysetPaginator
+
+ORDERING = ('-publish_date', '-id')
+
+class KeysetPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=50, category='CP')
+        # Spread the products over two days so both ordering fields are used
+        Product.objects.filter(id__lte=3).update(publish_date=datetime.date(2020, 1, 1))
+
+    def expected_ids(self):
+        return list(Product.objects.order_by(*ORDERING).values_list('id', flat=True))
+
+    def test_first_page(self):
+        page = KeysetPaginator(Product.objects.all(), ORDERING, 3).page()
+        self.assertEqual([p.id for p in page], self.expected_ids()[:3])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+
+    def test_walk_forward_visits_every_product_once(self):
+        paginator = KeysetPaginator(Product.objects.all(), ORDERING, 3)
+        page = paginator.page()
+        seen = [p.id for p in page]
+        while page.has_next:
+            page = paginator.page(page.next_cursor)
+            seen.extend(p.id for p in page)
+        self.assertEqual(seen, self.expected_ids())
+        self.assertEqual(len(page), 1)
+        self.assertTrue(page.has_previous)
+
+    def test_previous_cursor_returns_preceding_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), ORDERING, 3)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_page_query_count_does_not_depend_on_depth(self):
+        paginator = KeysetPaginator(Product.objects.all(), ORDERING, 2)
+        page = paginator.page(paginator.page().next_cursor)
+        with self.assertNumQueries(1):
+            paginator.page(page.next_cursor)
+
+    def test_invalid_cursor_raises(self):
+        paginator = KeysetPaginator(Product.objects.all(), ORDERING, 3)
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+
+    def test_get_page_invalid_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), ORDERING, 3)
+        page = paginator.get_page('not-a-cursor')
+        self.assertEqual([p.id for p in page], self.expected_ids()[:3])
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from . import payfast
+from .payfast import PayFastClient, ValidationUnavailable, get_client
+
+
+class StubPayFastHandler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.requests.append(dict(parse_qsl(body.decode())))
+            server.clients.add(self.client_address)
+            failure = server.failures.pop(0) if server.failures else None
+        if server.delay:
+            time.sleep(server.delay)
+        status, text = (failure, 'ERROR') if failure else (200, server.answer)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        try:
+            self.wfile.write(text.encode())
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubPayFastServer(ThreadingHTTPServer):
+    """The PayFast query validate endpoint on localhost, recording what it receives."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubPayFastHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.clients = set()
+        self.failures = []
+        self.answer = 'VALID'
+        self.delay = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/eng/query/validate'
+
+
+class PayFastClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = StubPayFastServer()
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def payfast_client(self, **options):
+        options = {'timeout': 2, 'retries': 2, 'backoff': 0, 'pool_size': 4, **options}
+        client = PayFastClient(self.server.url, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_valid(self):
+        self.assertIs(self.payfast_client().validate({'m_payment_id': '1', 'signature': 'abc'}), True)
+        self.assertEqual(self.server.requests, [{'m_payment_id': '1', 'signature': 'abc'}])
+
+    def test_invalid(self):
+        self.server.answer = 'INVALID'
+        self.assertIs(self.payfast_client().validate({'m_payment_id': '1'}), False)
+
+    def test_connections_are_reused(self):
+        client = self.payfast_client()
+        for _ in range(5):
+            client.validate({'m_payment_id': '1'})
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_concurrent_validations_share_the_pool(self):
+        client = self.payfast_client(pool_size=2)
+        threads = [threading.Thread(target=client.validate, args=({'m_payment_id': str(i)},)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 8)
+        self.assertLessEqual(len(self.server.clients), 2)
+
+    def test_server_errors_are_retried(self):
+        self.server.failures = [503, 502]
+        self.assertIs(self.payfast_client(retries=2).validate({'m_payment_id': '1'}), True)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_retries(self):
+        self.server.failures = [503, 503, 503]
+        with self.assertRaises(ValidationUnavailable):
+            self.payfast_client(retries=1).validate({'m_payment_id': '1'})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.failures = [400]
+        with self.assertRaises(ValidationUnavailable):
+            self.payfast_client().validate({'m_payment_id': '1'})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        start = time.perf_counter()
+        with self.assertRaises(ValidationUnavailable):
+            self.payfast_client(timeout=0.1, retries=0).validate({'m_payment_id': '1'})
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_unreachable(self):
+        client = PayFastClient('http://127.0.0.1:1/eng/query/validate', timeout=1, retries=0, backoff=0, pool_size=1)
+        with self.assertRaises(ValidationUnavailable):
+            client.validate({'m_payment_id': '1'})
+
+    def test_validate_async(self):
+        client = self.payfast_client()
+
+        async def validate_many():
+            return await asyncio.gather(*(client.validate_async({'m_payment_id': str(i)}) for i in range(4)))
+
+        self.assertEqual(asyncio.run(validate_many()), [True] * 4)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_client_from_settings(self):
+        with override_settings(PAYFAST_QUERY_URL=self.server.url):
+            client = get_client()
+            self.assertIs(get_client(), client)
+            self.assertEqual(client.query_url, self.server.url)
+            self.assertIs(payfast.validate_with_server({'m_payment_id': '1'}), True)
+            self.assertIs(asyncio.run(payfast.validate_with_server_async({'m_payment_id': '1'})), True)
+        # Changing the settings makes a new client
+        self.assertIsNot(get_client(), client)
+        self.assertEqual(get_client().query_url, settings.PAYFAST_QUERY_URL)
+
+    def test_query_url_is_plain_ascii(self):
+        self.assertTrue(settings.PAYFAST_QUERY_URL.isascii())
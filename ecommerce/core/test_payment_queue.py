@@ -0,0 +1,225 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import payfast
+from .models import Address, Order, OrderItem, Payment, PaymentNotification, Product, User
+from .payment_queue import process_batch
+
+PAYFAST_REFERER = 'https://sandbox.payfast.co.za'
+
+
+def create_payment(email='testuser1@gmail.com'):
+    user = User.objects.create_user(email=email, password='password123')
+    product = Product.objects.create(title='Product title 1', description='Product description 1', price=5.0, category='CP')
+    order = Order.objects.create(user=user)
+    OrderItem.objects.create(item=product, order=order, quantity=2)
+    address = Address.objects.create(user=user, name='John Doe', country='NZ', province='WC', zip_code='00408', city='Big City', suburb='Small suburb', street_address='50 Big Street', mobile_number='0723518979')
+    return Payment.objects.create(amount=order.total_price, address=address, order=order)
+
+
+def notification_data(payment, **changes):
+    data = {
+        'm_payment_id': str(payment.id),
+        'pf_payment_id': '1089250',
+        'payment_status': 'COMPLETE',
+        'item_name': payment.item_name,
+        'amount_gross': str(payment.amount),
+        'amount_fee': '-1.50',
+        'amount_net': '8.50',
+        'name_first': 'John Doe',
+        'merchant_id': '10000100',
+    }
+    data.update(changes)
+    data['signature'] = payfast.signature(data)
+    return data
+
+
+class PaymentNotifyViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payment = create_payment()
+
+    def test_notification_is_stored(self):
+        data = notification_data(self.payment)
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('core:payment-notify'), data, HTTP_REFERER=PAYFAST_REFERER)
+        self.assertEqual(response.status_code, 200)
+        notification = PaymentNotification.objects.get()
+        self.assertEqual(notification.payment, self.payment)
+        self.assertEqual(notification.referer, PAYFAST_REFERER)
+        self.assertEqual(notification.data, data)
+        self.assertEqual(notification.status, PaymentNotification.PENDING)
+        # Nothing is processed in the request
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'P')
+
+    def test_unknown_payment(self):
+        response = self.client.post(reverse('core:payment-notify'), {'m_payment_id': '9999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(PaymentNotification.objects.get().payment)
+
+    def test_only_post(self):
+        response = self.client.get(reverse('core:payment-notify'))
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(PAYFAST_SERVER_VALIDATION=False)
+class ProcessPaymentNotificationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payment = create_payment()
+
+    def notify(self, referer=PAYFAST_REFERER, **changes):
+        data = notification_data(self.payment, **changes)
+        self.client.post(reverse('core:payment-notify'), data, HTTP_REFERER=referer)
+        return PaymentNotification.objects.latest('id')
+
+    def process(self):
+        process_batch('test-worker', 10)
+
+    def assertProcessed(self, notification, outcome, payment_status):
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, PaymentNotification.DONE)
+        self.assertEqual(notification.outcome, outcome)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, payment_status)
+
+    def test_successful_payment_places_order(self):
+        notification = self.notify()
+        self.process()
+        self.assertProcessed(notification, 'successful', 'S')
+        order = Order.objects.get(pk=self.payment.order_id)
+        self.assertFalse(order.is_active)
+        self.assertEqual(order.placement_date, datetime.date.today())
+        self.assertEqual(notification.attempts, 1)
+        self.assertIsNotNone(notification.processed_at)
+
+    def test_invalid_signature(self):
+        notification = self.notify()
+        PaymentNotification.objects.filter(pk=notification.pk).update(payload=notification.payload.replace('COMPLETE', 'FAILED'))
+        self.process()
+        self.assertProcessed(notification, 'unsuccessful: signature', 'U')
+        self.assertTrue(Order.objects.get(pk=self.payment.order_id).is_active)
+
+    def test_invalid_host(self):
+        notification = self.notify(referer='https://example.com')
+        self.process()
+        self.assertProcessed(notification, 'unsuccessful: host', 'U')
+
+    def test_wrong_amount(self):
+        notification = self.notify(amount_gross='1.00')
+        self.process()
+        self.assertProcessed(notification, 'unsuccessful: amount', 'U')
+        self.assertTrue(Order.objects.get(pk=self.payment.order_id).is_active)
+
+    def test_duplicate_notification_is_ignored(self):
+        first, second = self.notify(), self.notify()
+        self.process()
+        self.assertProcessed(first, 'successful', 'S')
+        self.assertProcessed(second, 'duplicate', 'S')
+
+    def test_forged_notification_does_not_block_genuine_one(self):
+        forged = self.notify(referer='https://example.com')
+        self.process()
+        genuine = self.notify()
+        self.process()
+        self.assertProcessed(forged, 'unsuccessful: host', 'S')
+        self.assertProcessed(genuine, 'successful', 'S')
+
+    def test_unknown_payment(self):
+        self.client.post(reverse('core:payment-notify'), {'m_payment_id': '9999'}, HTTP_REFERER=PAYFAST_REFERER)
+        notification = PaymentNotification.objects.get()
+        self.process()
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.outcome), (PaymentNotification.DONE, 'unknown payment'))
+
+    @override_settings(PAYFAST_SERVER_VALIDATION=True)
+    def test_server_validation(self):
+        notification = self.notify()
+        with mock.patch('core.payfast.validate_with_server', return_value=False) as validate:
+            self.process()
+        validate.assert_called_once_with(notification.data)
+        self.assertProcessed(notification, 'unsuccessful: server', 'U')
+
+    @override_settings(PAYFAST_SERVER_VALIDATION=True, PAYMENT_NOTIFICATION_MAX_ATTEMPTS=2, PAYMENT_NOTIFICATION_RETRY_DELAY=60)
+    def test_retries_with_backoff_then_fails(self):
+        notification = self.notify()
+        unavailable = mock.patch('core.payfast.validate_with_server', side_effect=payfast.ValidationUnavailable('timed out'))
+        with unavailable, self.assertLogs('core.payment_queue', 'WARNING'):
+            self.process()
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), (PaymentNotification.PENDING, 1))
+        self.assertIn('timed out', notification.last_error)
+        self.assertGreater(notification.available_at, timezone.now() + datetime.timedelta(seconds=50))
+
+        # Not due yet
+        self.process()
+        notification.refresh_from_db()
+        self.assertEqual(notification.attempts, 1)
+
+        PaymentNotification.objects.update(available_at=timezone.now())
+        with unavailable, self.assertLogs('core.payment_queue', 'WARNING'):
+            self.process()
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), (PaymentNotification.FAILED, 2))
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'P')
+
+    def test_retry_succeeds(self):
+        notification = self.notify()
+        with mock.patch('core.payment_queue.process', side_effect=RuntimeError('database went away')), self.assertLogs('core.payment_queue', 'WARNING'):
+            self.process()
+        PaymentNotification.objects.update(available_at=timezone.now())
+        self.process()
+        self.assertProcessed(notification, 'successful', 'S')
+        self.assertEqual(notification.attempts, 2)
+
+
+class ClaimTest(TestCase):
+    def test_claimed_notifications_are_not_claimed_again(self):
+        for _ in range(3):
+            PaymentNotification.objects.create(payload='')
+        first = PaymentNotification.objects.claim('worker-1', 2)
+        second = PaymentNotification.objects.claim('worker-2', 2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({n.pk for n in first} & {n.pk for n in second})
+        self.assertEqual(PaymentNotification.objects.claim('worker-3', 2), [])
+        self.assertEqual(first[0].locked_by, 'worker-1')
+        self.assertEqual(first[0].status, PaymentNotification.PROCESSING)
+
+    def test_future_notifications_are_not_claimed(self):
+        PaymentNotification.objects.create(payload='', available_at=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(PaymentNotification.objects.claim('worker', 10), [])
+
+    @override_settings(PAYMENT_NOTIFICATION_LOCK_TIMEOUT=60)
+    def test_stale_claims_are_reclaimed(self):
+        notification = PaymentNotification.objects.create(payload='')
+        PaymentNotification.objects.claim('crashed-worker', 10)
+        self.assertEqual(PaymentNotification.objects.claim('worker', 10), [])
+        PaymentNotification.objects.update(locked_at=timezone.now() - datetime.timedelta(minutes=2))
+        [reclaimed] = PaymentNotification.objects.claim('worker', 10)
+        self.assertEqual((reclaimed.pk, reclaimed.locked_by, reclaimed.attempts), (notification.pk, 'worker', 2))
+
+
+@override_settings(PAYFAST_SERVER_VALIDATION=False)
+class ProcessPaymentNotificationsCommandTest(TransactionTestCase):
+    def test_concurrent_workers_process_every_notification_once(self):
+        payments = [create_payment(f'testuser{i}@gmail.com') for i in range(12)]
+        for payment in payments:
+            # Every payment is notified twice, like PayFast does when it doesn't get an answer in time
+            for _ in range(2):
+                self.client.post(reverse('core:payment-notify'), notification_data(payment), HTTP_REFERER=PAYFAST_REFERER)
+
+        out = StringIO()
+        call_command('process_payment_notifications', workers=4, batch_size=3, once=True, stdout=out)
+        self.assertIn('Processed 24 payment notifications.', out.getvalue())
+        self.assertFalse(PaymentNotification.objects.exclude(status=PaymentNotification.DONE).exists())
+        self.assertFalse(PaymentNotification.objects.exclude(attempts=1).exists())
+        self.assertEqual(PaymentNotification.objects.filter(outcome='successful').count(), 12)
+        self.assertEqual(PaymentNotification.objects.filter(outcome='duplicate').count(), 12)
+        self.assertFalse(Payment.objects.exclude(status='S').exists())
+        self.assertFalse(Order.objects.filter(is_active=True).exists())
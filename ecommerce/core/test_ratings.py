@@ -0,0 +1,87 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from .models import Product, ProductRating, Review
+
+User = get_user_model()
+
+class ProductRatingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.product = Product.objects.create(title='Product title 1', description='Product description 1', price=50, category='CP')
+        cls.other = Product.objects.create(title='Product title 2', description='Product description 2', price=50, category='CP')
+
+    def setUp(self):
+        cache.clear()
+
+    def summary(self, product=None):
+        return ProductRating.objects.get(product=product or self.product)
+
+    def test_reviews_update_summary(self):
+        for rating in (5, 4, 4):
+            Review.objects.create(user=self.user, product=self.product, rating=rating)
+        summary = self.summary()
+        self.assertEqual((summary.count, summary.total), (3, 13))
+        self.assertEqual(summary.histogram, [0, 0, 0, 2, 1])
+        self.assertAlmostEqual(summary.average, 13 / 3)
+
+    def test_deleting_review_updates_summary(self):
+        review = Review.objects.create(user=self.user, product=self.product, rating=5)
+        Review.objects.create(user=self.user, product=self.product, rating=1)
+        review.delete()
+        summary = self.summary()
+        self.assertEqual((summary.count, summary.total), (1, 1))
+        self.assertEqual(summary.histogram, [1, 0, 0, 0, 0])
+
+    def test_editing_review_moves_rating(self):
+        review = Review.objects.create(user=self.user, product=self.product, rating=5)
+        review.rating = 2
+        review.product = self.other
+        review.save()
+        self.assertEqual(self.summary().count, 0)
+        self.assertEqual(self.summary(self.other).histogram, [0, 1, 0, 0, 0])
+
+    def test_saving_unchanged_review_keeps_summary(self):
+        review = Review.objects.create(user=self.user, product=self.product, rating=5)
+        review.content = 'Edited content'
+        review.save()
+        self.assertEqual(self.summary().count, 1)
+
+    def test_review_submit_updates_summary(self):
+        self.client.login(email='testuser1@gmail.com', password='password123')
+        self.client.post(reverse('core:review-submit', kwargs={'product_id': self.product.id}), {'rating': 3, 'content': 'Content'})
+        self.assertEqual(self.summary().histogram, [0, 0, 1, 0, 0])
+
+    def test_listing_shows_rating_without_extra_queries(self):
+        Review.objects.create(user=self.user, product=self.product, rating=4)
+        response = self.client.get(reverse('core:index'))
+        self.assertEqual(response.wsgi_request.query_count, 1)
+        self.assertContains(response, '4.0 (1)')
+
+    def test_detail_shows_rating(self):
+        Review.objects.create(user=self.user, product=self.product, rating=4)
+        Review.objects.create(user=self.user, product=self.product, rating=5)
+        response = self.client.get(reverse('core:product-detail', kwargs={'product_id': self.product.id}))
+        self.assertContains(response, '4.5 (Based on 2 Ratings)')
+
+    def test_reconcile_rebuilds_summaries(self):
+        Review.objects.create(user=self.user, product=self.product, rating=4)
+        Review.objects.create(user=self.user, product=self.other, rating=2)
+        # Drift the summaries the way bulk changes that skip signals would
+        ProductRating.objects.filter(product=self.product).update(count=10, total=3)
+        ProductRating.objects.filter(product=self.other).delete()
+        stale = Product.objects.create(title='Product title 3', description='Product description 3', price=50, category='CP')
+        ProductRating.objects.create(product=stale, count=1, total=5, rating_5=1)
+
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        self.assertIn('Created 1, fixed 1 and deleted 1 rating summaries', out.getvalue())
+        self.assertEqual((self.summary().count, self.summary().total), (1, 4))
+        self.assertEqual(self.summary(self.other).histogram, [0, 1, 0, 0, 0])
+        self.assertFalse(ProductRating.objects.filter(product=stale).exists())
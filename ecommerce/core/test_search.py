@@ -0,0 +1,70 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from .models import Product
+from .search import FTS_TABLE, SQLiteFTSSearchBackend, SimpleSearchBackend, get_search_backend
+
+class SearchBackendSelectionTest(TestCase):
+    def test_sqlite_uses_fts_backend(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        self.assertIsInstance(get_search_backend(), SQLiteFTSSearchBackend)
+
+    @override_settings(SEARCH_BACKEND='core.search.SimpleSearchBackend')
+    def test_backend_from_setting(self):
+        self.assertIsInstance(get_search_backend(), SimpleSearchBackend)
+
+class FullTextSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(title='Gaming laptop', description='Fast and light', price=500, category='CP')
+        cls.bag = Product.objects.create(title='Shoulder bag', description='Fits a laptop up to 15 inches', price=50, category='CG')
+        cls.novel = Product.objects.create(title='Crime novel', description='A page turner', price=20, category='BK')
+
+    def search(self, text):
+        return get_search_backend().search(text, 100)
+
+    def test_title_match_ranks_above_description_match(self):
+        self.assertEqual(self.search('laptop'), [self.laptop.id, self.bag.id])
+
+    def test_matches_description(self):
+        self.assertEqual(self.search('turner'), [self.novel.id])
+
+    def test_matches_category_name(self):
+        self.assertEqual(self.search('clothing'), [self.bag.id])
+
+    def test_matches_word_prefix(self):
+        self.assertEqual(self.search('gam lap'), [self.laptop.id])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.search('laptop novel'), [])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('laptop" OR "novel'), [])
+        self.assertEqual(self.search('"*^()'), [])
+
+    def test_index_updated_on_save(self):
+        novel = Product.objects.get(pk=self.novel.pk)
+        novel.title = 'Detective story'
+        novel.save()
+        self.assertEqual(self.search('detective'), [self.novel.id])
+        self.assertEqual(self.search('crime'), [])
+
+    def test_index_updated_on_delete(self):
+        novel_id = self.novel.id
+        Product.objects.get(pk=novel_id).delete()
+        self.assertNotIn(novel_id, self.search('novel'))
+
+    def test_rebuild_command(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        self.assertEqual(self.search('laptop'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertEqual(self.search('laptop'), [self.laptop.id, self.bag.id])
@@ -0,0 +1,82 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, F, Sum
+from django.test import LiveServerTestCase, TestCase
+
+from .models import Address, CatalogVersion, Order, OrderItem, Payment, Product, ProductRating, Review, User
+from .search import get_search_backend
+
+
+class SeedStoreCommandTest(TestCase):
+    def seed(self, **options):
+        out = StringIO()
+        options = {'users': 20, 'products': 15, 'orders': 60, 'reviews': 100, 'batch_size': 7, **options}
+        call_command('seed_store', stdout=out, **options)
+        return out.getvalue()
+
+    def test_seeds_every_model(self):
+        out = self.seed()
+        self.assertIn('Seeded the store', out)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Address.objects.count(), 20)
+        self.assertEqual(Product.objects.count(), 15)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertEqual(Review.objects.count(), 100)
+        # Every placed order is paid from an address of its user
+        placed = Order.objects.filter(is_active=False)
+        self.assertEqual(Payment.objects.count(), placed.count())
+        self.assertFalse(Payment.objects.exclude(address__user=F('order__user')).exists())
+        self.assertFalse(Order.objects.filter(orderitem__isnull=True).exists())
+
+    def test_constraints_hold(self):
+        self.seed()
+        active = Order.objects.filter(is_active=True, user__isnull=False)
+        self.assertFalse(active.values('user').annotate(n=Count('id')).filter(n__gt=1).exists())
+        self.assertEqual(Order.objects.filter(is_active=True).count(), 6)
+        self.assertTrue(Order.objects.filter(is_active=True, user__isnull=True).exists())
+
+    def test_payment_amounts_match_items(self):
+        self.seed()
+        payment = Payment.objects.select_related('order').first()
+        self.assertAlmostEqual(payment.amount, payment.order.total_price, places=1)
+        self.assertEqual(payment.item_name, f'Order #{payment.order_id}')
+
+    def test_derived_data_is_up_to_date(self):
+        version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        self.seed()
+        ratings = ProductRating.objects.aggregate(count=Sum('count'))
+        self.assertEqual(ratings['count'], 100)
+        product = Product.objects.first()
+        self.assertIn(product.pk, get_search_backend().search(product.title, 10))
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version + 1)
+
+    def test_is_deterministic(self):
+        self.seed(seed=3)
+        titles = list(Product.objects.order_by('id').values_list('title', flat=True))
+        self.seed(seed=3, prefix='again')
+        again = list(Product.objects.filter(sku__startswith='again').order_by('id').values_list('title', flat=True))
+        self.assertEqual(titles, again)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+    def test_load_test(self):
+        call_command('seed_store', users=3, products=5, orders=10, reviews=10, stdout=StringIO())
+        out = StringIO()
+        call_command('load_test', url=self.live_server_url, clients=2, duration=0.5, stdout=out)
+        output = out.getvalue()
+        for view in ('index', 'search', 'product_detail', 'add_to_cart', 'view_cart', 'checkout'):
+            self.assertIn(view, output)
+        self.assertIn(' 0 errors', output)
+        self.assertIn('requests/s', output)
+        self.assertTrue(OrderItem.objects.filter(order__user__email='seed0@example.com', order__is_active=True).exists())
+
+    def test_needs_seeded_users(self):
+        with self.assertRaises(CommandError):
+            call_command('load_test', url=self.live_server_url, clients=2, duration=0.1, stdout=StringIO())
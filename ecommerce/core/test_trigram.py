@@ -0,0 +1,147 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import CatalogVersion, Product
+from .trigram import TrigramIndex, get_trigram_index, reset_trigram_index, trigrams
+
+class TrigramsTest(TestCase):
+    def test_words_are_padded(self):
+        self.assertEqual(trigrams('Cat'), {'  c', ' ca', 'cat', 'at '})
+
+    def test_case_and_punctuation_ignored(self):
+        self.assertEqual(trigrams('CAT!'), trigrams('cat'))
+
+class TrigramIndexTest(TestCase):
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.add(1, 'Louis Vutton handbag')
+        self.index.add(2, 'Bicycle')
+        self.index.add(3, 'Mountain bike')
+
+    def test_misspelled_query_finds_title(self):
+        self.assertEqual(self.index.search('Luis Vuton')[0][0], 1)
+
+    def test_results_ordered_by_similarity(self):
+        results = self.index.search('bicycle')
+        self.assertEqual(results[0], (2, 1.0))
+        similarities = [similarity for pk, similarity in results]
+        self.assertEqual(similarities, sorted(similarities, reverse=True))
+
+    def test_threshold_filters_unrelated_titles(self):
+        self.assertEqual(self.index.search('zzzz'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.search('bike bicycle handbag', limit=2, threshold=0)), 2)
+
+    def test_update_replaces_title(self):
+        self.index.add(2, 'Tricycle')
+        self.assertNotIn(2, [pk for pk, similarity in self.index.search('bicycle', threshold=0.5)])
+        self.assertEqual(self.index.search('tricycle')[0][0], 2)
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn(3, [pk for pk, similarity in self.index.search('mountain bike')])
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trigrams.pickle')
+            self.index.save(path)
+            loaded = TrigramIndex.load(path)
+        self.assertEqual(loaded.search('Luis Vuton'), self.index.search('Luis Vuton'))
+
+class ProcessTrigramIndexTest(TestCase):
+    def setUp(self):
+        reset_trigram_index()
+        self.addCleanup(reset_trigram_index)
+        self.product = Product.objects.create(title='Louis Vutton', description='Bag', price=50, category='CG')
+
+    def test_built_from_database(self):
+        self.assertEqual(get_trigram_index().search('Luis Vuton')[0][0], self.product.id)
+
+    def test_updated_by_product_signals(self):
+        index = get_trigram_index()
+        other = Product.objects.create(title='Communication device', description='Phone', price=500, category='CP')
+        self.assertEqual(index.search('comunication')[0][0], other.id)
+        other.delete()
+        self.assertEqual(index.search('comunication'), [])
+
+    def test_loads_current_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trigrams.pickle')
+            call_command('build_trigram_snapshot', path=path, stdout=StringIO())
+            with override_settings(TRIGRAM_SNAPSHOT_PATH=path):
+                self.assertEqual(len(get_trigram_index()), 1)
+
+    def test_stale_snapshot_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trigrams.pickle')
+            call_command('build_trigram_snapshot', path=path, stdout=StringIO())
+            Product.objects.create(title='Bicycle', description='Bike', price=50, category='CP')
+            reset_trigram_index()
+            with override_settings(TRIGRAM_SNAPSHOT_PATH=path):
+                self.assertEqual(len(get_trigram_index()), 2)
+
+    def test_snapshot_is_stale_after_a_title_edit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trigrams.pickle')
+            call_command('build_trigram_snapshot', path=path, stdout=StringIO())
+            self.product.title = 'Bicycle'
+            self.product.save()
+            reset_trigram_index()
+            with override_settings(TRIGRAM_SNAPSHOT_PATH=path):
+                self.assertEqual(get_trigram_index().search('bicycle')[0][0], self.product.id)
+                self.assertEqual(get_trigram_index().search('Luis Vuton'), [])
+
+    def test_rebuilt_after_a_change_in_another_process(self):
+        index = get_trigram_index()
+        # Another process saved the product: the row changed and the version was bumped, but not this index
+        Product.objects.filter(pk=self.product.pk).update(title='Bicycle')
+        CatalogVersion.objects.bump(CatalogVersion.TITLES)
+        rebuilt = get_trigram_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.search('bicycle')[0][0], self.product.id)
+
+    def test_own_changes_keep_the_index(self):
+        index = get_trigram_index()
+        Product.objects.create(title='Communication device', description='Phone', price=500, category='CP')
+        # Only the titles version is read
+        with self.assertNumQueries(1):
+            self.assertIs(get_trigram_index(), index)
+
+    def test_price_edit_keeps_the_version(self):
+        version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 60
+        product.save()
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version)
+        product.title = 'Louis Vuitton'
+        product.save()
+        self.assertEqual(CatalogVersion.objects.current(CatalogVersion.TITLES), version + 1)
+
+class FuzzySearchViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(title='Louis Vutton', description='Product Test', price=50, category='CG')
+        Product.objects.create(title='Bicycle', description='Product Test 2', price=50, category='BK')
+
+    def setUp(self):
+        reset_trigram_index()
+        self.addCleanup(reset_trigram_index)
+
+    def test_misspelled_search_falls_back_to_similar_products(self):
+        response = self.client.get(reverse('core:search'), {'search': 'luis vuton'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['fuzzy'])
+        self.assertEqual(list(response.context['products']), [Product.objects.get(title='Louis Vutton')])
+        self.assertContains(response, 'Showing similar products instead.')
+
+    def test_exact_search_does_not_use_fallback(self):
+        response = self.client.get(reverse('core:search'), {'search': 'bicycle'})
+        self.assertFalse(response.context['fuzzy'])
+        self.assertEqual(len(response.context['products']), 1)
@@ -5,12 +5,16 @@ from urllib.parse import urlencode, quote_plus
 from django import setup
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+from .autocomplete import get_autocomplete_index, reset_autocomplete_index
 from .models import Product, Order, OrderItem, Address, Payment, Review
 from .forms import AddressForm, RegisterForm, ReviewForm
+from .middleware import QueryBudgetExceeded, QueryCounter, get_query_budget
+from .trigram import get_trigram_index, reset_trigram_index
 
 User = get_user_model()
 
@@ -47,6 +51,32 @@ class IndexTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue('user' in response.context)
 
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_context_products_limited_to_page_size(self):
+        for i in range(3):
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=50, category='CP')
+        response = self.client.get(reverse('core:index'))
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertTrue(response.context['page'].has_next)
+        self.assertFalse(response.context['page'].has_previous)
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_next_cursor_returns_remaining_products(self):
+        for i in range(3):
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=50, category='CP')
+        response = self.client.get(reverse('core:index'))
+        response = self.client.get(reverse('core:index'), {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 1)
+        self.assertEqual(response.context['products'][0], Product.objects.get(title='Product title 0'))
+        self.assertTrue(response.context['page'].has_previous)
+
+    def test_invalid_cursor_returns_first_page(self):
+        Product.objects.create(title='Product title', description='Product description', price=50, category='CP')
+        response = self.client.get(reverse('core:index'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 1)
+
 class ProductSearchTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -143,6 +173,30 @@ class ProductSearchTest(TestCase):
         self.assertIn('products', response.context)
         self.assertEqual(len(response.context['products']), Product.objects.count())
 
+    def test_search_matches_description(self):
+        get_parameters = {'search': 'test 6'}
+        response = self.client.get(reverse('core:search'), get_parameters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['products']), [Product.objects.get(description='Product Test 6')])
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_search_next_cursor_returns_remaining_results(self):
+        get_parameters = {'search': 'louis'}
+        response = self.client.get(reverse('core:search'), get_parameters)
+        first_page = list(response.context['products'])
+        get_parameters['cursor'] = response.context['page'].next_cursor
+        response = self.client.get(reverse('core:search'), get_parameters)
+        self.assertEqual(len(response.context['products']), 1)
+        self.assertNotIn(response.context['products'][0], first_page)
+        self.assertFalse(response.context['page'].has_next)
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_search_pagination_links_keep_search_text(self):
+        get_parameters = {'search': 'louis'}
+        response = self.client.get(reverse('core:search'), get_parameters)
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertContains(response, f'?search=louis&amp;cursor={response.context["page"].next_cursor}')
+
 class ProductDetailTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -198,6 +252,63 @@ class ProductDetailTest(TestCase):
         self.assertEqual(len(response.context['reviews']), 2)   
         self.assertIsInstance(response.context['reviews'][0], Review)
 
+@override_settings(REVIEWS_PAGE_SIZE=3)
+class ProductReviewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.product = Product.objects.create(title='Product title 1', description='Product description 1', price=50, category='CP')
+        for i, rating in enumerate([3, 5, 1, 4, 5, 2, 4]):
+            Review.objects.create(user=cls.test_user, product=cls.product, rating=rating, content=f'Review {i}')
+        # Spread the reviews over two days so both ordering fields are used
+        Review.objects.filter(content__in=['Review 5', 'Review 6']).update(publish_date=datetime.date(2020, 1, 1))
+
+    def expected_ids(self, sort):
+        return list(Review.objects.filter(product=self.product).order_by(*Review.ORDERINGS[sort]).values_list('id', flat=True))
+
+    def walk(self, sort):
+        url = reverse('core:product-reviews', kwargs={'product_id': self.product.id})
+        response = self.client.get(url, {'sort': sort})
+        ids = [review['id'] for review in response.json()['reviews']]
+        while response.json()['next_cursor']:
+            response = self.client.get(url, {'sort': sort, 'cursor': response.json()['next_cursor']})
+            ids.extend(review['id'] for review in response.json()['reviews'])
+        return ids
+
+    def test_detail_renders_first_page_only(self):
+        response = self.client.get(reverse('core:product-detail', kwargs={'product_id': self.product.id}))
+        self.assertEqual([review.id for review in response.context['reviews']], self.expected_ids('recent')[:3])
+        self.assertContains(response, 'id="load-more-reviews"')
+
+    def test_detail_sorted_by_rating(self):
+        response = self.client.get(reverse('core:product-detail', kwargs={'product_id': self.product.id}), {'sort': 'rating'})
+        self.assertEqual([review.rating for review in response.context['reviews']], [5, 5, 4])
+        self.assertEqual(response.context['review_sort'], 'rating')
+
+    def test_unknown_sort_falls_back_to_recent(self):
+        response = self.client.get(reverse('core:product-detail', kwargs={'product_id': self.product.id}), {'sort': 'content'})
+        self.assertEqual(response.context['review_sort'], 'recent')
+
+    def test_load_more_walks_every_review_once(self):
+        self.assertEqual(self.walk('recent'), self.expected_ids('recent'))
+        self.assertEqual(self.walk('rating'), self.expected_ids('rating'))
+
+    def test_json_fields(self):
+        response = self.client.get(reverse('core:product-reviews', kwargs={'product_id': self.product.id}))
+        review = response.json()['reviews'][0]
+        self.assertEqual(set(review), {'id', 'user', 'rating', 'content', 'publish_date'})
+        self.assertEqual(review['user'], 'testuser1')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('core:product-reviews', kwargs={'product_id': self.product.id}), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_is_one_query(self):
+        url = reverse('core:product-reviews', kwargs={'product_id': self.product.id})
+        cursor = self.client.get(url).json()['next_cursor']
+        with self.assertNumQueries(1):
+            self.client.get(url, {'cursor': cursor})
+
 class ReviewSubmitTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -493,6 +604,18 @@ class ViewCartTest(TestCase):
         self.assertIsInstance(response.context['order_items'][0], OrderItem)
         self.assertEqual(len(response.context['order_items']), 3)
 
+    def test_context_contains_order_total(self):
+        user = User.objects.all()[0]
+        order = Order.objects.create(user=user)
+        product_1 = Product.objects.create(title='Product title 1', description='Product description 1', price=5, category='CP')
+        product_2 = Product.objects.create(title='Product title 2', description='Product description 2', price=1005, category='BK')
+        OrderItem.objects.create(item=product_1, order=order, quantity=2)
+        OrderItem.objects.create(item=product_2, order=order, quantity=1)
+        login = self.client.login(email='testuser1@gmail.com', password='password123')
+        response = self.client.get(reverse('core:cart'))
+        self.assertEqual(response.context['order_total'], 1015)
+        self.assertContains(response, 'R1015.0')
+
     def test_context_does_not_contain_order_items_with_no_order(self):
         login = self.client.login(email='testuser1@gmail.com', password='password123')
         response = self.client.get(reverse('core:cart'))
@@ -549,6 +672,16 @@ class ViewCartTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertNotIn('order_items', response.context)
 
+    def test_guest_view_does_not_create_order(self):
+        self.client.get(reverse('core:cart'))
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertNotIn('order_id', self.client.session)
+
+    def test_logged_in_view_does_not_create_order(self):
+        login = self.client.login(email='testuser1@gmail.com', password='password123')
+        self.client.get(reverse('core:cart'))
+        self.assertEqual(Order.objects.count(), 0)
+
     def test_context_does_not_contain_guest_order_items_with_order_but_zero_order_items(self):
         order = Order.objects.create()
         order.save()
@@ -774,6 +907,7 @@ class RemoveFromCartTest(TestCase):
         login = self.client.login(email='testuser1@gmail.com', password='password123')
         response = self.client.get(reverse('core:cart-remove', kwargs={'product_id': 1}))
         self.assertEqual(response.status_code, 404)
+        self.assertEqual(Order.objects.count(), 0)
 
     def test_404_if_order_exists_but_order_item_does_not(self):
         product_1 = Product.objects.create(title='Product title 1', description='Product description 1', price=5, category='CP')
@@ -1458,4 +1592,230 @@ class OrderDetailTest(TestCase):
     #redirect if not logged in
 
 class AccountTest(TestCase):
-    pass
\ No newline at end of file
+    pass
+
+
+class PageQueryCountTest(TestCase):
+    """Pages must run a fixed number of queries, however many rows they show."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.reviewer = User.objects.create_user(email='testuser2@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=5, category='CP')
+            for i in range(10)
+        ]
+
+    def setUp(self):
+        self.client.login(email='testuser1@gmail.com', password='password123')
+        self.order = Order.objects.create(user=self.test_user)
+        # Store the order in the session so the cart page doesn't have to
+        self.client.get(reverse('core:cart'))
+
+    def assertMaxQueries(self, num, url, method='get', data=None):
+        response = getattr(self.client, method)(url, data or {})
+        self.assertLessEqual(response.wsgi_request.query_count, num)
+        return response
+
+    def fill_cart(self, count):
+        for product in self.products[:count]:
+            OrderItem.objects.create(item=product, order=self.order, quantity=2)
+
+    def add_reviews(self, count):
+        for i in range(count):
+            Review.objects.create(user=self.reviewer, product=self.products[0], rating=4, content=f'Review {i}')
+
+    def test_cart(self):
+        self.fill_cart(10)
+        # The items were added behind the cart views' back, the first visit stores the new badge summary
+        self.client.get(reverse('core:cart'))
+        response = self.assertMaxQueries(5, reverse('core:cart'))
+        self.assertEqual(len(response.context['order_items']), 10)
+
+    def test_product_detail(self):
+        self.add_reviews(10)
+        response = self.assertMaxQueries(4, reverse('core:product-detail', kwargs={'product_id': self.products[0].id}))
+        self.assertEqual(len(response.context['reviews']), 10)
+
+    def test_review_submit_with_invalid_form(self):
+        self.add_reviews(10)
+        url = reverse('core:review-submit', kwargs={'product_id': self.products[0].id})
+        response = self.assertMaxQueries(4, url, method='post')
+        self.assertEqual(len(response.context['reviews']), 10)
+
+    def test_checkout(self):
+        self.fill_cart(10)
+        self.assertMaxQueries(5, reverse('core:checkout'))
+
+
+class QueryBudgetMixin:
+    """Fail a test when a response ran more queries than its view's QUERY_BUDGETS entry."""
+    def assertWithinBudget(self, response):
+        request = response.wsgi_request
+        view_name = request.resolver_match.view_name
+        budget = get_query_budget(view_name)
+        self.assertIsNotNone(budget, f'{view_name} has no query budget.')
+        stats = request.query_stats
+        self.assertLessEqual(
+            stats.count, budget,
+            f'{view_name} ran {stats.count} queries, its budget is {budget}. '
+            f'Repeated statements: {stats.repeated_statements()}',
+        )
+        return response
+
+    def get(self, url_name, *args, data=None, **extra):
+        return self.assertWithinBudget(self.client.get(reverse(url_name, args=args), data or {}, **extra))
+
+    def post(self, url_name, *args, data=None, **extra):
+        return self.assertWithinBudget(self.client.post(reverse(url_name, args=args), data or {}, **extra))
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(email='testuser1@gmail.com', password='password123')
+        cls.products = [
+            Product.objects.create(title=f'Product title {i}', description=f'Product description {i}', price=5, category='CP')
+            for i in range(30)
+        ]
+        cls.address = Address.objects.create(user=cls.test_user, name='John Doe', country='NZ', province='WC', zip_code='00408', city='Big City', suburb='Small suburb', street_address='50 Big Street', mobile_number='0723518979')
+        for product in cls.products[:5]:
+            Review.objects.create(user=cls.test_user, product=cls.products[0], rating=4, content='Review content')
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.test_user)
+        for product in self.products[:5]:
+            OrderItem.objects.create(item=product, order=self.order, quantity=1)
+
+    def login(self):
+        self.client.login(email='testuser1@gmail.com', password='password123')
+
+    def test_every_core_view_has_a_budget(self):
+        from . import urls
+        def names(patterns, namespace):
+            for pattern in patterns:
+                if hasattr(pattern, 'url_patterns'):
+                    yield from names(pattern.url_patterns, namespace)
+                else:
+                    yield f'{namespace}:{pattern.name}'
+        for view_name in names(urls.urlpatterns, urls.app_name):
+            self.assertIsNotNone(get_query_budget(view_name), f'{view_name} has no query budget.')
+
+    def test_catalog(self):
+        # The search indexes are built once per process, budgets are for the requests after that
+        reset_trigram_index()
+        self.addCleanup(reset_trigram_index)
+        get_trigram_index()
+        reset_autocomplete_index()
+        self.addCleanup(reset_autocomplete_index)
+        get_autocomplete_index()
+        for logged_in in (False, True):
+            if logged_in:
+                self.login()
+            first_page = self.get('core:index').context['page']
+            self.assertTrue(first_page.has_next)
+            second_page = self.get('core:index', data={'cursor': first_page.next_cursor}).context['page']
+            self.assertTrue(second_page.has_previous)
+            self.assertNotEqual(second_page[0], first_page[0])
+            response = self.get('core:search', data={'search': 'product'})
+            self.assertEqual(response.context['search_text'], 'product')
+            self.assertFalse(response.context['fuzzy'])
+            self.assertTrue(response.context['products'])
+            response = self.get('core:search', data={'search': 'prodcut'})
+            self.assertEqual(response.context['search_text'], 'prodcut')
+            self.assertTrue(response.context['fuzzy'])
+            self.get('core:autocomplete', data={'q': 'prod'})
+            self.get('core:product-detail', self.products[0].id)
+            self.get('core:product-reviews', self.products[0].id, data={'sort': 'rating'})
+
+    def test_review_submit(self):
+        self.login()
+        # The first review of a product creates its rating summary, the next ones update it
+        self.post('core:review-submit', self.products[1].id, data={'rating': 4, 'content': 'Review content'})
+        self.post('core:review-submit', self.products[0].id, data={'rating': 4, 'content': 'Review content'})
+        self.post('core:review-submit', self.products[0].id)
+
+    def test_guest_cart(self):
+        self.get('core:cart')
+        self.get('core:cart-add', self.products[6].id, 'cart')
+        self.get('core:cart-add', self.products[6].id, 'cart')
+        self.get('core:cart')
+        self.get('core:cart-remove-single', self.products[6].id)
+        self.get('core:cart-add', self.products[7].id, 'cart')
+        self.get('core:cart-remove', self.products[7].id)
+
+    def test_cart(self):
+        self.login()
+        self.get('core:cart')
+        self.get('core:cart-add', self.products[6].id, 'cart')
+        self.get('core:cart-add', self.products[6].id, 'product-detail')
+        self.get('core:cart-remove-single', self.products[6].id)
+        self.get('core:cart-remove', self.products[6].id)
+        self.get('core:cart')
+
+    def test_checkout(self):
+        self.login()
+        self.get('core:checkout')
+        self.post('core:checkout', data={'addresses': self.address.id})
+
+    def test_payment(self):
+        payment = Payment.objects.create(amount=25, address=self.address, order=self.order)
+        data = {'m_payment_id': payment.id, 'amount_gross': '25.0', 'signature': 'invalid'}
+        self.post('core:payment-notify', data=data, HTTP_REFERER='https://sandbox.payfast.co.za')
+        self.get('core:payment-return')
+        self.get('core:payment-cancel')
+        self.login()
+        self.get('core:payment-return')
+        # Cancelling a signed in user's pending payment
+        self.get('core:payment-cancel')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'C')
+
+    def test_accounts(self):
+        self.get('core:register')
+        self.post('core:register', data={'email': 'testuser2@gmail.com', 'password': 'password123', 'password_confirm': 'password123'})
+        self.get('core:login')
+        self.post('core:login', data={'username': 'testuser1@gmail.com', 'password': 'password123'})
+        self.get('core:password_change')
+        self.get('core:password_change_done')
+        self.get('core:logout')
+        self.get('core:password_reset')
+        self.get('core:password_reset_done')
+        self.get('core:password_reset_confirm', 'MQ', 'invalid-token')
+        self.get('core:password_reset_complete')
+
+
+class QueryBudgetMiddlewareTest(TestCase):
+    @override_settings(DEBUG=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", total;dur=[\d.]+$')
+
+    def test_no_server_timing_header_without_debug(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_duplicate_statements_are_counted(self):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for i in range(3):
+                list(Product.objects.filter(pk=i))
+            list(Order.objects.all())
+        self.assertEqual(counter.count, 4)
+        self.assertEqual(counter.duplicates, 2)
+        self.assertEqual(list(counter.repeated_statements().values()), [3])
+
+    @override_settings(DEBUG=True, QUERY_BUDGETS={'core:index': 0})
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            self.client.get(reverse('core:index'))
+        self.assertIn('core:index ran 1 queries, its budget is 0', logs.output[0])
+
+    @override_settings(DEBUG=True, QUERY_BUDGETS={'core:index': 0}, QUERY_BUDGET_RAISE=True)
+    def test_over_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded), self.assertLogs('django.request', 'ERROR'):
+            self.client.get(reverse('core:index'))
+
+    @override_settings(DEBUG=True, QUERY_BUDGETS={'core:index': 1}, QUERY_BUDGET_RAISE=True)
+    def test_within_budget_does_not_raise(self):
+        self.assertEqual(self.client.get(reverse('core:index')).status_code, 200)
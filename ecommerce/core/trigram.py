@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import math
+import os
+import pickle
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import CatalogVersion, Product
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+
+def trigrams(text):
+    """Split text into trigrams the way pg_trgm does: per word, padded with spaces."""
+    grams = set()
+    for word in words(text):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    In-memory fuzzy index over product titles.
+
+    Similarity is measured per word, as the Jaccard index of the trigram sets
+    of a query word and a title word (like pg_trgm). Each query word is matched
+    against the vocabulary of title words, which is much smaller than the
+    catalog, and titles are then found through word postings with set
+    intersections. A title's score is the mean over the query words of the
+    best similarity of one of its words.
+    """
+    # Corrections considered per query word, and query words considered per search
+    MAX_CORRECTIONS = 4
+    MAX_QUERY_WORDS = 5
+
+    def __init__(self):
+        self.titles = {}
+        self.word_titles = defaultdict(set)
+        self.gram_words = defaultdict(set)
+        self.fingerprint = None
+        # The titles version (see CatalogVersion) the index is in step with
+        self.version = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, pk, title):
+        title_words = frozenset(words(title))
+        with self.lock:
+            self.remove(pk)
+            self.titles[pk] = title_words
+            for word in title_words:
+                if word not in self.word_titles:
+                    for gram in trigrams(word):
+                        self.gram_words[gram].add(word)
+                self.word_titles[word].add(pk)
+
+    def remove(self, pk):
+        with self.lock:
+            for word in self.titles.pop(pk, ()):
+                pks = self.word_titles[word]
+                pks.discard(pk)
+                if pks:
+                    continue
+                del self.word_titles[word]
+                for gram in trigrams(word):
+                    vocabulary = self.gram_words[gram]
+                    vocabulary.discard(word)
+                    if not vocabulary:
+                        del self.gram_words[gram]
+
+    def similar_words(self, word, threshold, limit):
+        """Return up to `limit` (similarity, title word) pairs for a query word."""
+        query = trigrams(word)
+        if not query:
+            return []
+        # A word with similarity >= threshold shares at least threshold * len(query)
+        # trigrams with the query, so it is in one of the len(query) - min_shared + 1
+        # rarest postings and the commonest postings never need scanning.
+        min_shared = max(math.ceil(threshold * len(query)), 1)
+        postings = sorted((self.gram_words.get(gram, ()) for gram in query), key=len)
+        scored = []
+        for candidate in set().union(*postings[:len(query) - min_shared + 1]):
+            grams = trigrams(candidate)
+            shared = len(query & grams)
+            similarity = shared / (len(query) + len(grams) - shared)
+            if similarity >= threshold:
+                scored.append((similarity, candidate))
+        return heapq.nlargest(limit, scored)
+
+    def search(self, text, limit=10, threshold=0.3):
+        """Return up to `limit` (product id, similarity) pairs, most similar first."""
+        query_words = list(dict.fromkeys(words(text)))[:self.MAX_QUERY_WORDS]
+        if not query_words:
+            return []
+        with self.lock:
+            # None stands for leaving the query word unmatched
+            choices = [
+                self.similar_words(word, threshold, self.MAX_CORRECTIONS) + [(0.0, None)]
+                for word in query_words
+            ]
+            combinations = sorted(
+                ((sum(similarity for similarity, word in combination), combination)
+                 for combination in itertools.product(*choices)),
+                key=lambda item: item[0], reverse=True,
+            )
+            # Walking the combinations best first, the first one a title matches
+            # gives its score, so every title only needs to be seen once.
+            results = {}
+            for total, combination in combinations:
+                score = total / len(query_words)
+                if score < threshold or len(results) >= limit:
+                    break
+                postings = sorted((self.word_titles[word] for similarity, word in combination if word), key=len)
+                if not postings:
+                    continue
+                matches = postings[0].intersection(*postings[1:]).difference(results)
+                for pk in heapq.nlargest(limit - len(results), matches):
+                    results[pk] = score
+        return list(results.items())
+
+    def save(self, path):
+        with self.lock:
+            state = {'titles': self.titles, 'fingerprint': self.fingerprint,
+                     'word_titles': self.word_titles, 'gram_words': self.gram_words}
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        index = cls()
+        index.titles = state['titles']
+        index.word_titles = state['word_titles']
+        index.gram_words = state['gram_words']
+        index.fingerprint = state['fingerprint']
+        index.version = index.fingerprint[-1] if index.fingerprint else None
+        return index
+
+    @classmethod
+    def from_database(cls):
+        index = cls()
+        # Taken before reading the titles, so a change made meanwhile shows as a new version
+        index.fingerprint = catalog_fingerprint()
+        index.version = index.fingerprint[-1]
+        for pk, title in Product.objects.values_list('id', 'title').iterator(chunk_size=5000):
+            index.add(pk, title)
+        return index
+
+
+def catalog_fingerprint():
+    # Cheap check that a snapshot still describes the product table, the
+    # version catches title edits, which change neither the count nor the max id
+    result = Product.objects.aggregate(max_id=Max('id'))
+    return (Product.objects.count(), result['max_id'], CatalogVersion.objects.current(CatalogVersion.TITLES))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_trigram_index():
+    """
+    Return the process wide trigram index, loading it from the snapshot in
+    TRIGRAM_SNAPSHOT_PATH when that is still current, or building it from the
+    database on first use. Product signals keep it up to date with changes
+    made in this process, and it is built again when the titles version shows
+    another process changed a product.
+    """
+    global _index
+    version = CatalogVersion.objects.current(CatalogVersion.TITLES)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = load_or_build_index()
+            index = _index
+    return index
+
+def load_or_build_index():
+    path = getattr(settings, 'TRIGRAM_SNAPSHOT_PATH', None)
+    if path and os.path.exists(path):
+        try:
+            index = TrigramIndex.load(path)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            index = None
+        if index is not None and index.fingerprint == catalog_fingerprint():
+            return index
+    return TrigramIndex.from_database()
+
+def loaded_trigram_index():
+    """Return the index if it has been built in this process, else None."""
+    return _index
+
+def reset_trigram_index():
+    global _index
+    _index = None
@@ -7,7 +7,9 @@ app_name = 'core'
 urlpatterns = [
     path('', views.index, name='index'),
     path('search/', views.search, name='search'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
     path('detail/<int:product_id>/', views.product_detail, name='product-detail'),
+    path('detail/<int:product_id>/reviews/', views.product_reviews, name='product-reviews'),
     path('review-submit/<int:product_id>/', views.review_submit, name='review-submit'),
     path('cart/', views.view_cart, name='cart'),
     path('cart-add/<int:product_id>/<str:redirect_url>/', views.add_to_cart, name='cart-add'),
@@ -3,72 +3,146 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import redirect, render, get_object_or_404
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 
-import datetime
-import hashlib
 import requests
-from urllib.parse import urlencode, quote_plus
 
-from .models import Product, Order, OrderItem, Address, Payment, Review
+from . import payfast, payment_queue
+from .models import Product, Address, OutboxEmail, Payment, Review
 from .forms import RegisterForm, AddressForm, ReviewForm
+from .autocomplete import get_autocomplete_index
+from .cart import EMPTY_CART_SUMMARY, get_cart_backend
+from .catalog_cache import catalog_cache_context
+from .pagination import InvalidCursor, KeysetPaginator, RankedPaginator
+from .search import get_search_backend
+from .trigram import get_trigram_index
 
 User = get_user_model()
 
-def index(request):
-    products = Product.objects.all()
+# Newest products first, id breaks ties between products published on the same day
+CATALOG_ORDERING = ('-publish_date', '-id')
+
+def paginate_catalog(request, products):
+    paginator = KeysetPaginator(products, CATALOG_ORDERING, settings.CATALOG_PAGE_SIZE)
+    return paginator.get_page(request.GET.get('cursor'))
+
+def index_context(request):
+    page = paginate_catalog(request, Product.objects.select_related('rating'))
     # TODO do something if there are no products..in the template?
-    context = {
-        'products': products,
+    return {
+        'products': page,
+        'page': page,
         'user': request.user,
+        **catalog_cache_context(page),
     }
-    return render(request, "core/home.html", context)
 
-def search(request):
-    search_text = request.GET.get('search')
-    if search_text:
-        search_param = search_text.strip()
-        products = Product.objects.filter(title__icontains=search_param)
+def index(request):
+    return render(request, "core/home.html", index_context(request))
+
+def search_context(request):
+    search_param = (request.GET.get('search') or '').strip()
+    fuzzy = False
+    if search_param:
+        # Results are ranked by relevance, so page through the ranked ids
+        product_ids = get_search_backend().search(search_param, settings.SEARCH_MAX_RESULTS)
+        if not product_ids:
+            # Nothing matched exactly, so the query may be misspelled
+            matches = get_trigram_index().search(search_param, settings.FUZZY_SEARCH_MAX_RESULTS)
+            product_ids = [product_id for product_id, similarity in matches]
+            fuzzy = bool(product_ids)
+        paginator = RankedPaginator(Product.objects.select_related('rating'), product_ids, settings.CATALOG_PAGE_SIZE)
+        page = paginator.get_page(request.GET.get('cursor'))
     else:
-        products = Product.objects.all()
+        page = paginate_catalog(request, Product.objects.select_related('rating'))
 
-    context = {
-        'products': products,
+    return {
+        'products': page,
+        'page': page,
+        'search_text': search_param,
+        'fuzzy': fuzzy,
+        **catalog_cache_context(page),
     }
-    return render(request, "core/home.html", context)
 
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    reviews = Review.objects.filter(product=product)
+def search(request):
+    return render(request, "core/home.html", search_context(request))
+
+def autocomplete(request):
+    # Answered from the in-memory prefix index, the database is only asked for the titles version
+    prefix = request.GET.get('q', '').strip()
+    results = []
+    if len(prefix) >= settings.AUTOCOMPLETE_MIN_LENGTH:
+        for product_id, title in get_autocomplete_index().complete(prefix, settings.AUTOCOMPLETE_MAX_RESULTS):
+            results.append({
+                'id': product_id,
+                'title': title,
+                'url': reverse('core:product-detail', kwargs={'product_id': product_id}),
+            })
+    return JsonResponse({'results': results})
+
+def review_sort(request):
+    sort = request.GET.get('sort')
+    return sort if sort in Review.ORDERINGS else 'recent'
+
+def paginate_reviews(product, sort, cursor=None):
+    paginator = KeysetPaginator(Review.objects.for_product(product), Review.ORDERINGS[sort], settings.REVIEWS_PAGE_SIZE)
+    return paginator.page(cursor)
+
+def product_detail_context(request, product_id):
+    product = get_object_or_404(Product.objects.select_related('rating'), id=product_id)
+    # Only the first reviews are rendered, the rest are loaded from product_reviews
+    sort = review_sort(request)
     form = ReviewForm()
-    context = {
+    return {
         'product': product,
-        'reviews': reviews,
+        'reviews': paginate_reviews(product, sort),
+        'review_sort': sort,
         'form': form,
     }
-    return render(request, "core/product_detail.html", context)
+
+def product_detail(request, product_id):
+    return render(request, "core/product_detail.html", product_detail_context(request, product_id))
+
+def product_reviews(request, product_id):
+    try:
+        page = paginate_reviews(product_id, review_sort(request), request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    reviews = [
+        {
+            'id': review.id,
+            'user': review.user.get_short_name(),
+            'rating': review.rating,
+            'content': review.content or '',
+            'publish_date': review.publish_date.isoformat(),
+        }
+        for review in page
+    ]
+    return JsonResponse({'reviews': reviews, 'next_cursor': page.next_cursor})
 
 @login_required
 def review_submit(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_object_or_404(Product.objects.select_related('rating'), pk=product_id)
     form = ReviewForm(request.POST)
     if form.is_valid():
         review = form.save(commit=False)
         review.user = request.user
         review.product = product
-        review.save()
+        # The rating summary is updated by a signal, keep it in the same transaction
+        with transaction.atomic():
+            review.save()
 
         return redirect('core:product-detail', product_id=product_id)
     else:
-        reviews = Review.objects.filter(product=product)
         context = {
             'product': product,
-            'reviews': reviews,
+            'reviews': paginate_reviews(product, 'recent'),
+            'review_sort': 'recent',
             'form': form,
         }
         
@@ -93,197 +167,148 @@ def register(request):
         form = RegisterForm()    
         return render(request, "registration/register.html", {'form': form})
 
-def view_cart(request):
-    order, new_obj = Order.objects.new_or_get(request)
-    order_items = order.orderitem_set.all()
-    if order_items.exists():
-        context = {
-            'order_items': order_items,
+def cart_context(request):
+    backend = get_cart_backend()
+    items, total = backend.contents(request)
+    # Keeps the cart badge in step with the cart page, e.g. after the admin changed the order
+    backend.remember_summary(request, items, total)
+    if items:
+        return {
+            'order_items': items,
+            'order_total': total,
         }
-        return render(request, "core/cart.html", context)
-    return render(request, "core/cart.html")
-        
-def add_to_cart(request, product_id, redirect_url):
-    product = get_object_or_404(Product, pk=product_id)
-    order, new_obj = Order.objects.new_or_get(request)
+    return {}
 
-    order_item, created = OrderItem.objects.get_or_create(item=product, order=order)
-    if created:
-        messages.success(request, 'The item has been added to your cart.')
-    else:
-        # Order item exists, so update quantity
-        order_item.quantity += 1
-        messages.success(request, 'The item quantity in your cart has been updated.') 
-    order_item.save()
+def view_cart(request):
+    return render(request, "core/cart.html", cart_context(request))
 
+def add_item(request, product_id):
+    """Add a product to the request's cart, returning the message for the user."""
+    product = get_object_or_404(Product, pk=product_id)
+    backend = get_cart_backend()
+    added = backend.add(request, product)
+    backend.refresh_summary(request)
+    if added:
+        return 'The item has been added to your cart.'
+    return 'The item quantity in your cart has been updated.'
+
+def cart_redirect(product_id, redirect_url):
     if redirect_url == 'product-detail':
         return redirect('core:product-detail', product_id=product_id)
-    
     return redirect('core:cart')
 
-def remove_from_cart(request, product_id):
+def add_to_cart(request, product_id, redirect_url):
+    messages.success(request, add_item(request, product_id))
+    return cart_redirect(product_id, redirect_url)
+
+def remove_item(request, product_id, single=False):
+    """
+    Remove a product, or one of it if `single` is set, from the request's
+    cart and return the message for the user. Raises Http404 if the
+    product isn't in the cart.
+    """
     product = get_object_or_404(Product, pk=product_id)
-    order, new_obj = Order.objects.new_or_get(request)
-    order_item = get_object_or_404(OrderItem, item=product, order=order)
-    order_item.delete()
-    messages.success(request, 'The item has been removed from your cart.')
-    
+    backend = get_cart_backend()
+    if single:
+        removed = backend.remove_one(request, product)
+    else:
+        removed = True if backend.remove_all(request, product) else None
+    if removed is None:
+        raise Http404('The item is not in your cart.')
+    backend.refresh_summary(request)
+    if removed:
+        return 'The item has been removed from your cart.'
+    return 'The item quantity has been updated.'
+
+def remove_from_cart(request, product_id):
+    messages.success(request, remove_item(request, product_id))
     return redirect('core:cart')
 
 def remove_single_from_cart(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    order, new_obj = Order.objects.new_or_get(request)
-    order_item = get_object_or_404(OrderItem, item=product, order=order)
-    order_item.quantity -= 1
-    if order_item.quantity == 0:
-        # Remove the order item if the quantity is now 0
-        order_item.delete()
-        messages.success(request, 'The item has been removed from your cart.')
-    else:
-        order_item.save()
-        messages.success(request, 'The item quantity has been updated.')
-    
+    messages.success(request, remove_item(request, product_id, single=True))
     return redirect('core:cart')
 
 @login_required
 def checkout(request):
-    # TODO optimise this
-    order_qs = Order.objects.filter(user=request.user, is_active=True)
-    if order_qs.exists():
-        order = order_qs[0]
-        order_items_qs = OrderItem.objects.filter(order=order)
-        if order_items_qs.exists():
-            if request.method == 'POST':
-                # Check if address_id is None (this means the addresses radio value was not submitted, because the form disappears when new addres is selected), then create new address
-                address_id = request.POST.get('addresses')
-                if address_id is None:
-                    form = AddressForm(request.POST)
-                    # If the form data is valid then create new address
-                    if form.is_valid():
-                        address = form.save(commit=False)
-                        address.user = request.user
-                        address.save()
-                    else:
-                        existing_addresses = request.user.address_set.all()
-                        return render(request, "core/checkout.html", {
-                            'form': form,
-                            'existing_addresses': existing_addresses,
-                        })
+    order = get_cart_backend().checkout_order(request)
+    if order is not None:
+        if request.method == 'POST':
+            # Check if address_id is None (this means the addresses radio value was not submitted, because the form disappears when new addres is selected), then create new address
+            address_id = request.POST.get('addresses')
+            if address_id is None:
+                form = AddressForm(request.POST)
+                # If the form data is valid then create new address
+                if form.is_valid():
+                    address = form.save(commit=False)
+                    address.user = request.user
+                    address.save()
                 else:
-                    # If the address_id exists, then use that address for payment
-                    # TODO return form error instead of 404 maybe? or not... this can't happen if user does normal stuff..
-                    address = get_object_or_404(Address, pk=address_id)
-                    
-                payment = Payment(amount=order.total_price, address=address, order=order)
-                payment.save()
-                
-                # Prepare data to be submitted to PayFast
-                payment_data = {
-                    'merchant_id': settings.PAYFAST_MERCHANT_ID,
-                    'merchant_key': settings.PAYFAST_MERCHANT_KEY,
-                    'return_url': settings.PAYFAST_RETURN_URL,
-                    'cancel_url': settings.PAYFAST_CANCEL_URL,
-                    'notify_url': settings.PAYFAST_NOTIFY_URL,
-                    'name_first': address.name.strip(), #TODO improve client side validation, and when instance is saved, strip then...?
-                    'cell_number': address.mobile_number.strip(),
-                    'm_payment_id': payment.id,
-                    'amount': payment.amount,
-                    'item_name': payment.item_name,
-                    # 'email_confirmation': 1, 1=on 0=off
-                    # 'passphrase': settings.PAYFAST_PASSPHRASE,
-                }        
-                
-                # URL encode payment data and generate signature MD5 hash        
-                signature_string = urlencode(payment_data, quote_via=quote_plus)
-                signature = hashlib.md5(signature_string.encode())
-                payment_data['signature'] = signature.hexdigest()
-
-                # Render template showing payment methods
-                return render(request, "core/payments.html", {
-                    'payment_data': payment_data, 'payfast_url': settings.PAYFAST_URL,
+                    existing_addresses = request.user.address_set.all()
+                    return render(request, "core/checkout.html", {
+                        'form': form,
+                        'existing_addresses': existing_addresses,
                     })
-                
-            # If GET or any other method then create unbound form
             else:
-                # Check if user has existing address
-                existing_addresses = request.user.address_set.all()
-                form = AddressForm()
+                # If the address_id exists, then use that address for payment
+                # TODO return form error instead of 404 maybe? or not... this can't happen if user does normal stuff..
+                address = get_object_or_404(Address, pk=address_id)
                 
-            return render(request, "core/checkout.html", {
-                'form': form,
-                'existing_addresses': existing_addresses,
-            })
+            payment = Payment(amount=order.total_price, address=address, order=order)
+            payment.save()
+            
+            # Prepare the signed data to be submitted to PayFast
+            payment_data = payfast.payment_data(payment, address)
+
+            # Render template showing payment methods
+            return render(request, "core/payments.html", {
+                'payment_data': payment_data, 'payfast_url': settings.PAYFAST_URL,
+                })
+            
+        # If GET or any other method then create unbound form
         else:
-            return redirect('core:cart')
+            # Check if user has existing address
+            existing_addresses = request.user.address_set.all()
+            form = AddressForm()
+            
+        return render(request, "core/checkout.html", {
+            'form': form,
+            'existing_addresses': existing_addresses,
+        })
     else:
-        # TODO:If the order does not exist, maybe show a message?
+        # TODO:If the cart is empty, maybe show a message?
         return redirect('core:cart')
     
-#TODO only POST method.. 
 @csrf_exempt
+@require_http_methods(['POST'])
 def payment_notify(request):
-    # Return 200 Header to PayFast after 4 security checks:
-    payment_data = request.POST.dict() # TODO: Check if you can straight use QueryDict.urlencode()
-    payment = get_object_or_404(Payment, id=payment_data['m_payment_id'])
-    payment.status = 'S'
-    
-    # Security check 1: Verify signature
-    # payment_data['passphrase'] = settings.PAYFAST_PASSPHRASE
-    payfast_signature = payment_data.pop('signature')
-    signature_string = urlencode(payment_data, quote_via=quote_plus)
-    generated_signature = hashlib.md5(signature_string.encode()).hexdigest()
-    if payfast_signature != generated_signature:
-        # If they signatures are unequal, return the 200 Header to indicate that the page is reachable.
-        payment.status = 'U'
-    
-    # Security check 2: Verify the request is coming from a valid PayFast domain
-    valid_hosts = settings.PAYFAST_DOMAINS
-    request_host = request.headers['REFERER']
-    if not request_host in valid_hosts:
-        payment.status = 'U'
-    
-    # Security check 3: Confirm payment amount from PayFast is the same as amount in database
-    expected_amount = payment.amount
-    requested_amount = float(payment_data['amount_gross'])
-    if expected_amount != requested_amount: # TODO types...
-        payment.status = 'U'
-    
-    # Security check 4: Perform server request to confirm details
-    # payment_data['signature'] = generated_signature
-    # payfast_parameter = urlencode(payment_data, quote_via=quote_plus)
-    # r = requests.post(settings.PAYFAST_QUERY_URL, data=payfast_parameter)
-    # if r.content != 'VALID': # TODO make sure the r.content is correct way to go
-    #     payment.status = 'U'
-    
-    
-    payment.save()
-    if payment.status == 'S':
-        # Place order if payment is successful. TODO: Maybe change the business logic?
-        order = payment.order
-        order.placement_date = datetime.date.today()
-        order.is_active = False
-        order.save()
-
-        email_title = f'{payment.item_name} confirmation'
-        email_message = f'Dear {payment.order.user.username} \n\nYour order has been placed.'
-
-        # send_mail(email_title, email_message, settings.EMAIL_HOST_USER, ['berrieswebdev@gmail.com'], fail_silently=False)
-
-
-    # Return 200 Header for PayFast    
+    # Store the ITN and return 200 to PayFast straight away, process_payment_notifications does the checks
+    payment_queue.enqueue(request)
     return HttpResponse()
-    
+
 
 def payment_cancel(request):
-    print('cancelled')
-    # send_mail('Order payment cancelled', 'Your payment was cancelled. You can try again.', settings.EMAIL_HOST_USER, ['berrieswebdev@gmail.com'], fail_silently=False)
-    # TODO set payment to cancelled.
+    if request.user.is_authenticated:
+        payment = Payment.objects.filter(order__user=request.user, order__is_active=True, status='P').order_by('-id').first()
+        if payment is not None:
+            # The email is queued with the status change, send_outbox_emails sends it
+            with transaction.atomic():
+                if Payment.objects.filter(pk=payment.pk, status='P').update(status='C'):
+                    OutboxEmail.objects.enqueue(
+                        f'payment-cancelled:{payment.pk}',
+                        request.user.email,
+                        'Order payment cancelled',
+                        'Your payment was cancelled. You can try again.',
+                    )
     messages.error(request, 'The payment has been cancelled. If you still want to place the order, you need to complete payment.')
     return redirect('core:index')
 
 def payment_return(request):
-    print('returned')
-    # send_mail('Order confirmation', 'Your order has been placed.', settings.EMAIL_HOST_USER, ['berrieswebdev@gmail.com'], fail_silently=False)
+    # PayFast only sends the buyer back here once they paid, so the cart is
+    # empty for them, also before the ITN is processed and the order placed
+    backend = get_cart_backend()
+    if backend.summary_cart_id(request) is not None:
+        backend.store_summary(request, **EMPTY_CART_SUMMARY)
+    # The confirmation email is queued when the ITN is processed
     messages.success(request, 'The order has been placed. You will soon receive a payment confirmation email.')
     return redirect('core:index')
     
\ No newline at end of file
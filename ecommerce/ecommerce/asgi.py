@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+
+Set DJANGO_SETTINGS_MODULE to ecommerce.settings_asgi to serve the catalog
+and cart pages with the async views.
 """
 
 import os
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,6 +67,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.cart_summary',
             ],
         },
     },
@@ -81,6 +83,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests run on a file so that concurrent connections from threads see the same data
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -137,6 +153,91 @@ MESSAGE_TAGS = {
     message_constants.ERROR: 'danger',
 }
 
+# Number of products per page on the home and search pages
+CATALOG_PAGE_SIZE = 24
+
+# Number of reviews shown on the product page and loaded per "load more"
+REVIEWS_PAGE_SIZE = 10
+
+# Seconds rendered product cards and catalog pages stay in the cache. Their keys
+# are made of what they show, so a changed product never hits an old entry, in
+# any process, see core.catalog_cache.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Resized WebP and JPEG copies of product images, named after the image's content hash.
+# Heights are CSS pixels used by the templates and their 2x versions.
+PRODUCT_IMAGE_HEIGHTS = (100, 180, 200, 360)
+PRODUCT_IMAGE_QUALITY = 80
+PRODUCT_IMAGE_VARIANT_DIR = 'products/variants'
+
+# Cart storage, a dotted path to a backend in core.cart. The database backend
+# keeps carts as Order/OrderItem rows, the local and Redis ones only write them
+# there at checkout, and keep them for CART_TIMEOUT seconds after a change.
+CART_BACKEND = 'core.cart.DatabaseCartBackend'
+CART_REDIS_URL = 'redis://127.0.0.1:6379/0'
+CART_REDIS_TIMEOUT = 1
+CART_TIMEOUT = 60 * 60 * 24 * 30
+
+# Product search. SEARCH_BACKEND is a dotted path to a class in core.search,
+# when it is None the backend is chosen from the database vendor.
+SEARCH_BACKEND = None
+SEARCH_MAX_RESULTS = 1000
+
+# Typo tolerant fallback when a search has no exact matches. The trigram index
+# is loaded from TRIGRAM_SNAPSHOT_PATH (see build_trigram_snapshot) if the
+# snapshot is current, otherwise it is built from the database on first use.
+# Every process keeps its own index, and builds it again when a product title
+# was changed by another process, which it learns from the titles version in
+# the database (see core.models.CatalogVersion).
+FUZZY_SEARCH_MAX_RESULTS = 24
+TRIGRAM_SNAPSHOT_PATH = None
+
+# Search-as-you-type suggestions
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_MAX_RESULTS = 8
+
+# Maximum number of SQL queries per view, checked by core.middleware.QueryCountMiddleware
+# in DEBUG and asserted for every view in core/test_views.py. Views without an entry
+# are not checked. Set QUERY_BUDGET_RAISE to fail requests that go over budget
+# instead of logging a warning.
+QUERY_BUDGETS = {
+    'core:index': 3,
+    # Including the titles version read when falling back to the fuzzy index
+    'core:search': 5,
+    # The titles version, the suggestions come from the in-memory index
+    'core:autocomplete': 1,
+    'core:product-detail': 4,
+    'core:product-reviews': 1,
+    # Session, user and product (3), the review's insert and the update of the
+    # product's rating summary (2) in an atomic block, which runs as a savepoint
+    # in tests (2), and the insert of the summary for a product's first review,
+    # in a savepoint of its own (3)
+    'core:review-submit': 10,
+    # The cart views that change the cart write the badge's summary to the
+    # session, an update in an atomic block that runs as a savepoint in tests (3)
+    'core:cart': 8,
+    'core:cart-add': 12,
+    'core:cart-remove': 9,
+    'core:cart-remove-single': 9,
+    'core:checkout': 7,
+    'core:payment-notify': 2,
+    'core:payment-return': 4,
+    # Session, user and the pending payment (3), the payment's update in an
+    # atomic block, which runs as a savepoint in tests (3), and queueing the
+    # email, a get_or_create with a savepoint of its own (4)
+    'core:payment-cancel': 10,
+    'core:register': 2,
+    'core:login': 11,
+    'core:logout': 4,
+    'core:password_change': 2,
+    'core:password_change_done': 2,
+    'core:password_reset': 0,
+    'core:password_reset_done': 0,
+    'core:password_reset_confirm': 1,
+    'core:password_reset_complete': 0,
+}
+QUERY_BUDGET_RAISE = False
+
 # PayFast settings
 PAYFAST_URL = "https://sandbox.payfast.co.za/eng/process"
 PAYFAST_MERCHANT_ID = "secret"
@@ -153,9 +254,35 @@ PAYFAST_DOMAINS = [
 PAYFAST_PASSPHRASE = 'password'
 
 if DEBUG == True:
-    PAYFAST_QUERY_URL = 'https://sandbox.payfast.co.za/​eng/query/validate'
+    PAYFAST_QUERY_URL = 'https://sandbox.payfast.co.za/eng/query/validate'
 else:
-    PAYFAST_QUERY_URL = 'https://www.payfast.co.za/​eng/query/validate'
+    PAYFAST_QUERY_URL = 'https://www.payfast.co.za/eng/query/validate'
+# Security check 4 of the ITNs: ask PayFast to confirm it sent the notification
+PAYFAST_SERVER_VALIDATION = True
+# Seconds per attempt. Failed attempts are retried RETRIES times, waiting
+# BACKOFF seconds and doubling, over up to POOL_SIZE keep-alive connections.
+PAYFAST_VALIDATION_TIMEOUT = 10
+PAYFAST_VALIDATION_RETRIES = 3
+PAYFAST_VALIDATION_BACKOFF = 0.5
+PAYFAST_POOL_SIZE = 10
+
+# ITN queue, see process_payment_notifications. Failed attempts are retried
+# after RETRY_DELAY seconds, doubling every time, and notifications claimed by
+# a worker that hasn't finished them after LOCK_TIMEOUT seconds are reclaimed.
+PAYMENT_NOTIFICATION_MAX_ATTEMPTS = 5
+PAYMENT_NOTIFICATION_RETRY_DELAY = 30
+PAYMENT_NOTIFICATION_LOCK_TIMEOUT = 300
+
+# Email outbox, see send_outbox_emails. Same retry settings as the ITN queue,
+# and at most RATE_LIMIT emails are sent per second.
+OUTBOX_EMAIL_MAX_ATTEMPTS = 5
+OUTBOX_EMAIL_RETRY_DELAY = 60
+OUTBOX_EMAIL_LOCK_TIMEOUT = 300
+OUTBOX_EMAIL_RATE_LIMIT = 5
+
+# Threads the async views (core.async_views) run their database work in,
+# 0 runs it in the main thread like sync views. See settings_asgi.
+ASYNC_DB_THREADS = 10
 
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
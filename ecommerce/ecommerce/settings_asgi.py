@@ -0,0 +1,20 @@
+"""
+Settings for serving the store with an ASGI server, e.g.
+
+    DJANGO_SETTINGS_MODULE=ecommerce.settings_asgi uvicorn ecommerce.asgi:application
+
+The catalog and cart pages are served by the async views in
+core.async_views, whose database work runs in a pool of ASYNC_DB_THREADS
+threads. Each of those threads keeps its connection for CONN_MAX_AGE
+seconds, so the pool doubles as a connection pool.
+"""
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = 'ecommerce.urls_asgi'
+
+# QueryCountMiddleware is sync only, and would make Django run every async view in a thread
+MIDDLEWARE = [name for name in MIDDLEWARE if name != 'core.middleware.QueryCountMiddleware']
+
+ASYNC_DB_THREADS = 10
+
+DATABASES = {**DATABASES, 'default': {**DATABASES['default'], 'CONN_MAX_AGE': 60}}
@@ -0,0 +1,11 @@
+"""The URLs of ecommerce.urls, with the async views of core.async_urls. See settings_asgi."""
+from django.contrib import admin
+from django.urls import include, path
+from django.contrib.staticfiles.urls import static
+from . import settings
+
+urlpatterns = [
+    path('', include('core.async_urls')),
+    path('admin/', admin.site.urls),
+]
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)